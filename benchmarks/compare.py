@@ -0,0 +1,65 @@
+"""
+Compares two `benchmarks.run` result files.
+
+Usage:
+    python -m benchmarks.compare BASELINE.json CANDIDATE.json
+"""
+import argparse
+import json
+
+
+METRICS = ("p50_ms", "p95_ms", "p99_ms", "throughput_rps")
+
+
+def compare(baseline, candidate):
+    """
+    Returns rows of `(target, lane_type, metric, baseline, candidate,
+    change)`, where change is the relative difference, for every target and
+    lane type present in both results.
+    """
+    rows = []
+    for target, lane_types in sorted(candidate["results"].items()):
+        baseline_lane_types = baseline["results"].get(target, {})
+        for lane_type, summary in sorted(lane_types.items()):
+            baseline_summary = baseline_lane_types.get(lane_type)
+            if baseline_summary is None:
+                continue
+            for metric in METRICS:
+                old = baseline_summary.get(metric)
+                new = summary.get(metric)
+                change = (new - old) / old if old and new is not None else None
+                rows.append((target, lane_type, metric, old, new, change))
+    return rows
+
+
+def _format_value(value):
+    return "-" if value is None else "{:.2f}".format(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare benchmark results.")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    print("{:<6} {:<14} {:<15} {:>12} {:>12} {:>9}".format(
+        "target", "lanes", "metric", "baseline", "candidate", "change"
+    ))
+    for target, lane_type, metric, old, new, change in compare(baseline, candidate):
+        print("{:<6} {:<14} {:<15} {:>12} {:>12} {:>9}".format(
+            target,
+            lane_type,
+            metric,
+            _format_value(old),
+            _format_value(new),
+            "-" if change is None else "{:+.1%}".format(change),
+        ))
+
+
+if __name__ == "__main__":
+    main()
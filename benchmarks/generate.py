@@ -0,0 +1,237 @@
+"""
+Synthetic benchmark dataset.
+
+Generates a region tree (`--top-regions` roots, `--depth` levels, `--fanout`
+children per region), `--ports` ports attached to non-root regions and
+`--rows` prices over `--days` days. Prices are concentrated on `--lanes`
+lanes between hub-weighted ports, like the real data, and loaded with `COPY`
+through `ratestask.ingest` in transactions of `--batch-rows` rows.
+
+Usage:
+    python -m benchmarks.generate [--database-uri URI] [--truncate]
+                                  [--rows N] [--ports N] [--lanes N] ...
+"""
+import argparse
+import itertools
+import logging
+import os
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+
+from ratestask.ingest import ingest_chunks
+
+
+logger = logging.getLogger(__name__)
+
+_PORT_CODE_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+def port_code(index):
+    """
+    Returns a 5 letter, UN/LOCODE-like code for the given port index.
+    """
+    letters = []
+    for _ in range(5):
+        index, remainder = divmod(index, len(_PORT_CODE_ALPHABET))
+        letters.append(_PORT_CODE_ALPHABET[remainder])
+    return "".join(reversed(letters))
+
+
+def generate_hierarchy(top_regions=6, depth=3, fanout=4, ports=2000, seed=0):
+    """
+    Returns `(regions, ports)` as lists of `(slug, name, parent_slug)` and
+    `(code, name, parent_slug)` tuples.
+    """
+    rng = np.random.default_rng(seed)
+
+    regions = []
+    level = []
+    for i in range(top_regions):
+        slug = "region_{}".format(i)
+        regions.append((slug, "Region {}".format(i), None))
+        level.append(slug)
+
+    parents = []
+    for _ in range(depth - 1):
+        children = []
+        for parent in level:
+            for i in range(fanout):
+                slug = "{}_{}".format(parent, i)
+                regions.append((slug, slug.replace("_", " ").title(), parent))
+                children.append(slug)
+        parents.extend(children)
+        level = children
+
+    # Ports hang off any non-root region, mostly off the leaves.
+    parents = parents or [slug for slug, _, _ in regions]
+    leaves = set(level)
+    weights = np.array([4.0 if slug in leaves else 1.0 for slug in parents])
+    parent_indexes = rng.choice(
+        len(parents), size=ports, p=weights / weights.sum()
+    )
+    port_rows = [
+        (port_code(i), "Port {}".format(i), parents[parent_index])
+        for i, parent_index in enumerate(parent_indexes)
+    ]
+    return regions, port_rows
+
+
+def iter_price_chunks(
+    port_codes,
+    rows,
+    lanes=20000,
+    days=365,
+    start_date=date(2021, 1, 1),
+    chunk_size=100000,
+    seed=0
+):
+    """
+    Yields lists of `(orig_code, dest_code, day, price)` rows, `rows` in total.
+
+    Port popularity follows a Zipf-like distribution, so a few hub ports
+    appear on many lanes, and lane volumes are skewed the same way.
+    """
+    rng = np.random.default_rng(seed)
+    n_ports = len(port_codes)
+    codes = np.array(port_codes, dtype=object)
+
+    port_weights = 1.0 / np.arange(1, n_ports + 1)
+    port_weights /= port_weights.sum()
+    orig = rng.choice(n_ports, size=lanes, p=port_weights)
+    dest = rng.choice(n_ports, size=lanes, p=port_weights)
+    dest = np.where(orig == dest, (dest + 1) % n_ports, dest)
+    base_price = rng.integers(300, 5000, size=lanes)
+
+    lane_weights = 1.0 / np.arange(1, lanes + 1) ** 0.8
+    lane_weights /= lane_weights.sum()
+    day_strings = np.array(
+        [(start_date + timedelta(days=i)).isoformat() for i in range(days)],
+        dtype=object,
+    )
+
+    remaining = rows
+    while remaining > 0:
+        size = min(chunk_size, remaining)
+        lane = rng.choice(lanes, size=size, p=lane_weights)
+        price = (
+            base_price[lane] * rng.lognormal(0.0, 0.15, size=size)
+        ).astype(np.int64)
+        day = rng.integers(0, days, size=size)
+        yield list(zip(
+            codes[orig[lane]].tolist(),
+            codes[dest[lane]].tolist(),
+            day_strings[day].tolist(),
+            price.tolist(),
+        ))
+        remaining -= size
+
+
+def load_hierarchy(db_conn, regions, ports):
+    with db_conn:
+        with db_conn.cursor() as db_cursor:
+            # Parents are generated before their children.
+            execute_values(
+                db_cursor,
+                "INSERT INTO regions (slug, name, parent_slug) VALUES %s",
+                regions,
+            )
+            execute_values(
+                db_cursor,
+                "INSERT INTO ports (code, name, parent_slug) VALUES %s",
+                ports,
+            )
+
+
+def truncate(db_conn):
+    with db_conn:
+        with db_conn.cursor() as db_cursor:
+            db_cursor.execute("TRUNCATE prices, ports, regions")
+
+
+def _batches(chunks, chunks_per_batch):
+    """
+    Lazily groups chunks into batches, each loaded in its own transaction.
+    Every batch must be consumed before the next one is requested.
+    """
+    chunks = iter(chunks)
+    for first in chunks:
+        yield itertools.chain(
+            [first], itertools.islice(chunks, chunks_per_batch - 1)
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate benchmark data.")
+    parser.add_argument(
+        "--database-uri",
+        default=os.getenv("DATABASE_URI"),
+        help="Postgres connection URI (default: $DATABASE_URI)",
+    )
+    parser.add_argument(
+        "--truncate",
+        action="store_true",
+        help="Delete all prices, ports and regions first",
+    )
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--ports", type=int, default=2000)
+    parser.add_argument("--lanes", type=int, default=20000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--top-regions", type=int, default=6)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fanout", type=int, default=4)
+    parser.add_argument("--chunk-size", type=int, default=100000)
+    parser.add_argument("--batch-rows", type=int, default=5000000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    db_conn = psycopg2.connect(args.database_uri)
+    try:
+        if args.truncate:
+            truncate(db_conn)
+
+        regions, ports = generate_hierarchy(
+            top_regions=args.top_regions,
+            depth=args.depth,
+            fanout=args.fanout,
+            ports=args.ports,
+            seed=args.seed,
+        )
+        load_hierarchy(db_conn, regions, ports)
+        logger.info("Loaded %d regions and %d ports", len(regions), len(ports))
+
+        chunks = iter_price_chunks(
+            [code for code, _, _ in ports],
+            args.rows,
+            lanes=args.lanes,
+            days=args.days,
+            chunk_size=args.chunk_size,
+            seed=args.seed,
+        )
+        started = time.monotonic()
+        loaded = 0
+        chunks_per_batch = max(1, args.batch_rows // args.chunk_size)
+        for batch in _batches(chunks, chunks_per_batch):
+            result = ingest_chunks(db_conn, batch)
+            loaded += result.rows_loaded
+            logger.info(
+                "Loaded %d/%d prices (%.0f rows/s)",
+                loaded,
+                args.rows,
+                loaded / (time.monotonic() - started),
+            )
+
+        with db_conn:
+            with db_conn.cursor() as db_cursor:
+                db_cursor.execute("ANALYZE prices")
+                db_cursor.execute("ANALYZE daily_lane_stats")
+    finally:
+        db_conn.close()
+
+
+if __name__ == "__main__":
+    main()
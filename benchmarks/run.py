@@ -0,0 +1,383 @@
+"""
+Concurrent load benchmark of the rates lookup.
+
+Builds a workload of port-to-port, port-to-region and region-to-region
+lanes from the data in the database (see `benchmarks.generate`), then runs
+it with `--concurrency` threads against:
+
+    db   `DBAPI.fetch_avg_rates` (or the columnar backend with
+         `--backend columnar`)
+    api  the `/rates` endpoint, either of a running server (`--url`) or of an
+         in-process app
+
+and writes p50/p95/p99 latencies and throughput per lane type as JSON.
+
+Usage:
+    python -m benchmarks.run [--database-uri URI] [--targets db,api]
+                             [--concurrency N] [--duration S] [--output FILE]
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+import psycopg2
+
+from ratestask.app import create_app
+from ratestask.columnar import ColumnarDBAPI
+from ratestask.db import DBAPI, PLAN_CACHE_MODES
+
+
+RESULTS_VERSION = 1
+LANE_TYPES = ("port_port", "port_region", "region_region")
+
+
+def percentile(sorted_values, p):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    rank = max(0, math.ceil(p / 100.0 * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+def summarize(samples, elapsed):
+    """
+    Returns latency percentiles (in milliseconds) and throughput of a list of
+    `(lane_type, seconds, ok)` samples, overall and per lane type.
+    """
+    groups = {"all": samples}
+    for lane_type in LANE_TYPES:
+        groups[lane_type] = [
+            sample for sample in samples if sample[0] == lane_type
+        ]
+
+    summary = {}
+    for name, group in groups.items():
+        latencies = sorted(seconds * 1000.0 for _, seconds, _ in group)
+        summary[name] = {
+            "count": len(group),
+            "errors": sum(1 for _, _, ok in group if not ok),
+            "throughput_rps": len(group) / elapsed if elapsed else 0.0,
+            "mean_ms": sum(latencies) / len(latencies) if latencies else None,
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "max_ms": latencies[-1] if latencies else None,
+        }
+    return summary
+
+
+def _ancestors(parents, slug):
+    ancestors = []
+    seen = set()
+    while slug is not None and slug not in seen:
+        seen.add(slug)
+        ancestors.append(slug)
+        slug = parents.get(slug)
+    return ancestors
+
+
+def build_workload(db_cursor, size=1000, span_days=(7, 90), seed=0):
+    """
+    Returns `size` queries, dicts of `lane_type`, `date_from`, `date_to`,
+    `origin` and `destination`, spread evenly over the lane types.
+
+    Port-to-port lanes are sampled from lanes that have prices, region lanes
+    replace either end with one of the port's ancestor regions.
+    """
+    rng = random.Random(seed)
+
+    db_cursor.execute("SELECT slug, parent_slug FROM regions")
+    region_parents = dict(db_cursor.fetchall())
+    db_cursor.execute("SELECT code, parent_slug FROM ports")
+    port_parents = dict(db_cursor.fetchall())
+    db_cursor.execute("SELECT MIN(day), MAX(day) FROM daily_lane_stats")
+    first_day, last_day = db_cursor.fetchone()
+    db_cursor.execute(
+        "SELECT DISTINCT orig_code, dest_code FROM daily_lane_stats"
+    )
+    lanes = db_cursor.fetchall()
+    if not lanes:
+        raise ValueError("No prices to build a workload from")
+
+    def region_of(code):
+        return rng.choice(_ancestors(region_parents, port_parents[code]))
+
+    total_days = (last_day - first_day).days
+    queries = []
+    for i in range(size):
+        lane_type = LANE_TYPES[i % len(LANE_TYPES)]
+        orig_code, dest_code = rng.choice(lanes)
+        origin = orig_code
+        destination = dest_code
+        if lane_type in ("port_region", "region_region"):
+            destination = region_of(dest_code)
+        if lane_type == "region_region":
+            origin = region_of(orig_code)
+
+        span = min(rng.randint(*span_days), total_days)
+        date_from = first_day + timedelta(days=rng.randint(0, total_days - span))
+        queries.append({
+            "lane_type": lane_type,
+            "date_from": date_from.isoformat(),
+            "date_to": (date_from + timedelta(days=span)).isoformat(),
+            "origin": origin,
+            "destination": destination,
+        })
+    return queries
+
+
+def run_load(call, queries, concurrency=8, duration=30.0, warmup=2.0):
+    """
+    Runs `call(query)` from `concurrency` threads, cycling through the
+    queries, for `warmup` seconds (not recorded) and then `duration`
+    seconds. Returns `(samples, elapsed)`.
+    """
+    lock = threading.Lock()
+    next_index = itertools.count()
+    samples = []
+    started = time.monotonic()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+
+    def worker():
+        local_samples = []
+        while True:
+            with lock:
+                index = next(next_index)
+            query = queries[index % len(queries)]
+
+            request_started = time.monotonic()
+            if request_started >= stop_at:
+                break
+            try:
+                call(query)
+                ok = True
+            except Exception:
+                ok = False
+            if request_started >= measure_from:
+                local_samples.append(
+                    (query["lane_type"], time.monotonic() - request_started, ok)
+                )
+        with lock:
+            samples.extend(local_samples)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return samples, max(time.monotonic(), stop_at) - measure_from
+
+
+def _db_caller(db):
+    def call(query):
+        db.fetch_avg_rates(
+            query["date_from"],
+            query["date_to"],
+            query["origin"],
+            query["destination"],
+        )
+    return call
+
+
+def _http_caller(url):
+    def call(query):
+        params = {
+            key: value for key, value in query.items() if key != "lane_type"
+        }
+        with urllib.request.urlopen(
+            "{}/rates?{}".format(url.rstrip("/"), urlencode(params))
+        ) as response:
+            response.read()
+    return call
+
+
+def _app_caller(app):
+    local = threading.local()
+
+    def call(query):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = app.test_client()
+        params = {
+            key: value for key, value in query.items() if key != "lane_type"
+        }
+        response = client.get("/rates", query_string=params)
+        if response.status_code != 200:
+            raise RuntimeError(response.status)
+    return call
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _dataset_info(db_cursor):
+    info = {}
+    for table in ("regions", "ports", "prices", "daily_lane_stats"):
+        db_cursor.execute(
+            "SELECT reltuples::bigint FROM pg_class WHERE relname = %s",
+            (table,),
+        )
+        row = db_cursor.fetchone()
+        info["{}_rows".format(table)] = row[0] if row else None
+    return info
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark rates lookups.")
+    parser.add_argument(
+        "--database-uri",
+        default=os.getenv("DATABASE_URI"),
+        help="Postgres connection URI (default: $DATABASE_URI)",
+    )
+    parser.add_argument(
+        "--targets",
+        default="db,api",
+        help="Comma separated targets to run: db, api",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=("postgres", "columnar"),
+        default="postgres",
+        help="Rates backend of the db target and the in-process app",
+    )
+    parser.add_argument(
+        "--no-prepare",
+        action="store_true",
+        help="Send the rates query as text instead of a prepared statement",
+    )
+    parser.add_argument(
+        "--plan-cache-mode",
+        choices=PLAN_CACHE_MODES,
+        help="Postgres plan_cache_mode of the pooled connections",
+    )
+    parser.add_argument(
+        "--url",
+        help="Base URL of a running server for the api target "
+             "(default: an in-process app)",
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--queries", type=int, default=3000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output",
+        help="File to write the results to (default: stdout)",
+    )
+    args = parser.parse_args(argv)
+
+    targets = [target for target in args.targets.split(",") if target]
+    db_conn = psycopg2.connect(args.database_uri)
+    try:
+        with db_conn.cursor() as db_cursor:
+            queries = build_workload(
+                db_cursor, size=args.queries, seed=args.seed
+            )
+            dataset = _dataset_info(db_cursor)
+    finally:
+        db_conn.close()
+
+    results = {}
+    for target in targets:
+        if target == "db":
+            db_class = ColumnarDBAPI if args.backend == "columnar" else DBAPI
+            db = db_class(
+                args.database_uri,
+                pool_max_size=args.concurrency,
+                prepare_statements=not args.no_prepare,
+                plan_cache_mode=args.plan_cache_mode,
+            )
+            db.warm_up()
+            try:
+                samples, elapsed = run_load(
+                    _db_caller(db),
+                    queries,
+                    concurrency=args.concurrency,
+                    duration=args.duration,
+                    warmup=args.warmup,
+                )
+            finally:
+                db.close()
+        elif target == "api" and args.url:
+            samples, elapsed = run_load(
+                _http_caller(args.url),
+                queries,
+                concurrency=args.concurrency,
+                duration=args.duration,
+                warmup=args.warmup,
+            )
+        elif target == "api":
+            app = create_app({
+                "DATABASE_URI": args.database_uri,
+                "DB_POOL_MAX_SIZE": args.concurrency,
+                "RATES_BACKEND": args.backend,
+                "DB_PREPARE_STATEMENTS": not args.no_prepare,
+                "DB_PLAN_CACHE_MODE": args.plan_cache_mode,
+                "RATES_CACHE_SIZE": 0,
+                "PRELOAD": True,
+            })
+            try:
+                samples, elapsed = run_load(
+                    _app_caller(app),
+                    queries,
+                    concurrency=args.concurrency,
+                    duration=args.duration,
+                    warmup=args.warmup,
+                )
+            finally:
+                app.db.close()
+        else:
+            parser.error("Unknown target: {}".format(target))
+
+        results[target] = summarize(samples, elapsed)
+
+    report = {
+        "version": RESULTS_VERSION,
+        "started_at": datetime.utcnow().isoformat() + "Z",
+        "git_commit": _git_commit(),
+        "config": {
+            "backend": args.backend,
+            "prepare_statements": not args.no_prepare,
+            "plan_cache_mode": args.plan_cache_mode,
+            "url": args.url,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "queries": args.queries,
+            "seed": args.seed,
+        },
+        "dataset": dataset,
+        "results": results,
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        sys.stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
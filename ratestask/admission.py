@@ -0,0 +1,153 @@
+import threading
+import time
+from functools import wraps
+
+from flask import Response, current_app as app
+
+
+# Query cost classes, from port-to-port lanes over a short span to
+# region-to-region lanes over a long one.
+COST_CLASSES = ("light", "medium", "heavy")
+
+# Spans of more days than this raise the cost class.
+WIDE_SPAN_DAYS = 92
+
+
+def cost_class(origin_is_port, destination_is_port, days):
+    """
+    Cost class of a rates query: a port-to-port lane over at most
+    `WIDE_SPAN_DAYS` days is light, each region end and a wider span raise
+    the class by one, up to heavy.
+    """
+    score = (not origin_is_port) + (not destination_is_port) + (
+        days > WIDE_SPAN_DAYS
+    )
+    return COST_CLASSES[min(score, len(COST_CLASSES) - 1)]
+
+
+class Overloaded(Exception):
+    """
+    Raised when a request is shed, clients should retry after `retry_after`
+    seconds.
+    """
+
+    def __init__(self, message, retry_after):
+        super(Overloaded, self).__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController(object):
+    """
+    Bounds the number of requests running at once to `max_in_flight`.
+    Further requests wait, at most `max_queue` of them and for at most
+    `queue_timeout` seconds, before they are shed with `Overloaded`.
+    """
+
+    def __init__(
+        self,
+        max_in_flight=10,
+        max_queue=20,
+        queue_timeout=0.5,
+        retry_after=1
+    ):
+        if max_in_flight < 1 or max_queue < 0:
+            raise ValueError(
+                "Invalid admission limits: in flight={}, queue={}".format(
+                    max_in_flight, max_queue
+                )
+            )
+
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._waiting = 0
+
+        self._admitted = 0
+        self._queued = 0
+        self._rejected = 0
+        self._timeouts = 0
+
+    def acquire(self):
+        """
+        Admits a request, waiting for a free slot if needed. Raises
+        `Overloaded` when the queue is full or the wait timed out.
+        """
+        with self._cond:
+            if self._in_flight >= self.max_in_flight:
+                if self._waiting >= self.max_queue:
+                    self._rejected += 1
+                    raise Overloaded(
+                        "Too many requests in flight", self.retry_after
+                    )
+
+                self._waiting += 1
+                self._queued += 1
+                deadline = time.monotonic() + self.queue_timeout
+                try:
+                    while self._in_flight >= self.max_in_flight:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._timeouts += 1
+                            raise Overloaded(
+                                "No request slot available within {}s".format(
+                                    self.queue_timeout
+                                ),
+                                self.retry_after,
+                            )
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            self._in_flight += 1
+            self._admitted += 1
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "max_in_flight": self.max_in_flight,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "waiting": self._waiting,
+                "admitted": self._admitted,
+                "queued": self._queued,
+                "rejected": self._rejected,
+                "timeouts": self._timeouts,
+            }
+
+
+def admitted(func):
+    """
+    Decorator running an API handler under the app's admission control
+    (`app.admission`), if any, until its response is written when streamed.
+    """
+    @wraps(func)
+    def decorated(*args, **kwargs):
+        admission = app.admission
+        if admission is None:
+            return func(*args, **kwargs)
+
+        admission.acquire()
+        try:
+            response = func(*args, **kwargs)
+        except BaseException:
+            admission.release()
+            raise
+
+        if isinstance(response, Response) and response.is_streamed:
+            # Streamed responses keep querying while they are written, so
+            # the slot is held until the response is closed.
+            response.call_on_close(admission.release)
+        else:
+            admission.release()
+        return response
+
+    return decorated
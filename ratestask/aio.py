@@ -0,0 +1,218 @@
+"""
+asyncio variant of the rates API, serving `/rates` with aiohttp on an
+asyncpg connection pool, so a single process can keep many requests in
+flight while Postgres is busy.
+
+Usage:
+    python ratestask/aio.py [--host HOST] [--port PORT]
+"""
+import argparse
+import asyncio
+from os import getenv
+
+import asyncpg
+from aiohttp import web
+from voluptuous import MultipleInvalid
+
+from ratestask.api import format_rates
+from ratestask.db import AVG_RATES_QUERIES, avg_rates_params, to_numbered_params
+from ratestask.hierarchy import PORTS_QUERY, REGIONS_QUERY, RegionHierarchy
+from ratestask.validator import rates_lane_schema
+
+
+class AsyncDBAPI(object):
+    """
+    Async counterpart of `DBAPI`, running the same rates query on an
+    asyncpg pool. asyncpg has no maximum connection age: connections are
+    closed after `pool_max_idle` seconds unused instead.
+    """
+
+    def __init__(
+        self,
+        db_uri,
+        pool_min_size=1,
+        pool_max_size=10,
+        pool_timeout=30.0,
+        pool_max_idle=300.0,
+        hierarchy_ttl=300.0,
+        hierarchy_miss_reload_interval=1.0
+    ):
+        self.db_uri = db_uri
+        self.pool_min_size = pool_min_size
+        self.pool_max_size = pool_max_size
+        self.pool_timeout = pool_timeout
+        self.pool_max_idle = pool_max_idle
+        self.pool = None
+
+        self.hierarchy = RegionHierarchy(
+            ttl=hierarchy_ttl,
+            miss_reload_interval=hierarchy_miss_reload_interval,
+        )
+        self._hierarchy_lock = None
+
+    async def open(self):
+        # Created here to be bound to the running event loop.
+        self._hierarchy_lock = asyncio.Lock()
+        self.pool = await asyncpg.create_pool(
+            self.db_uri,
+            min_size=self.pool_min_size,
+            max_size=self.pool_max_size,
+            max_inactive_connection_lifetime=self.pool_max_idle,
+        )
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def refresh_hierarchy(self, db_conn):
+        regions = await db_conn.fetch(REGIONS_QUERY)
+        ports = await db_conn.fetch(PORTS_QUERY)
+        return self.hierarchy.load(
+            [tuple(row) for row in regions], [tuple(row) for row in ports]
+        )
+
+    async def _refresh_if(self, db_conn, is_stale):
+        async with self._hierarchy_lock:
+            index = self.hierarchy.index
+            if index is None or is_stale():
+                index = await self.refresh_hierarchy(db_conn)
+        return index
+
+    async def resolve(self, db_conn, code_or_slug):
+        """
+        Async counterpart of `RegionHierarchy.resolve`.
+        """
+        hierarchy = self.hierarchy
+        index = hierarchy.index
+        if index is None or hierarchy.is_expired():
+            index = await self._refresh_if(db_conn, hierarchy.is_expired)
+
+        codes = index.get(code_or_slug)
+        if codes is None and hierarchy.may_reload_on_miss():
+            index = await self._refresh_if(db_conn, hierarchy.may_reload_on_miss)
+            codes = index.get(code_or_slug)
+
+        return codes or frozenset()
+
+    async def fetch_avg_rates(
+        self,
+        start_date,
+        end_date,
+        origin,
+        destination,
+        min_price_count=3,
+        granularity="day"
+    ):
+        """
+        Fetches daily average price rates, see `DBAPI.get_avg_rates`.
+        """
+        async with self.pool.acquire(timeout=self.pool_timeout) as db_conn:
+            origin_codes = await self.resolve(db_conn, origin)
+            destination_codes = await self.resolve(db_conn, destination)
+            if not origin_codes or not destination_codes:
+                return []
+
+            query, args = to_numbered_params(
+                AVG_RATES_QUERIES[granularity],
+                avg_rates_params(
+                    start_date,
+                    end_date,
+                    origin_codes,
+                    destination_codes,
+                    min_price_count
+                )
+            )
+            rows = await db_conn.fetch(query, *args)
+        return [(day, average_price) for day, average_price in rows]
+
+
+routes = web.RouteTableDef()
+
+
+@routes.get("/rates")
+async def get_rates(request):
+    """
+    API handler for fetching daily average price rates between origin
+    and destination port/region.
+    """
+    input_args = dict(request.query)
+    try:
+        validated_args = rates_lane_schema(input_args)
+    except MultipleInvalid as e:
+        return web.json_response(
+            {
+                "message": "Bad Request",
+                "args": input_args,
+                "errors": [str(error) for error in e.errors],
+            },
+            status=400,
+        )
+
+    try:
+        rates = await request.app["db"].fetch_avg_rates(
+            validated_args["date_from"],
+            validated_args["date_to"],
+            validated_args["origin"],
+            validated_args["destination"],
+            granularity=validated_args.get("granularity", "day"),
+        )
+    except asyncio.TimeoutError as e:
+        return web.json_response(
+            {"message": "Service Unavailable", "errors": [str(e)]},
+            status=503,
+        )
+
+    return web.json_response(format_rates(rates))
+
+
+def create_aio_app(config=None):
+    config = config or {}
+    app = web.Application()
+    app["config"] = config
+    app["db"] = AsyncDBAPI(
+        config.get("DATABASE_URI"),
+        pool_min_size=config.get("DB_POOL_MIN_SIZE", 1),
+        pool_max_size=config.get("DB_POOL_MAX_SIZE", 10),
+        pool_timeout=config.get("DB_POOL_TIMEOUT", 30.0),
+        pool_max_idle=config.get("DB_POOL_MAX_IDLE", 300.0),
+        hierarchy_ttl=config.get("HIERARCHY_TTL", 300.0),
+        hierarchy_miss_reload_interval=config.get(
+            "HIERARCHY_MISS_RELOAD_INTERVAL", 1.0
+        ),
+    )
+    app.add_routes(routes)
+
+    async def open_db(app):
+        await app["db"].open()
+
+    async def close_db(app):
+        await app["db"].close()
+
+    app.on_startup.append(open_db)
+    app.on_cleanup.append(close_db)
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the async rates API.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=80)
+    args = parser.parse_args(argv)
+
+    app = create_aio_app({
+        "DATABASE_URI": getenv("DATABASE_URI"),
+        "DB_POOL_MIN_SIZE": int(getenv("DB_POOL_MIN_SIZE", 1)),
+        "DB_POOL_MAX_SIZE": int(getenv("DB_POOL_MAX_SIZE", 10)),
+        "DB_POOL_TIMEOUT": float(getenv("DB_POOL_TIMEOUT", 30.0)),
+        "DB_POOL_MAX_IDLE": float(getenv("DB_POOL_MAX_IDLE", 300.0)),
+        "HIERARCHY_TTL": float(getenv("HIERARCHY_TTL", 300.0)),
+        "HIERARCHY_MISS_RELOAD_INTERVAL": float(
+            getenv("HIERARCHY_MISS_RELOAD_INTERVAL", 1.0)
+        ),
+    })
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
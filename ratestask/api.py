@@ -1,45 +1,260 @@
+import functools
+import itertools
+
+import psycopg2.errors
 from flask import (
     Blueprint,
+    Response,
     current_app as app,
     jsonify,
 )
-from ratestask.validator import validate_rates_inputs
+from ratestask.admission import Overloaded, admitted
+from ratestask.cache import cached_response
+from ratestask.metrics import labelled_by_lane, phase
+from ratestask.pool import PoolTimeout
+from ratestask.serializers import (
+    JSON_MIMETYPE,
+    SERIALIZERS,
+    negotiated,
+    rates_columns,
+)
+from ratestask.validator import (
+    rates_lane_schema,
+    validate_rates_batch_inputs,
+    validate_rates_inputs,
+)
 
 
 api = Blueprint("api", __name__)
 
 
+@api.errorhandler(PoolTimeout)
+def handle_pool_timeout(e):
+    return jsonify(message="Service Unavailable", errors=[str(e)]), 503
+
+
+@api.errorhandler(Overloaded)
+def handle_overloaded(e):
+    response = jsonify(message="Service Unavailable", errors=[str(e)])
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response, 503
+
+
+@api.errorhandler(psycopg2.errors.QueryCanceled)
+def handle_query_canceled(e):
+    # Statement timeout of the query's cost class, see DBAPI.
+    response = jsonify(
+        message="Service Unavailable",
+        errors=["Query took too long, retry later or narrow the date range"],
+    )
+    response.headers["Retry-After"] = str(app.config.get("RETRY_AFTER", 1))
+    return response, 503
+
+
 @api.route("/rates", methods=["GET"])
 @validate_rates_inputs
-def get_rates(date_from, date_to, origin, destination):
+@labelled_by_lane
+@negotiated
+@cached_response
+@admitted
+def get_rates(
+    date_from,
+    date_to,
+    origin,
+    destination,
+    stream=False,
+    granularity="day",
+    stats=(),
+    mimetype=JSON_MIMETYPE
+):
     """
     API handler for fetching daily average price rates between origin
-    and destination port/region.
+    and destination port/region, in the format negotiated from the `Accept`
+    header. With a `week` or `month` granularity, rates are averaged per
+    bucket instead, and `stats` adds price percentiles to every row. With
+    `stream` set, rates are read through a server-side cursor and written as
+    a chunked response (JSON and CSV only).
     """
-    db_conn = app.db.get_db_conn()
-    db_cursor = db_conn.cursor()
-
-    # TODO: Implement DB connection pool to reuse DB connections - avoid
-    # establishing DB connection for every request.
+    dump, stream_dump = SERIALIZERS[mimetype]
+    if stream and stream_dump is not None:
+        return _stream_rates(
+            app.db.iter_avg_rates(
+                date_from,
+                date_to,
+                origin,
+                destination,
+                granularity=granularity,
+                stats=stats,
+            ),
+            functools.partial(stream_dump, stats=stats),
+            mimetype,
+        )
 
-    rates = app.db.get_avg_rates(
-        db_cursor,
+    rates = app.db.fetch_avg_rates(
         date_from,
         date_to,
         origin,
-        destination
+        destination,
+        granularity=granularity,
+        stats=stats,
     )
-    db_conn.close()
+    with phase("serialize"):
+        return Response(dump(*rates_columns(rates, stats)), mimetype=mimetype)
 
-    return jsonify(
+
+@api.route("/rates/batch", methods=["POST"])
+@validate_rates_batch_inputs
+@admitted
+def get_rates_batch(lanes):
+    """
+    API handler for fetching daily average price rates of many lanes in one
+    request. Results are keyed by the lane `id` if given, otherwise by
+    `<origin>:<destination>:<date_from>:<date_to>` (followed by
+    `:<granularity>` unless it is `day`).
+    """
+    results = app.db.fetch_batch_avg_rates(
         [
+            (
+                lane["date_from"],
+                lane["date_to"],
+                lane["origin"],
+                lane["destination"],
+                lane.get("granularity", "day"),
+            )
+            for lane in lanes
+        ]
+    )
+
+    with phase("serialize"):
+        return jsonify(
             {
-                "day": day.strftime("%Y-%m-%d"),
-                "average_price": (
-                    round(float(avg_price), 3)
-                    if avg_price is not None else None
-                )
+                _lane_key(lane): format_rates(rates)
+                for lane, rates in zip(lanes, results)
             }
-            for day, avg_price in rates
-        ]
+        )
+
+
+@api.route("/rates/matrix", methods=["GET"])
+@validate_rates_inputs(schema=rates_lane_schema)
+@labelled_by_lane
+@cached_response
+@admitted
+def get_rates_matrix(
+    date_from,
+    date_to,
+    origin,
+    destination,
+    granularity=None
+):
+    """
+    API handler for fetching the average price of every lane (port pair)
+    between an origin and a destination port/region over the date range, or
+    with a granularity per lane and day/week/month bucket. Lanes without
+    prices are omitted.
+    """
+    rows = app.db.fetch_lane_matrix(
+        date_from,
+        date_to,
+        origin,
+        destination,
+        granularity=granularity,
+    )
+    with phase("serialize"):
+        return jsonify([format_lane_rate(*row) for row in rows])
+
+
+def _lane_key(lane):
+    if "id" in lane:
+        return lane["id"]
+    key = "{}:{}:{:%Y-%m-%d}:{:%Y-%m-%d}".format(
+        lane["origin"], lane["destination"], lane["date_from"], lane["date_to"]
+    )
+    if lane.get("granularity", "day") != "day":
+        key += ":" + lane["granularity"]
+    return key
+
+
+def format_rate(day, avg_price):
+    return {
+        "day": day.strftime("%Y-%m-%d"),
+        "average_price": (
+            round(float(avg_price), 3)
+            if avg_price is not None else None
+        )
+    }
+
+
+def format_rates(rates):
+    return [format_rate(day, avg_price) for day, avg_price in rates]
+
+
+def format_lane_rate(orig_code, dest_code, *rate):
+    """
+    Formats a lane matrix row, `(orig_code, dest_code, [day,] avg_price)`.
+    """
+    if len(rate) == 2:
+        formatted = format_rate(*rate)
+    else:
+        formatted = {
+            "average_price": (
+                round(float(rate[0]), 3) if rate[0] is not None else None
+            )
+        }
+    formatted.update(origin=orig_code, destination=dest_code)
+    return formatted
+
+
+def _stream_rates(rates, stream_dump, mimetype):
+    """
+    Streams rates written by the `stream_dump` serializer.
+    """
+    rates = iter(rates)
+    # Runs the query before the response is started, so that errors still
+    # get a proper error response.
+    first = next(rates, None)
+
+    def generate():
+        try:
+            if first is None:
+                yield from stream_dump(())
+            else:
+                yield from stream_dump(itertools.chain([first], rates))
+        finally:
+            # Returns the DB connection if the client went away early.
+            close = getattr(rates, "close", None)
+            if close is not None:
+                close()
+
+    return Response(generate(), mimetype=mimetype)
+
+
+def _runtime_stats():
+    stats = app.db.stats()
+    if app.rates_cache is not None:
+        stats["rates_cache"] = app.rates_cache.stats()
+    if app.admission is not None:
+        stats["admission"] = app.admission.stats()
+    if app.change_listener is not None:
+        stats["change_listener"] = app.change_listener.stats()
+    return stats
+
+
+@api.route("/stats", methods=["GET"])
+def get_stats():
+    """
+    API handler exposing runtime statistics, e.g. for sizing the DB
+    connection pool.
+    """
+    return jsonify(_runtime_stats())
+
+
+@api.route("/metrics", methods=["GET"])
+def get_metrics():
+    """
+    API handler exposing request latency histograms and runtime statistics
+    in the Prometheus text format.
+    """
+    return Response(
+        app.metrics.render(_runtime_stats()),
+        mimetype="text/plain; version=0.0.4",
     )
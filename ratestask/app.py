@@ -1,9 +1,16 @@
 
+from ratestask.admission import COST_CLASSES, AdmissionController
 from ratestask.api import api
+from ratestask.cache import LRUCache
+from ratestask.columnar import ColumnarDBAPI
 from ratestask.db import DBAPI
+from ratestask.invalidation import ChangeListener, invalidate_app
+from ratestask.metrics import RequestMetrics
 
 from flask import Flask
 
+import psycopg2
+
 from os import getenv
 
 
@@ -12,16 +19,144 @@ def create_app(config=None):
     if config:
         app.config.from_mapping(config)
 
-    app.db = DBAPI(app.config.get("DATABASE_URI"))
+    db_kwargs = dict(
+        pool_min_size=app.config.get("DB_POOL_MIN_SIZE", 1),
+        pool_max_size=app.config.get("DB_POOL_MAX_SIZE", 10),
+        pool_timeout=app.config.get("DB_POOL_TIMEOUT", 30.0),
+        pool_max_age=app.config.get("DB_POOL_MAX_AGE", 3600.0),
+        pool_validate_after=app.config.get("DB_POOL_VALIDATE_AFTER", 30.0),
+        hierarchy_ttl=app.config.get("HIERARCHY_TTL", 300.0),
+        hierarchy_miss_reload_interval=app.config.get(
+            "HIERARCHY_MISS_RELOAD_INTERVAL", 1.0
+        ),
+        stream_itersize=app.config.get("STREAM_ITERSIZE", 2000),
+        prepare_statements=app.config.get("DB_PREPARE_STATEMENTS", True),
+        plan_cache_mode=app.config.get("DB_PLAN_CACHE_MODE") or None,
+        replica_uris=app.config.get("DATABASE_REPLICA_URIS") or (),
+        replica_strategy=app.config.get("DB_REPLICA_STRATEGY", "round_robin"),
+        replica_max_lag=app.config.get("DB_REPLICA_MAX_LAG"),
+        replica_eject_for=app.config.get("DB_REPLICA_EJECT_SECONDS", 30.0),
+        replica_check_interval=app.config.get("DB_REPLICA_CHECK_INTERVAL", 5.0),
+        coalesce_queries=app.config.get("COALESCE_QUERIES", True),
+        region_resolution=app.config.get("REGION_RESOLUTION", "memory"),
+        statement_timeouts=app.config.get("STATEMENT_TIMEOUTS_MS"),
+    )
+
+    backend = app.config.get("RATES_BACKEND", "postgres")
+    if backend == "postgres":
+        app.db = DBAPI(app.config.get("DATABASE_URI"), **db_kwargs)
+    elif backend == "columnar":
+        app.db = ColumnarDBAPI(
+            app.config.get("DATABASE_URI"),
+            reload_interval=app.config.get("COLUMNAR_RELOAD_INTERVAL"),
+            snapshot_path=app.config.get("COLUMNAR_SNAPSHOT_PATH") or None,
+            **db_kwargs
+        )
+    else:
+        raise ValueError("Unknown RATES_BACKEND: {}".format(backend))
+
+    app.rates_cache = None
+    if app.config.get("RATES_CACHE_SIZE", 1024) > 0:
+        app.rates_cache = LRUCache(
+            maxsize=app.config.get("RATES_CACHE_SIZE", 1024),
+            ttl=app.config.get("RATES_CACHE_TTL", 60.0),
+            max_bytes=app.config.get("RATES_CACHE_MAX_BYTES"),
+        )
+
+    app.change_listener = None
+    if (
+        app.rates_cache is not None and
+        backend == "postgres" and
+        app.config.get("CACHE_INVALIDATION", False)
+    ):
+        app.change_listener = ChangeListener(
+            app.config.get("DATABASE_URI"),
+            lambda change: invalidate_app(app, change),
+        )
+
+    app.admission = None
+    if app.config.get("MAX_IN_FLIGHT", 10) > 0:
+        app.admission = AdmissionController(
+            max_in_flight=app.config.get("MAX_IN_FLIGHT", 10),
+            max_queue=app.config.get("ADMISSION_QUEUE_SIZE", 20),
+            queue_timeout=app.config.get("ADMISSION_QUEUE_TIMEOUT", 0.5),
+            retry_after=app.config.get("RETRY_AFTER", 1),
+        )
+
+    RequestMetrics(
+        slow_request_threshold_ms=app.config.get("SLOW_REQUEST_THRESHOLD_MS"),
+    ).init_app(app)
+
     app.register_blueprint(api)
 
+    if app.config.get("PRELOAD"):
+        try:
+            app.db.warm_up()
+        except psycopg2.Error as e:
+            # Not fatal, the data is loaded on first use instead.
+            app.logger.warning("Could not preload rates data: %s", e)
+
+    if backend == "columnar":
+        app.db.start_reloader()
+    if app.change_listener is not None:
+        app.change_listener.start()
+
     return app
 
 
-app = create_app({
-    "DATABASE_URI": getenv("DATABASE_URI"),
-})
+def config_from_env():
+    """
+    Returns the app config read from the environment variables, see the
+    README. The app itself is created in `ratestask.wsgi`, so importing
+    `create_app` neither connects to the DB nor starts threads.
+    """
+    return {
+        "DATABASE_URI": getenv("DATABASE_URI"),
+        "DATABASE_REPLICA_URIS": [
+            uri for uri in getenv("DATABASE_REPLICA_URIS", "").split(",") if uri
+        ],
+        "DB_POOL_MIN_SIZE": int(getenv("DB_POOL_MIN_SIZE", 1)),
+        "DB_POOL_MAX_SIZE": int(getenv("DB_POOL_MAX_SIZE", 10)),
+        "DB_POOL_TIMEOUT": float(getenv("DB_POOL_TIMEOUT", 30.0)),
+        "DB_POOL_MAX_AGE": float(getenv("DB_POOL_MAX_AGE", 3600.0)),
+        "DB_POOL_VALIDATE_AFTER": float(getenv("DB_POOL_VALIDATE_AFTER", 30.0)),
+        "PRELOAD": getenv("PRELOAD", "1") == "1",
+        "HIERARCHY_TTL": float(getenv("HIERARCHY_TTL", 300.0)),
+        "HIERARCHY_MISS_RELOAD_INTERVAL": float(
+            getenv("HIERARCHY_MISS_RELOAD_INTERVAL", 1.0)
+        ),
+        "RATES_BACKEND": getenv("RATES_BACKEND", "postgres"),
+        "COLUMNAR_RELOAD_INTERVAL": float(getenv("COLUMNAR_RELOAD_INTERVAL", 0)),
+        "COLUMNAR_SNAPSHOT_PATH": getenv("COLUMNAR_SNAPSHOT_PATH", ""),
+        "STREAM_ITERSIZE": int(getenv("STREAM_ITERSIZE", 2000)),
+        "COALESCE_QUERIES": getenv("COALESCE_QUERIES", "1") == "1",
+        "REGION_RESOLUTION": getenv("REGION_RESOLUTION", "memory"),
+        "DB_PREPARE_STATEMENTS": getenv("DB_PREPARE_STATEMENTS", "1") == "1",
+        "DB_PLAN_CACHE_MODE": getenv("DB_PLAN_CACHE_MODE", ""),
+        "DB_REPLICA_STRATEGY": getenv("DB_REPLICA_STRATEGY", "round_robin"),
+        # Unset or empty disables the lag check, 0 tolerates no lag.
+        "DB_REPLICA_MAX_LAG": (
+            float(getenv("DB_REPLICA_MAX_LAG"))
+            if getenv("DB_REPLICA_MAX_LAG") else None
+        ),
+        "DB_REPLICA_EJECT_SECONDS": float(getenv("DB_REPLICA_EJECT_SECONDS", 30.0)),
+        "DB_REPLICA_CHECK_INTERVAL": float(getenv("DB_REPLICA_CHECK_INTERVAL", 5.0)),
+        "RATES_CACHE_SIZE": int(getenv("RATES_CACHE_SIZE", 1024)),
+        "RATES_CACHE_TTL": float(getenv("RATES_CACHE_TTL", 60.0)),
+        "RATES_CACHE_MAX_BYTES": int(getenv("RATES_CACHE_MAX_BYTES", 64 * 1024 ** 2)),
+        "CACHE_INVALIDATION": getenv("CACHE_INVALIDATION", "1") == "1",
+        "SLOW_REQUEST_THRESHOLD_MS": float(getenv("SLOW_REQUEST_THRESHOLD_MS", 1000)),
+        "MAX_IN_FLIGHT": int(getenv("MAX_IN_FLIGHT", 10)),
+        "ADMISSION_QUEUE_SIZE": int(getenv("ADMISSION_QUEUE_SIZE", 20)),
+        "ADMISSION_QUEUE_TIMEOUT": float(getenv("ADMISSION_QUEUE_TIMEOUT", 0.5)),
+        "RETRY_AFTER": int(getenv("RETRY_AFTER", 1)),
+        "STATEMENT_TIMEOUTS_MS": dict(zip(COST_CLASSES, [
+            int(timeout)
+            for timeout in getenv("STATEMENT_TIMEOUTS_MS", "2000,10000,30000").split(",")
+            if timeout
+        ])),
+    }
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=80)
+    create_app(config_from_env()).run(host="0.0.0.0", port=80)
@@ -0,0 +1,205 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import wraps
+
+from flask import (
+    Response,
+    current_app as app,
+    make_response,
+    request,
+)
+
+
+CachedResponse = namedtuple("CachedResponse", ["body", "etag", "mimetype"])
+
+
+class LRUCache(object):
+    """
+    Thread-safe LRU cache bounded by number of entries (`maxsize`) and
+    optionally by the total size of the entries (`max_bytes`), expiring
+    entries `ttl` seconds after they were stored.
+
+    Every invalidation (`evict`, `clear`) starts a new `generation`, values
+    computed during an older one are not stored anymore. Keys removed by
+    `evict` are reported as `invalidated` until they are stored again (for
+    at most `maxsize` keys).
+    """
+
+    def __init__(self, maxsize=1024, ttl=60.0, max_bytes=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()
+        self._invalidated = OrderedDict()
+        self._lock = threading.Lock()
+        self._nbytes = 0
+
+        self._hits = 0
+        self._misses = 0
+        self._expirations = 0
+        self._evictions = 0
+        self._invalidations = 0
+        self._generation = 0
+
+    def _remove(self, key):
+        _, _, nbytes = self._entries.pop(key)
+        self._nbytes -= nbytes
+
+    def get(self, key):
+        """
+        Returns the cached value, or None if missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+
+            value, expires_at, _ = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                self._expirations += 1
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def set(self, key, value, nbytes=0, generation=None):
+        """
+        Stores a value, unless it was computed during the `generation`
+        before an invalidation.
+        """
+        if self.max_bytes is not None and nbytes > self.max_bytes:
+            return
+
+        expires_at = (
+            time.monotonic() + self.ttl if self.ttl is not None else None
+        )
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, expires_at, nbytes)
+            self._nbytes += nbytes
+            self._invalidated.pop(key, None)
+
+            while (
+                len(self._entries) > self.maxsize or
+                (self.max_bytes is not None and self._nbytes > self.max_bytes)
+            ):
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def evict(self, predicate):
+        """
+        Removes the entries whose key matches `predicate`, returns their
+        number.
+        """
+        with self._lock:
+            self._generation += 1
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                self._remove(key)
+                self._invalidated[key] = None
+                self._invalidated.move_to_end(key)
+            while len(self._invalidated) > self.maxsize:
+                self._invalidated.popitem(last=False)
+            self._invalidations += len(keys)
+        return len(keys)
+
+    def invalidated(self, key):
+        """
+        Whether `key` was evicted by `evict` and not stored since.
+        """
+        with self._lock:
+            return key in self._invalidated
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._nbytes,
+                "maxsize": self.maxsize,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "expirations": self._expirations,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations,
+            }
+
+
+def _not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def cached_response(func):
+    """
+    Decorator caching successful responses of an API handler in
+    `app.rates_cache`, keyed on the (validated) handler arguments. Responses
+    carry a strong ETag, and requests revalidating a cached response with
+    If-None-Match get a 304 without the handler being run.
+    """
+    @wraps(func)
+    def decorated(*args, **kwargs):
+        cache = app.rates_cache
+        key = (func.__name__, tuple(sorted(kwargs.items())))
+        entry = cache.get(key) if cache is not None else None
+
+        if entry is None:
+            # Taken before the data is read, so that a response racing with
+            # an invalidation is not cached.
+            generation = cache.generation if cache is not None else None
+            if cache is not None and cache.invalidated(key):
+                # Replicas may not have replayed the change yet, so the
+                # evicted response is not refilled from one.
+                with app.db.primary_reads():
+                    response = make_response(func(*args, **kwargs))
+            else:
+                response = make_response(func(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+
+            body = response.get_data()
+            entry = CachedResponse(
+                body=body,
+                etag=hashlib.sha256(body).hexdigest()[:32],
+                mimetype=response.mimetype,
+            )
+            if cache is not None:
+                cache.set(key, entry, nbytes=len(body), generation=generation)
+
+        if request.if_none_match.contains_weak(entry.etag):
+            return _not_modified(entry.etag)
+
+        response = Response(entry.body, mimetype=entry.mimetype)
+        response.set_etag(entry.etag)
+        return response
+
+    return decorated
@@ -0,0 +1,535 @@
+import logging
+import threading
+import time
+from datetime import date
+
+import numpy as np
+
+from ratestask.db import DBAPI
+from ratestask.hierarchy import RegionHierarchy
+from ratestask.metrics import phase
+from ratestask.sketches import LOG_GAMMA, quantiles, stat_quantile
+
+
+logger = logging.getLogger(__name__)
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def _to_date(value):
+    if isinstance(value, str):
+        return date.fromisoformat(value)
+    return value
+
+
+def bucket_ordinals(ordinals, granularity):
+    """
+    Maps day ordinals to the ordinal of the first day of their bucket, like
+    `date_trunc` does in the rates query.
+    """
+    if granularity == "week":
+        # Ordinal 1 (0001-01-01) is a Monday.
+        return ordinals - (ordinals - 1) % 7
+    if granularity == "month":
+        months = (
+            (ordinals - _EPOCH_ORDINAL).astype("datetime64[D]")
+            .astype("datetime64[M]")
+        )
+        return months.astype("datetime64[D]").astype(np.int64) + _EPOCH_ORDINAL
+    return ordinals
+
+
+def price_buckets(prices):
+    """
+    Sketch buckets of prices, see `ratestask.sketches.price_bucket`.
+    """
+    logs = np.log(np.maximum(prices, 1)) / LOG_GAMMA
+    return np.where(prices < 1, 0, np.ceil(logs) + 1).astype(np.int16)
+
+
+class RatesColumns(object):
+    """
+    Immutable columnar copy of the `prices` table.
+
+    Port codes are dictionary encoded (`port_codes[i]` is the code of id `i`),
+    days are stored as proleptic Gregorian ordinals, and the `orig`, `dest`,
+    `day` and `price` int32 columns are sorted by (orig, dest, day). Rows of
+    the lane `orig * len(port_codes) + dest` are found through the sorted
+    `lanes` keys and `lane_offsets`. `bucket` holds the price sketch bucket
+    of every row.
+    """
+
+    def __init__(self, port_codes, orig, dest, day, price):
+        self.port_codes = list(port_codes)
+        self.port_ids = {code: i for i, code in enumerate(self.port_codes)}
+
+        order = np.lexsort((day, dest, orig))
+        self.orig = np.ascontiguousarray(orig[order], dtype=np.int32)
+        self.dest = np.ascontiguousarray(dest[order], dtype=np.int32)
+        self.day = np.ascontiguousarray(day[order], dtype=np.int32)
+        self.price = np.ascontiguousarray(price[order], dtype=np.int32)
+        self.bucket = price_buckets(self.price)
+
+        lane_keys = self._lane_keys(self.orig, self.dest)
+        boundaries = np.flatnonzero(np.diff(lane_keys)) + 1
+        self.lane_offsets = np.concatenate(
+            ([0], boundaries, [len(lane_keys)]) if len(lane_keys) else ([0],)
+        ).astype(np.int64)
+        self.lanes = lane_keys[self.lane_offsets[:-1]]
+
+    @classmethod
+    def from_sorted(
+        cls, port_codes, orig, dest, day, price, bucket, lanes, lane_offsets
+    ):
+        """
+        Wraps columns that are already sorted and indexed (as exported by
+        another instance) without copying them, e.g. read-only arrays
+        mapped from a snapshot file.
+        """
+        columns = cls.__new__(cls)
+        columns.port_codes = list(port_codes)
+        columns.port_ids = {code: i for i, code in enumerate(columns.port_codes)}
+        columns.orig = orig
+        columns.dest = dest
+        columns.day = day
+        columns.price = price
+        columns.bucket = bucket
+        columns.lanes = lanes
+        columns.lane_offsets = lane_offsets
+        return columns
+
+    def __len__(self):
+        return len(self.price)
+
+    def _lane_keys(self, orig, dest):
+        return (
+            orig.astype(np.int64) * len(self.port_codes) +
+            dest.astype(np.int64)
+        )
+
+    def _encode(self, codes):
+        return np.array(
+            sorted(self.port_ids[code] for code in codes if code in self.port_ids),
+            dtype=np.int64,
+        )
+
+    def _lane_rows(self, origin_codes, destination_codes):
+        """
+        Returns the row indices of every lane between the given ports.
+        """
+        orig_ids = self._encode(origin_codes)
+        dest_ids = self._encode(destination_codes)
+        if not len(orig_ids) or not len(dest_ids) or not len(self.lanes):
+            return np.empty(0, dtype=np.int64)
+
+        keys = (orig_ids[:, None] * len(self.port_codes) + dest_ids).ravel()
+        positions = np.searchsorted(self.lanes, keys)
+        found = positions < len(self.lanes)
+        found[found] = self.lanes[positions[found]] == keys[found]
+        positions = positions[found]
+
+        starts = self.lane_offsets[positions]
+        lengths = self.lane_offsets[positions + 1] - starts
+        # Concatenation of the ranges [start, start + length) of all lanes.
+        run_starts = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return run_starts + np.arange(lengths.sum())
+
+    def avg_rates(
+        self,
+        start_date,
+        end_date,
+        origin_codes,
+        destination_codes,
+        min_price_count=3,
+        granularity="day",
+        stats=()
+    ):
+        """
+        Daily (or weekly/monthly) average prices between the given sets of
+        port codes, returned like `DBAPI.get_avg_rates` as
+        `(day, average_price, *stats)` tuples.
+        """
+        start = _to_date(start_date).toordinal()
+        end = _to_date(end_date).toordinal()
+        if end < start:
+            return []
+
+        rows = self._lane_rows(origin_codes, destination_codes)
+        days = self.day[rows]
+        in_range = (days >= start) & (days <= end)
+        first = int(bucket_ordinals(np.array([start]), granularity)[0])
+        days = bucket_ordinals(days[in_range].astype(np.int64), granularity) - first
+        prices = self.price[rows][in_range]
+
+        span = end - first + 1
+        counts = np.bincount(days, minlength=span)
+        sums = np.bincount(days, weights=prices, minlength=span)
+
+        rates = [
+            (
+                date.fromordinal(first + int(offset)),
+                (
+                    float(sums[offset] / counts[offset])
+                    if counts[offset] >= min_price_count else None
+                ),
+            )
+            for offset in np.flatnonzero(counts)
+        ]
+        if not stats:
+            return rates
+
+        buckets = self.bucket[rows][in_range].astype(np.int64)
+        width = int(buckets.max()) + 1 if len(buckets) else 1
+        keys, key_counts = np.unique(days * width + buckets, return_counts=True)
+        key_days = keys // width
+        qs = [stat_quantile(name) for name in stats]
+        result = []
+        for rate in rates:
+            offset = rate[0].toordinal() - first
+            if counts[offset] < max(min_price_count, 1):
+                result.append(rate + (None,) * len(qs))
+                continue
+            lo, hi = np.searchsorted(key_days, [offset, offset + 1])
+            result.append(rate + tuple(quantiles(
+                (keys[lo:hi] % width).tolist(),
+                key_counts[lo:hi].tolist(),
+                qs,
+            )))
+        return result
+
+    def lane_matrix(
+        self,
+        start_date,
+        end_date,
+        origin_codes,
+        destination_codes,
+        min_price_count=3,
+        granularity=None
+    ):
+        """
+        Average prices per lane (and bucket, with a granularity) between the
+        given sets of port codes, returned like `DBAPI.get_lane_matrix`.
+        """
+        start = _to_date(start_date).toordinal()
+        end = _to_date(end_date).toordinal()
+        if end < start:
+            return []
+
+        rows = self._lane_rows(origin_codes, destination_codes)
+        days = self.day[rows]
+        in_range = (days >= start) & (days <= end)
+        rows = rows[in_range]
+        keys = self._lane_keys(self.orig[rows], self.dest[rows])
+        if granularity is not None:
+            first = int(bucket_ordinals(np.array([start]), granularity)[0])
+            span = end - first + 1
+            offsets = bucket_ordinals(
+                days[in_range].astype(np.int64), granularity
+            ) - first
+            keys = keys * span + offsets
+
+        keys, inverse = np.unique(keys, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(keys))
+        sums = np.bincount(
+            inverse, weights=self.price[rows], minlength=len(keys)
+        )
+
+        result = []
+        for key, count, total in zip(keys.tolist(), counts, sums):
+            average_price = (
+                float(total / count) if count >= min_price_count else None
+            )
+            if granularity is None:
+                lane = key
+            else:
+                lane, offset = divmod(key, span)
+            orig, dest = divmod(lane, len(self.port_codes))
+            row = (self.port_codes[orig], self.port_codes[dest])
+            if granularity is not None:
+                row += (date.fromordinal(first + offset),)
+            result.append(row + (average_price,))
+        return result
+
+
+def fetch_columns(db_cursor, chunk_size=100000):
+    """
+    Loads the `prices` table into `RatesColumns`, reading it in chunks of
+    `chunk_size` rows from a server-side cursor on the connection of
+    `db_cursor`.
+    """
+    db_cursor.execute("SELECT code FROM ports")
+    port_codes = sorted(code for code, in db_cursor.fetchall())
+    port_ids = {code: i for i, code in enumerate(port_codes)}
+
+    chunks = []
+    with db_cursor.connection.cursor(name="columnar_load") as rows_cursor:
+        rows_cursor.execute("""
+            SELECT orig_code, dest_code, day - DATE '0001-01-01' + 1, price
+            FROM prices
+        """)
+        while True:
+            rows = rows_cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            chunks.append(np.array(
+                [
+                    (port_ids[orig_code], port_ids[dest_code], day, price)
+                    for orig_code, dest_code, day, price in rows
+                ],
+                dtype=np.int32,
+            ))
+
+    data = (
+        np.concatenate(chunks) if chunks
+        else np.empty((0, 4), dtype=np.int32)
+    )
+    return RatesColumns(port_codes, data[:, 0], data[:, 1], data[:, 2], data[:, 3])
+
+
+class ColumnarDBAPI(DBAPI):
+    """
+    DBAPI backend answering rates queries from an in-memory columnar copy
+    of `prices` (and of the region hierarchy) instead of Postgres. The copy is
+    loaded on first use and, with `reload_interval`, periodically reloaded
+    in a background thread.
+
+    With `snapshot_path`, the copy is memory-mapped from a snapshot file
+    (see `ratestask.snapshot`) instead of being read from Postgres, and
+    reloads map the file again.
+    """
+
+    def __init__(
+        self, db_uri, reload_interval=None, snapshot_path=None, **kwargs
+    ):
+        super(ColumnarDBAPI, self).__init__(db_uri, **kwargs)
+        # Loaded and reloaded together with the columns.
+        self.hierarchy = RegionHierarchy(ttl=None, miss_reload_interval=None)
+        self.reload_interval = reload_interval
+        self.snapshot_path = snapshot_path
+        self.columns = None
+        self.loaded_at = None
+        self._load_lock = threading.Lock()
+        self._reloader = None
+        self._stop_reloader = threading.Event()
+
+    def _load(self):
+        started = time.monotonic()
+        if self.snapshot_path:
+            # Imported here, the snapshot module builds on this one.
+            from ratestask.snapshot import load_snapshot
+
+            snapshot = load_snapshot(self.snapshot_path)
+            self.hierarchy.load(snapshot.regions, snapshot.ports)
+            columns = snapshot.columns
+        else:
+            with self.cursor() as db_cursor:
+                self.hierarchy.refresh(db_cursor)
+                columns = fetch_columns(db_cursor)
+        self.columns = columns
+        self.loaded_at = time.time()
+
+        logger.info(
+            "Loaded %d prices into columnar backend from %s in %.2fs",
+            len(columns),
+            self.snapshot_path or "Postgres",
+            time.monotonic() - started
+        )
+
+    def load(self):
+        """
+        (Re)loads the region hierarchy and the prices columns.
+        """
+        with self._load_lock:
+            self._load()
+
+    def warm_up(self):
+        self.load()
+
+    def _get_columns(self):
+        if self.columns is None:
+            with self._load_lock:
+                if self.columns is None:
+                    self._load()
+        return self.columns
+
+    def _reload_loop(self):
+        while not self._stop_reloader.wait(self.reload_interval):
+            try:
+                self.load()
+            except Exception:
+                logger.exception("Reloading columnar backend failed")
+
+    def start_reloader(self):
+        """
+        Starts the background thread reloading the data every
+        `reload_interval` seconds.
+        """
+        if not self.reload_interval or self._reloader is not None:
+            return
+        self._reloader = threading.Thread(
+            target=self._reload_loop, name="columnar-reloader", daemon=True
+        )
+        self._reloader.start()
+
+    def stop_reloader(self):
+        """
+        Stops the background reloading thread, waiting for a running
+        reload to finish.
+        """
+        if self._reloader is None:
+            return
+        self._stop_reloader.set()
+        self._reloader.join()
+        self._reloader = None
+        self._stop_reloader = threading.Event()
+
+    def before_fork(self):
+        # Threads do not survive a fork, workers start their own reloader.
+        self.stop_reloader()
+        super(ColumnarDBAPI, self).before_fork()
+
+    def after_fork(self):
+        super(ColumnarDBAPI, self).after_fork()
+        self.start_reloader()
+
+    def get_avg_rates(
+        self,
+        db_cursor,
+        start_date,
+        end_date,
+        origin,
+        destination,
+        min_price_count=3,
+        granularity="day",
+        stats=()
+    ):
+        """
+        Query for fetching daily average price rates between the given
+        origin and destination port/region, answered from memory. The
+        `db_cursor` is unused and may be None.
+        """
+        columns = self._get_columns()
+        with phase("resolve"):
+            origin_codes = self.hierarchy.resolve(None, origin)
+            destination_codes = self.hierarchy.resolve(None, destination)
+        with phase("query"):
+            return columns.avg_rates(
+                start_date,
+                end_date,
+                origin_codes,
+                destination_codes,
+                min_price_count=min_price_count,
+                granularity=granularity,
+                stats=stats,
+            )
+
+    def fetch_avg_rates(
+        self,
+        start_date,
+        end_date,
+        origin,
+        destination,
+        min_price_count=3,
+        granularity="day",
+        stats=()
+    ):
+        return self.get_avg_rates(
+            None,
+            start_date,
+            end_date,
+            origin,
+            destination,
+            min_price_count=min_price_count,
+            granularity=granularity,
+            stats=stats,
+        )
+
+    def iter_avg_rates(
+        self,
+        start_date,
+        end_date,
+        origin,
+        destination,
+        min_price_count=3,
+        granularity="day",
+        stats=()
+    ):
+        return iter(self.fetch_avg_rates(
+            start_date,
+            end_date,
+            origin,
+            destination,
+            min_price_count=min_price_count,
+            granularity=granularity,
+            stats=stats,
+        ))
+
+    def get_lane_matrix(
+        self,
+        db_cursor,
+        start_date,
+        end_date,
+        origin,
+        destination,
+        min_price_count=3,
+        granularity=None
+    ):
+        columns = self._get_columns()
+        with phase("resolve"):
+            origin_codes = self.hierarchy.resolve(None, origin)
+            destination_codes = self.hierarchy.resolve(None, destination)
+        with phase("query"):
+            return columns.lane_matrix(
+                start_date,
+                end_date,
+                origin_codes,
+                destination_codes,
+                min_price_count=min_price_count,
+                granularity=granularity,
+            )
+
+    def fetch_lane_matrix(
+        self,
+        start_date,
+        end_date,
+        origin,
+        destination,
+        min_price_count=3,
+        granularity=None
+    ):
+        return self.get_lane_matrix(
+            None,
+            start_date,
+            end_date,
+            origin,
+            destination,
+            min_price_count=min_price_count,
+            granularity=granularity,
+        )
+
+    def get_batch_avg_rates(self, db_cursor, lanes, min_price_count=3):
+        return [
+            self.get_avg_rates(
+                None,
+                *lane[:4],
+                min_price_count=min_price_count,
+                granularity=lane[4] if len(lane) > 4 else "day"
+            )
+            for lane in lanes
+        ]
+
+    def fetch_batch_avg_rates(self, lanes, min_price_count=3):
+        return self.get_batch_avg_rates(
+            None, lanes, min_price_count=min_price_count
+        )
+
+    def stats(self):
+        stats = super(ColumnarDBAPI, self).stats()
+        columns = self.columns
+        stats["columnar"] = {
+            "rows": len(columns) if columns is not None else 0,
+            "lanes": len(columns.lanes) if columns is not None else 0,
+            "loaded_at": self.loaded_at,
+            "snapshot_path": self.snapshot_path,
+        }
+        return stats
@@ -1,16 +1,667 @@
+import re
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date
+
 import psycopg2
+import psycopg2.errors
+from psycopg2.extras import execute_values
+
+from ratestask.admission import COST_CLASSES, cost_class
+from ratestask.hierarchy import RegionHierarchy
+from ratestask.metrics import phase, record_lane_ports
+from ratestask.pool import ConnectionPool
+from ratestask.replicas import ReplicaRouter
+from ratestask.singleflight import SingleFlight
+from ratestask.sketches import stat_quantile, with_quantiles
+
+
+GRANULARITIES = ("day", "week", "month")
+
+# Where origins and destinations are resolved to port codes: by the
+# in-memory `RegionHierarchy`, or in the query through the `port_ancestors`
+# closure table.
+REGION_RESOLUTIONS = ("memory", "database")
+
+# Port codes of the port code or region slug parameter `{0}`, an array with
+# the code itself appended (which is no port code for a region slug).
+_CLOSURE_PORT_CODES = """ARRAY(
+              SELECT port_code FROM port_ancestors
+              WHERE ancestor_slug = %({0})s
+          ) || %({0})s::text"""
+
+
+def _span_days(start_date, end_date):
+    if isinstance(start_date, str):
+        start_date = date.fromisoformat(start_date)
+    if isinstance(end_date, str):
+        end_date = date.fromisoformat(end_date)
+    return (end_date - start_date).days + 1
+
+
+def _day_bucket(granularity):
+    if granularity == "day":
+        return "day"
+    return "date_trunc('{}', day::timestamp)::date".format(granularity)
+
+
+def _rates_query(template, granularity, resolution="memory"):
+    if resolution == "database":
+        origin_codes = _CLOSURE_PORT_CODES.format("origin")
+        destination_codes = _CLOSURE_PORT_CODES.format("destination")
+    else:
+        origin_codes = "%(origin_codes)s"
+        destination_codes = "%(destination_codes)s"
+    return template.format(
+        bucket=_day_bucket(granularity),
+        origin_codes=origin_codes,
+        destination_codes=destination_codes,
+    )
+
+
+# Average prices per day, or per week/month bucket labelled by its first day
+# (weeks start on Monday), between sets of origin and destination ports. The
+# minimum price count applies to each bucket.
+_AVG_RATES_QUERY = """
+    SELECT {bucket} AS day,
+           CASE
+                WHEN SUM(price_count) >= %(min_price_count)s
+                THEN SUM(price_sum)::numeric / SUM(price_count)
+                ELSE NULL
+           END AS average_price
+    FROM daily_lane_stats
+    WHERE day >= %(start_date)s AND
+          day <= %(end_date)s AND
+          orig_code = ANY({origin_codes}) AND
+          dest_code = ANY({destination_codes})
+    GROUP BY 1
+    ORDER BY 1
+"""
+
+AVG_RATES_QUERIES = {
+    granularity: _rates_query(_AVG_RATES_QUERY, granularity)
+    for granularity in GRANULARITIES
+}
+AVG_RATES_QUERY = AVG_RATES_QUERIES["day"]
+
+# Merged price sketches (see `ratestask.sketches`) of the same buckets.
+_PRICE_BUCKETS_QUERY = """
+    SELECT {bucket} AS day, bucket, SUM(price_count)
+    FROM daily_lane_price_buckets
+    WHERE day >= %(start_date)s AND
+          day <= %(end_date)s AND
+          orig_code = ANY({origin_codes}) AND
+          dest_code = ANY({destination_codes})
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+"""
+
+PRICE_BUCKETS_QUERIES = {
+    granularity: _rates_query(_PRICE_BUCKETS_QUERY, granularity)
+    for granularity in GRANULARITIES
+}
+
+# Average prices of every lane (port pair) between sets of origin and
+# destination ports over the whole date range, or per lane and bucket.
+_LANE_MATRIX_QUERY = """
+    SELECT orig_code,
+           dest_code,
+           CASE
+                WHEN SUM(price_count) >= %(min_price_count)s
+                THEN SUM(price_sum)::numeric / SUM(price_count)
+                ELSE NULL
+           END AS average_price
+    FROM daily_lane_stats
+    WHERE day >= %(start_date)s AND
+          day <= %(end_date)s AND
+          orig_code = ANY({origin_codes}) AND
+          dest_code = ANY({destination_codes})
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+"""
+
+_LANE_MATRIX_BUCKETS_QUERY = """
+    SELECT orig_code,
+           dest_code,
+           {bucket} AS day,
+           CASE
+                WHEN SUM(price_count) >= %(min_price_count)s
+                THEN SUM(price_sum)::numeric / SUM(price_count)
+                ELSE NULL
+           END AS average_price
+    FROM daily_lane_stats
+    WHERE day >= %(start_date)s AND
+          day <= %(end_date)s AND
+          orig_code = ANY({origin_codes}) AND
+          dest_code = ANY({destination_codes})
+    GROUP BY 1, 2, 3
+    ORDER BY 1, 2, 3
+"""
+
+
+def avg_rates_params(
+    start_date,
+    end_date,
+    origin_codes,
+    destination_codes,
+    min_price_count
+):
+    return {
+        "start_date": start_date,
+        "end_date": end_date,
+        "origin_codes": sorted(origin_codes),
+        "destination_codes": sorted(destination_codes),
+        "min_price_count": min_price_count
+    }
+
+
+PLAN_CACHE_MODES = ("auto", "force_generic_plan", "force_custom_plan")
+
+_NAMED_PARAM_RE = re.compile(r"%\((\w+)\)s")
+
+
+def _number_params(query):
+    names = []
+
+    def replace(match):
+        name = match.group(1)
+        if name not in names:
+            names.append(name)
+        return "${}".format(names.index(name) + 1)
+
+    return _NAMED_PARAM_RE.sub(replace, query), names
+
+
+def to_numbered_params(query, params):
+    """
+    Converts a query with psycopg2 `%(name)s` placeholders and its
+    parameters dict to `$n` placeholders and an arguments list.
+    """
+    query, names = _number_params(query)
+    return query, [params[name] for name in names]
+
+
+class PreparedStatement(object):
+    """
+    Server-side prepared statement of a query with `%(name)s` placeholders,
+    `param_types` maps the placeholder names to their SQL types.
+    """
+
+    def __init__(self, name, query, param_types):
+        self.name = name
+        self.query = query
+        numbered_query, self.param_names = _number_params(query)
+        self.prepare_sql = "PREPARE {} ({}) AS {}".format(
+            name,
+            ", ".join(param_types[param] for param in self.param_names),
+            numbered_query,
+        )
+        self.execute_sql = "EXECUTE {} ({})".format(
+            name, ", ".join("%s" for _ in self.param_names)
+        )
+
+    def args(self, params):
+        return [params[name] for name in self.param_names]
+
+
+_AVG_RATES_PARAM_TYPES = {
+    "start_date": "date",
+    "end_date": "date",
+    "origin_codes": "text[]",
+    "destination_codes": "text[]",
+    "origin": "text",
+    "destination": "text",
+    "min_price_count": "integer",
+}
+
+
+def _rates_statements(name, template, resolution="memory"):
+    """
+    Prepared statements of a rates query template per granularity, named
+    `[closure_]<name>[_<granularity>]`.
+    """
+    if resolution == "database":
+        name = "closure_" + name
+    return {
+        granularity: PreparedStatement(
+            name if granularity == "day" else "{}_{}".format(name, granularity),
+            _rates_query(template, granularity, resolution),
+            _AVG_RATES_PARAM_TYPES,
+        )
+        for granularity in GRANULARITIES
+    }
+
+
+AVG_RATES_STATEMENTS = _rates_statements("avg_rates", _AVG_RATES_QUERY)
+PRICE_BUCKETS_STATEMENTS = _rates_statements(
+    "price_buckets", _PRICE_BUCKETS_QUERY
+)
+CLOSURE_AVG_RATES_STATEMENTS = _rates_statements(
+    "avg_rates", _AVG_RATES_QUERY, "database"
+)
+CLOSURE_PRICE_BUCKETS_STATEMENTS = _rates_statements(
+    "price_buckets", _PRICE_BUCKETS_QUERY, "database"
+)
+
+
+def _lane_matrix_statements(resolution="memory"):
+    """
+    Prepared lane matrix statements per granularity, and for averages over
+    the whole date range under the None key.
+    """
+    statements = _rates_statements(
+        "lane_matrix", _LANE_MATRIX_BUCKETS_QUERY, resolution
+    )
+    statements[None] = PreparedStatement(
+        "{}lane_matrix_total".format(
+            "closure_" if resolution == "database" else ""
+        ),
+        _rates_query(_LANE_MATRIX_QUERY, "day", resolution),
+        _AVG_RATES_PARAM_TYPES,
+    )
+    return statements
+
+
+LANE_MATRIX_STATEMENTS = _lane_matrix_statements()
+CLOSURE_LANE_MATRIX_STATEMENTS = _lane_matrix_statements("database")
 
 
 class DBAPI(object):
+    """
+    Rates queries on pooled connections to `db_uri`, or spread over the
+    pools of `replica_uris` when given (see `ReplicaRouter`).
+
+    With `region_resolution="database"`, the rates queries resolve regions
+    to their ports through the `port_ancestors` closure table instead of
+    the in-memory hierarchy.
+
+    `statement_timeouts` maps query cost classes (see
+    `ratestask.admission.cost_class`) to a `statement_timeout` in
+    milliseconds, rates queries running longer are canceled by Postgres
+    with `QueryCanceled`.
+    """
+
+    def __init__(
+        self,
+        db_uri,
+        pool_min_size=1,
+        pool_max_size=10,
+        pool_timeout=30.0,
+        pool_max_age=3600.0,
+        pool_validate_after=30.0,
+        hierarchy_ttl=300.0,
+        hierarchy_miss_reload_interval=1.0,
+        stream_itersize=2000,
+        prepare_statements=True,
+        plan_cache_mode=None,
+        replica_uris=(),
+        replica_strategy="round_robin",
+        replica_max_lag=None,
+        replica_eject_for=30.0,
+        replica_check_interval=5.0,
+        coalesce_queries=True,
+        region_resolution="memory",
+        statement_timeouts=None
+    ):
+        if plan_cache_mode and plan_cache_mode not in PLAN_CACHE_MODES:
+            raise ValueError(
+                "Unknown plan_cache_mode: {}".format(plan_cache_mode)
+            )
+        if region_resolution not in REGION_RESOLUTIONS:
+            raise ValueError(
+                "Unknown region_resolution: {}".format(region_resolution)
+            )
+        for name in statement_timeouts or {}:
+            if name not in COST_CLASSES:
+                raise ValueError("Unknown cost class: {}".format(name))
 
-    def __init__(self, db_uri):
         self.db_uri = db_uri
+        self.stream_itersize = stream_itersize
+        self.prepare_statements = prepare_statements
+        self.plan_cache_mode = plan_cache_mode or None
+        self.region_resolution = region_resolution
+        self.statement_timeouts = dict(statement_timeouts or {})
+        pool_kwargs = dict(
+            min_size=pool_min_size,
+            max_size=pool_max_size,
+            timeout=pool_timeout,
+            max_age=pool_max_age,
+            validate_after=pool_validate_after,
+            connect_kwargs=(
+                {"options": "-c plan_cache_mode={}".format(plan_cache_mode)}
+                if plan_cache_mode else None
+            ),
+        )
+        self.pool = ConnectionPool(db_uri, **pool_kwargs)
+        self.router = None
+        if replica_uris:
+            self.router = ReplicaRouter(
+                self.pool,
+                [ConnectionPool(uri, **pool_kwargs) for uri in replica_uris],
+                strategy=replica_strategy,
+                max_lag=replica_max_lag,
+                eject_for=replica_eject_for,
+                check_interval=replica_check_interval,
+            )
+        self.hierarchy = RegionHierarchy(
+            ttl=hierarchy_ttl,
+            miss_reload_interval=hierarchy_miss_reload_interval,
+        )
+
+        self.singleflight = SingleFlight() if coalesce_queries else None
+
+        self._statement_counts = Counter()
+        self._statement_counts_lock = threading.Lock()
+        self._local = threading.local()
 
     def get_db_conn(self):
-        # TODO: Implement DB connection pool.
+        """
+        Opens a new DB connection outside of the pool, the caller is
+        responsible for closing it.
+        """
         db_conn = psycopg2.connect(self.db_uri)
         return db_conn
 
+    def _reads_primary(self):
+        return getattr(self._local, "primary_reads", False)
+
+    @contextmanager
+    def primary_reads(self):
+        """
+        Context manager reading from the primary rather than from replicas
+        in the current thread, for reads that must see the latest commits.
+        """
+        previous = self._reads_primary()
+        self._local.primary_reads = True
+        try:
+            yield
+        finally:
+            self._local.primary_reads = previous
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager lending a pooled DB connection, to a replica if any
+        is usable (outside of `primary_reads`). Any open transaction is
+        rolled back when the connection is returned.
+        """
+        if self.router is None or self._reads_primary():
+            with phase("acquire"):
+                db_conn = self.pool.getconn()
+            try:
+                yield db_conn
+            finally:
+                self.pool.putconn(db_conn)
+            return
+
+        with phase("acquire"):
+            node, db_conn = self.router.getconn()
+        error = None
+        try:
+            yield db_conn
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.router.putconn(node, db_conn, error)
+
+    @contextmanager
+    def cursor(self):
+        """
+        Context manager yielding a cursor on a pooled DB connection.
+        """
+        with self.connection() as db_conn:
+            with db_conn.cursor() as db_cursor:
+                yield db_cursor
+
+    def refresh_hierarchy(self):
+        """
+        Reloads the in-memory region hierarchy from the DB.
+        """
+        with self.cursor() as db_cursor:
+            self.hierarchy.refresh(db_cursor)
+
+    def warm_up(self):
+        """
+        Loads the state needed to serve requests ahead of the first one.
+        """
+        self.refresh_hierarchy()
+
+    def pool_stats(self):
+        return self.pool.stats()
+
+    def _count(self, name):
+        with self._statement_counts_lock:
+            self._statement_counts[name] += 1
+
+    def statement_stats(self):
+        with self._statement_counts_lock:
+            counts = dict(self._statement_counts)
+        return {
+            "prepare_statements": self.prepare_statements,
+            "plan_cache_mode": self.plan_cache_mode or "default",
+            "prepares": counts.get("prepares", 0),
+            "reprepares": counts.get("reprepares", 0),
+            "prepared_executions": counts.get("prepared_executions", 0),
+            "text_executions": counts.get("text_executions", 0),
+            "canceled": counts.get("canceled", 0),
+        }
+
+    def stats(self):
+        stats = {
+            "db_pool": self.pool_stats(),
+            "statements": self.statement_stats(),
+        }
+        if self.router is not None:
+            stats["db_replicas"] = self.router.stats()
+        if self.singleflight is not None:
+            stats["coalescing"] = self.singleflight.stats()
+        return stats
+
+    def _pools(self):
+        pools = [self.pool]
+        if self.router is not None:
+            pools.extend(node.pool for node in self.router.replicas)
+        return pools
+
+    def close(self):
+        for pool in self._pools():
+            pool.closeall()
+
+    def before_fork(self):
+        """
+        Prepares for forking worker processes, which must not inherit open
+        DB connections. The in-memory state is kept, and shared with the
+        workers copy-on-write.
+        """
+        for pool in self._pools():
+            pool.closeall()
+
+    def after_fork(self):
+        """
+        Gives a forked worker process its own DB pools.
+        """
+        for pool in self._pools():
+            pool.reset()
+        self._statement_counts_lock = threading.Lock()
+        if self.singleflight is not None:
+            self.singleflight = SingleFlight()
+
+    def _rates_params(
+        self,
+        db_cursor,
+        start_date,
+        end_date,
+        origin,
+        destination,
+        min_price_count
+    ):
+        """
+        Returns the parameters of the rates statements (of the configured
+        `region_resolution`) for a lane, or None if the origin or destination
+        covers no ports.
+        """
+        if self.region_resolution == "database":
+            return {
+                "start_date": start_date,
+                "end_date": end_date,
+                "origin": origin,
+                "destination": destination,
+                "min_price_count": min_price_count,
+            }
+
+        with phase("resolve"):
+            origin_codes = self.hierarchy.resolve(db_cursor, origin)
+            destination_codes = self.hierarchy.resolve(db_cursor, destination)
+        if not origin_codes or not destination_codes:
+            return None
+
+        return avg_rates_params(
+            start_date,
+            end_date,
+            origin_codes,
+            destination_codes,
+            min_price_count
+        )
+
+    def _avg_rates_query(
+        self,
+        db_cursor,
+        start_date,
+        end_date,
+        origin,
+        destination,
+        min_price_count,
+        granularity="day"
+    ):
+        """
+        Returns the statement and parameters fetching average price rates
+        per `granularity` bucket, or None if the origin or destination covers
+        no ports. The parameters also fit the matching price buckets
+        statement.
+        """
+        params = self._rates_params(
+            db_cursor,
+            start_date,
+            end_date,
+            origin,
+            destination,
+            min_price_count
+        )
+        if params is None:
+            return None
+
+        if self.region_resolution == "database":
+            return CLOSURE_AVG_RATES_STATEMENTS[granularity], params
+        return AVG_RATES_STATEMENTS[granularity], params
+
+    def _price_buckets_statement(self, granularity):
+        if self.region_resolution == "database":
+            return CLOSURE_PRICE_BUCKETS_STATEMENTS[granularity]
+        return PRICE_BUCKETS_STATEMENTS[granularity]
+
+    def _is_port(self, db_cursor, origin, destination):
+        """
+        Returns whether the origin and destination are port codes (rather
+        than region slugs), looked up in `ports` with database resolution,
+        which leaves the in-memory hierarchy unloaded.
+        """
+        if self.region_resolution == "database":
+            db_cursor.execute(
+                "SELECT EXISTS (SELECT 1 FROM ports WHERE code = %s), "
+                "EXISTS (SELECT 1 FROM ports WHERE code = %s)",
+                (origin, destination),
+            )
+            is_port = db_cursor.fetchone()
+        else:
+            is_port = (
+                self.hierarchy.is_port(origin),
+                self.hierarchy.is_port(destination),
+            )
+        record_lane_ports(*is_port)
+        return is_port
+
+    def _cost_class(
+        self,
+        db_cursor,
+        start_date,
+        end_date,
+        origin,
+        destination
+    ):
+        """
+        Returns the cost class of a rates query, None without
+        `statement_timeouts` to choose from.
+        """
+        if not self.statement_timeouts:
+            return None
+        return cost_class(
+            *self._is_port(db_cursor, origin, destination),
+            _span_days(start_date, end_date)
+        )
+
+    def _limit_statements(self, db_cursor, cost):
+        """
+        Sets the `statement_timeout` of the `cost` class for the rest of the
+        transaction of `db_cursor`.
+        """
+        timeout = self.statement_timeouts.get(cost)
+        if timeout:
+            db_cursor.execute(
+                "SET LOCAL statement_timeout = %s", (int(timeout),)
+            )
+
+    def _execute_prepared(self, db_cursor, statement, params, cost=None):
+        """
+        Runs a prepared statement, preparing it first if needed. Only
+        connections of the pool keep track of their prepared statements.
+        """
+        db_conn = db_cursor.connection
+        if statement.name not in db_conn.prepared:
+            db_cursor.execute(statement.prepare_sql)
+            db_conn.prepared.add(statement.name)
+            self._count("prepares")
+
+        args = statement.args(params)
+        try:
+            db_cursor.execute(statement.execute_sql, args)
+        except psycopg2.errors.InvalidSqlStatementName:
+            # Dropped behind our back, e.g. by DISCARD ALL in a connection
+            # pooler. The failed statement aborted the (read-only)
+            # transaction, and prepared statements outlive rollbacks.
+            db_conn.rollback()
+            self._limit_statements(db_cursor, cost)
+            db_cursor.execute(statement.prepare_sql)
+            self._count("reprepares")
+            db_cursor.execute(statement.execute_sql, args)
+
+        self._count("prepared_executions")
+        return db_cursor.fetchall()
+
+    def _fetch(self, db_cursor, statement, params, cost=None):
+        """
+        Runs a statement, prepared with `prepare_statements` on a pooled
+        connection or else as text, and returns its rows. `cost` is the cost
+        class whose timeout limits the transaction (see `_limit_statements`),
+        set again if the transaction has to be rolled back.
+        """
+        try:
+            if (
+                self.prepare_statements and
+                hasattr(db_cursor.connection, "prepared")
+            ):
+                return self._execute_prepared(
+                    db_cursor, statement, params, cost
+                )
+
+            db_cursor.execute(statement.query, params)
+            self._count("text_executions")
+            return db_cursor.fetchall()
+        except psycopg2.errors.QueryCanceled:
+            self._count("canceled")
+            raise
+
     def get_avg_rates(
         self,
         db_cursor,
@@ -18,78 +669,348 @@ class DBAPI(object):
         end_date,
         origin,
         destination,
-        min_price_count=3
+        min_price_count=3,
+        granularity="day",
+        stats=()
     ):
         """
         Query for fetching daily average price rates between the given
-        origin and destination port/region.
+        origin and destination port/region. Regions are resolved to their
+        port codes through the in-memory hierarchy index (or the
+        `port_ancestors` table, see `region_resolution`), and averages are
+        computed from the per lane-day sums and counts in `daily_lane_stats`.
+        With a `week` or `month` granularity, averages are computed per
+        bucket, labelled by its first day.
+
+        `stats` names price percentiles (`median`, `p10`, ...) to append to
+        every row, estimated from the merged sketches of all lanes in
+        `daily_lane_price_buckets`.
+
+        With `prepare_statements`, the query runs as a statement prepared
+        once per pooled connection.
         """
+        query = self._avg_rates_query(
+            db_cursor,
+            start_date,
+            end_date,
+            origin,
+            destination,
+            min_price_count,
+            granularity
+        )
+        if query is None:
+            return []
 
+        statement, params = query
+        cost = self._cost_class(
+            db_cursor, start_date, end_date, origin, destination
+        )
+        self._limit_statements(db_cursor, cost)
+        with phase("query"):
+            rows = self._fetch(db_cursor, statement, params, cost)
+            if stats:
+                bucket_rows = self._fetch(
+                    db_cursor,
+                    self._price_buckets_statement(granularity),
+                    params,
+                    cost,
+                )
+                rows = with_quantiles(
+                    rows,
+                    bucket_rows,
+                    [stat_quantile(name) for name in stats],
+                    min_price_count,
+                )
+        return rows
+
+    def iter_avg_rates(
+        self,
+        start_date,
+        end_date,
+        origin,
+        destination,
+        min_price_count=3,
+        granularity="day",
+        stats=()
+    ):
         """
-        CTEs:
-            sub_regions: CTE for recursively querying nested sub-regions
-                         for every main/parent region
-            ports_prices: CTE for querying prices between origin and
-                          destination ports.
+        Generator yielding daily average price rates (see `get_avg_rates`)
+        from a server-side cursor on a pooled DB connection, so that only
+        `stream_itersize` rows are held in memory at a time. The connection
+        is returned to the pool once the generator is exhausted or closed.
+        Rates with `stats` are fetched at once.
         """
-        query = """
-            WITH RECURSIVE sub_regions AS (
-                SELECT parent_slug, slug FROM regions
-                WHERE parent_slug IS NOT NULL
-                UNION ALL
-                SELECT s.parent_slug, r.slug
-                FROM sub_regions as s
-                INNER JOIN regions AS r ON s.slug = r.parent_slug
-            ),
-            ports_prices AS (
-                SELECT prices.*,
-                       orig_ports.parent_slug AS orig_slug,
-                       dest_ports.parent_slug AS dest_slug
-                FROM prices
-                INNER JOIN ports AS orig_ports
-                    ON prices.orig_code = orig_ports.code
-                INNER JOIN ports AS dest_ports
-                    ON prices.dest_code = dest_ports.code
+        if stats:
+            yield from self.fetch_avg_rates(
+                start_date,
+                end_date,
+                origin,
+                destination,
+                min_price_count=min_price_count,
+                granularity=granularity,
+                stats=stats
+            )
+            return
+
+        with self.connection() as db_conn:
+            with db_conn.cursor() as db_cursor:
+                query = self._avg_rates_query(
+                    db_cursor,
+                    start_date,
+                    end_date,
+                    origin,
+                    destination,
+                    min_price_count,
+                    granularity
+                )
+                if query is not None:
+                    self._limit_statements(
+                        db_cursor,
+                        self._cost_class(
+                            db_cursor, start_date, end_date, origin,
+                            destination
+                        ),
+                    )
+            if query is None:
+                return
+
+            with db_conn.cursor(name="avg_rates_stream") as stream_cursor:
+                stream_cursor.itersize = self.stream_itersize
+                statement, params = query
+                with phase("query"):
+                    stream_cursor.execute(statement.query, params)
+                for row in stream_cursor:
+                    yield row
+
+    def fetch_avg_rates(
+        self,
+        start_date,
+        end_date,
+        origin,
+        destination,
+        min_price_count=3,
+        granularity="day",
+        stats=()
+    ):
+        """
+        Fetches daily average price rates (see `get_avg_rates`) on a pooled
+        DB connection. With `coalesce_queries`, concurrent calls with the
+        same arguments share one query and its (not to be mutated) result.
+        """
+        def fetch():
+            with self.cursor() as db_cursor:
+                return self.get_avg_rates(
+                    db_cursor,
+                    start_date,
+                    end_date,
+                    origin,
+                    destination,
+                    min_price_count=min_price_count,
+                    granularity=granularity,
+                    stats=stats
+                )
+
+        if self.singleflight is None:
+            return fetch()
+
+        key = (
+            "avg_rates",
+            str(start_date),
+            str(end_date),
+            origin,
+            destination,
+            min_price_count,
+            granularity,
+            tuple(stats),
+            self._reads_primary(),
+        )
+        return self.singleflight.do(key, fetch)
+
+    def get_lane_matrix(
+        self,
+        db_cursor,
+        start_date,
+        end_date,
+        origin,
+        destination,
+        min_price_count=3,
+        granularity=None
+    ):
+        """
+        Query for fetching the average price of every lane (port pair)
+        between the given origin and destination port/region over the date
+        range, as `(orig_code, dest_code, average_price)` rows ordered by
+        lane. With a granularity, averages are computed per lane and day (or
+        week/month bucket) instead, as `(orig_code, dest_code, day,
+        average_price)` rows. Lanes and buckets without prices are omitted,
+        and averages of less than `min_price_count` prices are None.
+
+        Regions are resolved like in `get_avg_rates`, and all lanes are
+        averaged in one grouped scan of `daily_lane_stats`.
+        """
+        params = self._rates_params(
+            db_cursor,
+            start_date,
+            end_date,
+            origin,
+            destination,
+            min_price_count
+        )
+        if params is None:
+            return []
+
+        if self.region_resolution == "database":
+            statement = CLOSURE_LANE_MATRIX_STATEMENTS[granularity]
+        else:
+            statement = LANE_MATRIX_STATEMENTS[granularity]
+        cost = self._cost_class(
+            db_cursor, start_date, end_date, origin, destination
+        )
+        self._limit_statements(db_cursor, cost)
+        with phase("query"):
+            return self._fetch(db_cursor, statement, params, cost)
+
+    def fetch_lane_matrix(
+        self,
+        start_date,
+        end_date,
+        origin,
+        destination,
+        min_price_count=3,
+        granularity=None
+    ):
+        """
+        Fetches the lane matrix (see `get_lane_matrix`) on a pooled DB
+        connection.
+        """
+        with self.cursor() as db_cursor:
+            return self.get_lane_matrix(
+                db_cursor,
+                start_date,
+                end_date,
+                origin,
+                destination,
+                min_price_count=min_price_count,
+                granularity=granularity
             )
-            SELECT day,
+
+    def get_batch_avg_rates(self, db_cursor, lanes, min_price_count=3):
+        """
+        Query for fetching daily average price rates of many lanes at once.
+        `lanes` is a sequence of `(start_date, end_date, origin, destination)`
+        tuples, optionally followed by a granularity (see `get_avg_rates`); a
+        list of `(day, average_price)` rows is returned per lane, in the same
+        order.
+
+        Every lane is sent as one row with the port codes of its origin and
+        destination (or, with database resolution, the origin and
+        destination themselves, resolved in the query like in
+        `get_avg_rates`), joined with `daily_lane_stats` in a single
+        set-based query, limited by the statement timeout of the costliest
+        lane.
+        """
+        database = self.region_resolution == "database"
+        values = []
+        for lane_id, lane in enumerate(lanes):
+            start_date, end_date, origin, destination = lane[:4]
+            granularity = lane[4] if len(lane) > 4 else "day"
+            if not database:
+                with phase("resolve"):
+                    origin = sorted(self.hierarchy.resolve(db_cursor, origin))
+                    destination = sorted(
+                        self.hierarchy.resolve(db_cursor, destination)
+                    )
+                if not origin or not destination:
+                    continue
+            values.append(
+                (lane_id, origin, destination, start_date, end_date, granularity)
+            )
+
+        results = [[] for _ in lanes]
+        if not values:
+            return results
+
+        if self.statement_timeouts:
+            self._limit_statements(
+                db_cursor,
+                max(
+                    (self._cost_class(db_cursor, *lane[:4]) for lane in lanes),
+                    key=COST_CLASSES.index,
+                ),
+            )
+
+        if database:
+            codes_type = "text"
+            origin_codes = """ARRAY(
+                       SELECT port_code FROM port_ancestors
+                       WHERE ancestor_slug = lanes.origin
+                   ) || lanes.origin"""
+            destination_codes = """ARRAY(
+                       SELECT port_code FROM port_ancestors
+                       WHERE ancestor_slug = lanes.destination
+                   ) || lanes.destination"""
+        else:
+            codes_type = "text[]"
+            origin_codes = "lanes.origin"
+            destination_codes = "lanes.destination"
+
+        query = """
+            SELECT lanes.lane_id,
+                   date_trunc(lanes.granularity, stats.day::timestamp)::date,
                    CASE
-                        WHEN COUNT(price) >= %(min_price_count)s THEN AVG(price)
+                        WHEN SUM(stats.price_count) >= {min_price_count}
+                        THEN SUM(stats.price_sum)::numeric / SUM(stats.price_count)
                         ELSE NULL
                    END AS average_price
-            FROM ports_prices
-            WHERE day >= %(start_date)s AND
-                  day <= %(end_date)s AND
-                (
-                    orig_code = %(origin)s OR
-                    orig_slug = %(origin)s OR
-                    orig_slug IN (
-                        SELECT slug
-                        FROM sub_regions
-                        WHERE parent_slug = %(origin)s
-                    )
-                ) AND
-                (
-                    dest_code = %(destination)s OR
-                    dest_slug = %(destination)s OR
-                    dest_slug IN (
-                        SELECT slug
-                        FROM sub_regions
-                        WHERE parent_slug = %(destination)s
-                    )
+            FROM (
+                SELECT lane_id,
+                       {origin_codes} AS orig_codes,
+                       {destination_codes} AS dest_codes,
+                       start_date,
+                       end_date,
+                       granularity
+                FROM (VALUES %s) AS lanes(
+                    lane_id, origin, destination, start_date, end_date,
+                    granularity
                 )
-            GROUP BY day
-            ORDER BY day
-        """
-        db_cursor.execute(
-            query,
-            {
-                "start_date": start_date,
-                "end_date": end_date,
-                "origin": origin,
-                "destination": destination,
-                "min_price_count": min_price_count
-            }
+            ) AS lanes
+            INNER JOIN daily_lane_stats AS stats
+                ON stats.orig_code = ANY(lanes.orig_codes) AND
+                   stats.dest_code = ANY(lanes.dest_codes) AND
+                   stats.day >= lanes.start_date AND
+                   stats.day <= lanes.end_date
+            GROUP BY 1, 2
+            ORDER BY 1, 2
+        """.format(
+            min_price_count=int(min_price_count),
+            origin_codes=origin_codes,
+            destination_codes=destination_codes,
         )
-        rows = db_cursor.fetchall()
-        return rows
+        with phase("query"):
+            try:
+                # One page, so that all lanes are grouped in one statement.
+                rows = execute_values(
+                    db_cursor,
+                    query,
+                    values,
+                    template="(%s, %s::{0}, %s::{0}, %s::date, %s::date, %s)"
+                    .format(codes_type),
+                    page_size=len(values),
+                    fetch=True,
+                )
+            except psycopg2.errors.QueryCanceled:
+                self._count("canceled")
+                raise
+        for lane_id, day, average_price in rows:
+            results[lane_id].append((day, average_price))
+        return results
 
+    def fetch_batch_avg_rates(self, lanes, min_price_count=3):
+        """
+        Fetches daily average price rates of many lanes (see
+        `get_batch_avg_rates`) on a pooled DB connection.
+        """
+        with self.cursor() as db_cursor:
+            return self.get_batch_avg_rates(
+                db_cursor, lanes, min_price_count=min_price_count
+            )
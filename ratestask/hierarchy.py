@@ -0,0 +1,156 @@
+import threading
+import time
+from collections import defaultdict
+
+
+REGIONS_QUERY = "SELECT slug, parent_slug FROM regions"
+PORTS_QUERY = "SELECT code, parent_slug FROM ports"
+
+
+class RegionHierarchy(object):
+    """
+    In-memory index of the regions/ports hierarchy, resolving a port code or
+    region slug to the set of port codes it covers (including the ports of
+    all nested sub-regions).
+
+    The index is loaded lazily through the DB cursor passed to `resolve`,
+    reloaded once it is older than `ttl` seconds, and reloaded early when an
+    unknown code/slug is looked up, at most every `miss_reload_interval`
+    seconds.
+    """
+
+    def __init__(self, ttl=300.0, miss_reload_interval=1.0):
+        self.ttl = ttl
+        self.miss_reload_interval = miss_reload_interval
+
+        self._index = None
+        self._port_codes = frozenset()
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def build_index(regions, ports):
+        """
+        Builds the lookup index from `(slug, parent_slug)` region rows and
+        `(code, parent_slug)` port rows.
+        """
+        sub_regions = defaultdict(list)
+        for slug, parent_slug in regions:
+            if parent_slug is not None:
+                sub_regions[parent_slug].append(slug)
+
+        region_ports = defaultdict(set)
+        for code, parent_slug in ports:
+            region_ports[parent_slug].add(code)
+
+        index = {}
+        for slug, _ in regions:
+            codes = set()
+            seen = set()
+            pending = [slug]
+            while pending:
+                region = pending.pop()
+                if region in seen:
+                    continue
+                seen.add(region)
+                codes.update(region_ports.get(region, ()))
+                pending.extend(sub_regions.get(region, ()))
+            index[slug] = frozenset(codes)
+
+        for code, _ in ports:
+            index[code] = index.get(code, frozenset()) | {code}
+
+        return index
+
+    @property
+    def index(self):
+        """
+        The current `code/slug -> port codes` index, None if not loaded.
+        """
+        return self._index
+
+    def load(self, regions, ports):
+        """
+        Replaces the index, returns the new one.
+        """
+        index = self.build_index(regions, ports)
+        self._index = index
+        self._port_codes = frozenset(code for code, _ in ports)
+        self._loaded_at = time.monotonic()
+        return index
+
+    def refresh(self, db_cursor):
+        """
+        Reloads the index from the `regions` and `ports` tables.
+        """
+        db_cursor.execute(REGIONS_QUERY)
+        regions = db_cursor.fetchall()
+        db_cursor.execute(PORTS_QUERY)
+        ports = db_cursor.fetchall()
+        return self.load(regions, ports)
+
+    def is_port(self, code):
+        """
+        Whether the given code is a port code (rather than a region slug) of
+        the loaded index.
+        """
+        return code in self._port_codes
+
+    def invalidate(self):
+        self._index = None
+
+    def _age(self):
+        if self._loaded_at is None:
+            return None
+        return time.monotonic() - self._loaded_at
+
+    def is_expired(self):
+        """
+        Whether the index was never loaded, invalidated, or is older than
+        `ttl` seconds.
+        """
+        return (
+            self._index is None or
+            (self.ttl is not None and self._age() > self.ttl)
+        )
+
+    def may_reload_on_miss(self):
+        """
+        Whether a lookup of an unknown code/slug may reload the index.
+        """
+        return (
+            self.miss_reload_interval is not None and
+            (self._loaded_at is None or self._age() > self.miss_reload_interval)
+        )
+
+    def _refresh_if(self, db_cursor, is_stale):
+        with self._lock:
+            # Another thread may have reloaded while we were waiting.
+            index = self._index
+            if index is None or is_stale():
+                index = self.refresh(db_cursor)
+        return index
+
+    def current(self, db_cursor):
+        """
+        Returns the index, reloaded first if it expired.
+        """
+        index = self._index
+        # Another thread may reload the index after it was read as None and
+        # before is_expired() reads it again.
+        if index is None or self.is_expired():
+            index = self._refresh_if(db_cursor, self.is_expired)
+        return index
+
+    def resolve(self, db_cursor, code_or_slug):
+        """
+        Returns the frozenset of port codes covered by the given port code or
+        region slug, an empty set if it is unknown.
+        """
+        index = self.current(db_cursor)
+        codes = index.get(code_or_slug)
+        if codes is None and self.may_reload_on_miss():
+            index = self._refresh_if(db_cursor, self.may_reload_on_miss)
+            codes = index.get(code_or_slug)
+
+        return codes or frozenset()
@@ -0,0 +1,292 @@
+"""
+Bulk ingestion of prices.
+
+Rows are read in chunks of `--chunk-size` from CSV (with an
+`orig_code,dest_code,day,price` header) or JSON lines files, copied into a
+temporary staging table with `COPY FROM STDIN`, checked against the known
+ports and merged into `prices`, all in a single transaction.
+
+Usage:
+    python ratestask/ingest.py [--database-uri URI] [--format csv|jsonl]
+                               [--chunk-size N] [--skip-invalid] FILE [FILE ...]
+
+`-` reads from stdin.
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import sys
+import time
+from collections import namedtuple
+
+import psycopg2
+
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ("orig_code", "dest_code", "day", "price")
+DEFAULT_CHUNK_SIZE = 50000
+
+
+class IngestError(Exception):
+    pass
+
+
+class IngestResult(
+    namedtuple(
+        "IngestResult",
+        ["rows_read", "rows_loaded", "invalid_codes", "seconds"]
+    )
+):
+
+    @property
+    def rows_rejected(self):
+        return self.rows_read - self.rows_loaded
+
+    @property
+    def rows_per_second(self):
+        return self.rows_read / self.seconds if self.seconds else 0.0
+
+
+def iter_csv_chunks(fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields lists of `(orig_code, dest_code, day, price)` rows read from a CSV
+    file whose header names the columns (in any order).
+    """
+    reader = csv.reader(fileobj)
+    header = next(reader, None)
+    if header is None:
+        return
+
+    header = [column.strip() for column in header]
+    missing = [column for column in COLUMNS if column not in header]
+    if missing:
+        raise IngestError("Missing CSV columns: {}".format(", ".join(missing)))
+    positions = [header.index(column) for column in COLUMNS]
+
+    chunk = []
+    for row in reader:
+        if not row:
+            continue
+        try:
+            chunk.append(tuple(row[position] for position in positions))
+        except IndexError:
+            raise IngestError(
+                "Missing values on CSV line {}".format(reader.line_num)
+            )
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_jsonl_chunks(fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields lists of `(orig_code, dest_code, day, price)` rows read from a
+    file with one JSON object per line.
+    """
+    chunk = []
+    for line_number, line in enumerate(fileobj, 1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+            chunk.append(tuple(item[column] for column in COLUMNS))
+        except (ValueError, KeyError, TypeError) as e:
+            raise IngestError(
+                "Invalid JSON line {}: {}".format(line_number, e)
+            )
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+CHUNK_READERS = {
+    "csv": iter_csv_chunks,
+    "jsonl": iter_jsonl_chunks,
+}
+
+
+def _copy_chunk(db_cursor, chunk):
+    buf = io.StringIO()
+    csv.writer(buf).writerows(chunk)
+    buf.seek(0)
+    db_cursor.copy_expert(
+        "COPY prices_staging (orig_code, dest_code, day, price) "
+        "FROM STDIN WITH (FORMAT csv)",
+        buf
+    )
+
+
+def ingest_chunks(db_conn, chunks, skip_invalid=False):
+    """
+    Loads chunks of `(orig_code, dest_code, day, price)` rows into `prices`
+    in a single transaction.
+
+    Rows referencing unknown port codes abort the load, or are left out with
+    `skip_invalid`.
+    """
+    started = time.monotonic()
+    rows_read = 0
+
+    with db_conn:
+        with db_conn.cursor() as db_cursor:
+            db_cursor.execute("""
+                CREATE TEMPORARY TABLE prices_staging
+                    (LIKE prices INCLUDING DEFAULTS)
+                ON COMMIT DROP
+            """)
+            for chunk in chunks:
+                _copy_chunk(db_cursor, chunk)
+                rows_read += len(chunk)
+                logger.debug("Staged %d rows", rows_read)
+
+            db_cursor.execute("ANALYZE prices_staging")
+            db_cursor.execute("""
+                SELECT codes.code
+                FROM (
+                    SELECT orig_code AS code FROM prices_staging
+                    UNION
+                    SELECT dest_code AS code FROM prices_staging
+                ) AS codes
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM ports WHERE ports.code = codes.code
+                )
+                ORDER BY codes.code
+            """)
+            invalid_codes = [code for code, in db_cursor.fetchall()]
+            if invalid_codes and not skip_invalid:
+                raise IngestError(
+                    "Unknown port codes: {}".format(", ".join(invalid_codes))
+                )
+
+            db_cursor.execute("""
+                INSERT INTO prices (orig_code, dest_code, day, price)
+                SELECT staging.orig_code,
+                       staging.dest_code,
+                       staging.day,
+                       staging.price
+                FROM prices_staging AS staging
+                INNER JOIN ports AS orig_ports
+                    ON staging.orig_code = orig_ports.code
+                INNER JOIN ports AS dest_ports
+                    ON staging.dest_code = dest_ports.code
+            """)
+            rows_loaded = db_cursor.rowcount
+
+    return IngestResult(
+        rows_read=rows_read,
+        rows_loaded=rows_loaded,
+        invalid_codes=invalid_codes,
+        seconds=time.monotonic() - started,
+    )
+
+
+def ingest_file(
+    db_conn,
+    fileobj,
+    fmt="csv",
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    skip_invalid=False
+):
+    """
+    Loads prices from a CSV or JSON lines file object, see `ingest_chunks`.
+    Values Postgres rejects (e.g. malformed dates or missing prices) abort
+    the load with an `IngestError`.
+    """
+    try:
+        read_chunks = CHUNK_READERS[fmt]
+    except KeyError:
+        raise IngestError("Unknown format: {}".format(fmt))
+
+    try:
+        return ingest_chunks(
+            db_conn,
+            read_chunks(fileobj, chunk_size=chunk_size),
+            skip_invalid=skip_invalid,
+        )
+    except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+        raise IngestError("Invalid values: {}".format(str(e).strip()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk load prices.")
+    parser.add_argument(
+        "--database-uri",
+        default=os.getenv("DATABASE_URI"),
+        help="Postgres connection URI (default: $DATABASE_URI)",
+    )
+    parser.add_argument(
+        "--format",
+        choices=sorted(CHUNK_READERS),
+        help="Input format (default: from the file extension, else csv)",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="Rows held in memory and copied per round trip",
+    )
+    parser.add_argument(
+        "--skip-invalid",
+        action="store_true",
+        help="Skip rows with unknown port codes instead of aborting",
+    )
+    parser.add_argument("files", nargs="+", metavar="FILE")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    db_conn = psycopg2.connect(args.database_uri)
+    try:
+        for path in args.files:
+            fmt = args.format or (
+                "jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv"
+            )
+            if path == "-":
+                fileobj = sys.stdin
+            else:
+                fileobj = open(path, newline="")
+            try:
+                result = ingest_file(
+                    db_conn,
+                    fileobj,
+                    fmt=fmt,
+                    chunk_size=args.chunk_size,
+                    skip_invalid=args.skip_invalid,
+                )
+            except (IngestError, psycopg2.Error) as e:
+                print("{}: {}".format(path, e), file=sys.stderr)
+                return 1
+            finally:
+                if fileobj is not sys.stdin:
+                    fileobj.close()
+
+            print(
+                "{}: loaded {} of {} rows in {:.2f}s ({:.0f} rows/s)".format(
+                    path,
+                    result.rows_loaded,
+                    result.rows_read,
+                    result.seconds,
+                    result.rows_per_second,
+                )
+            )
+            if result.invalid_codes:
+                print(
+                    "{}: skipped {} rows with unknown port codes: {}".format(
+                        path,
+                        result.rows_rejected,
+                        ", ".join(result.invalid_codes),
+                    )
+                )
+    finally:
+        db_conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,213 @@
+"""
+Invalidation of cached rates on changes of the rates data.
+
+Triggers of the 0006 migration notify the `rates_changed` channel with the
+table a transaction changed and, for `prices`, the changed lanes and their
+first and last changed day. `ChangeListener` receives them on a dedicated
+connection in a background thread, and `invalidate_app` evicts the cached
+responses whose lanes and dates overlap with the change, and reloads the
+region hierarchy after changes of ports or regions.
+"""
+import json
+import logging
+import select
+import threading
+from collections import namedtuple
+from datetime import date
+
+import psycopg2
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "rates_changed"
+
+
+LaneChange = namedtuple(
+    "LaneChange", ["orig_code", "dest_code", "start_date", "end_date"]
+)
+
+
+class Change(namedtuple("Change", ["table", "lanes"])):
+    """
+    A committed change of `table`, limited to the `LaneChange`s in `lanes`,
+    or of anything in it when `lanes` is None. A change of table None stands
+    for changes that may have been missed.
+    """
+
+
+ANY_CHANGE = Change(None, None)
+
+
+def parse_change(payload):
+    """
+    Parses the JSON payload of a `rates_changed` notification.
+    """
+    data = json.loads(payload)
+    lanes = data.get("lanes")
+    if lanes is not None:
+        lanes = [
+            LaneChange(
+                lane["orig"],
+                lane["dest"],
+                date.fromisoformat(lane["from"]),
+                date.fromisoformat(lane["to"]),
+            )
+            for lane in lanes
+        ]
+    return Change(data.get("table"), lanes)
+
+
+def affects(change, kwargs, index):
+    """
+    Whether `change` may alter the result of a rates handler called with
+    `kwargs` (`origin`, `destination`, `date_from` and `date_to`), given
+    the region hierarchy `index` (see `RegionHierarchy.index`).
+    """
+    if change.lanes is None or index is None or "origin" not in kwargs:
+        return True
+
+    origin_codes = index.get(kwargs["origin"], ())
+    destination_codes = index.get(kwargs["destination"], ())
+    return any(
+        lane.orig_code in origin_codes and
+        lane.dest_code in destination_codes and
+        lane.start_date <= kwargs["date_to"] and
+        lane.end_date >= kwargs["date_from"]
+        for lane in change.lanes
+    )
+
+
+def invalidate_app(app, change):
+    """
+    Evicts the cached responses of `app` affected by `change`, and drops its
+    region hierarchy unless only prices changed.
+    """
+    hierarchy = app.db.hierarchy
+    if change.table != "prices":
+        hierarchy.invalidate()
+
+    if app.rates_cache is not None:
+        index = hierarchy.index
+        evicted = app.rates_cache.evict(
+            lambda key: affects(change, dict(key[1]), index)
+        )
+        logger.debug("Evicted %d cached responses on %s", evicted, change)
+
+
+class ChangeListener(object):
+    """
+    Listens to `rates_changed` notifications on a dedicated connection to
+    `db_uri`, in a background thread, and calls `on_change` with every
+    `Change`. When the connection is lost, it reconnects every
+    `reconnect_interval` seconds and reports `ANY_CHANGE`, as notifications
+    may have been missed meanwhile. Stopping takes up to `poll_interval`
+    seconds.
+    """
+
+    def __init__(
+        self,
+        db_uri,
+        on_change,
+        poll_interval=1.0,
+        reconnect_interval=5.0
+    ):
+        self.db_uri = db_uri
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.reconnect_interval = reconnect_interval
+
+        self._thread = None
+        self._stop = threading.Event()
+        self._connected = threading.Event()
+        self._notifications = 0
+        self._reconnects = 0
+
+    def _connect(self):
+        db_conn = psycopg2.connect(self.db_uri)
+        db_conn.autocommit = True
+        with db_conn.cursor() as db_cursor:
+            db_cursor.execute("LISTEN {}".format(CHANNEL))
+        return db_conn
+
+    def _dispatch(self, change):
+        try:
+            self.on_change(change)
+        except Exception:
+            logger.exception("Handling %s failed", change)
+
+    def _listen(self, db_conn):
+        while not self._stop.is_set():
+            if not select.select([db_conn], [], [], self.poll_interval)[0]:
+                continue
+            db_conn.poll()
+            while db_conn.notifies:
+                notify = db_conn.notifies.pop(0)
+                self._notifications += 1
+                try:
+                    change = parse_change(notify.payload)
+                except (ValueError, KeyError) as e:
+                    logger.warning(
+                        "Invalid %s payload %r: %s", CHANNEL, notify.payload, e
+                    )
+                    change = ANY_CHANGE
+                self._dispatch(change)
+
+    def _run(self):
+        connected_before = False
+        while not self._stop.is_set():
+            try:
+                db_conn = self._connect()
+            except psycopg2.Error as e:
+                logger.warning("Could not listen to %s: %s", CHANNEL, e)
+                self._stop.wait(self.reconnect_interval)
+                continue
+
+            if connected_before:
+                self._reconnects += 1
+                self._dispatch(ANY_CHANGE)
+            connected_before = True
+            self._connected.set()
+            try:
+                self._listen(db_conn)
+            except (psycopg2.Error, OSError) as e:
+                logger.warning("Lost %s listener connection: %s", CHANNEL, e)
+                self._stop.wait(self.reconnect_interval)
+            finally:
+                self._connected.clear()
+                db_conn.close()
+
+    def start(self):
+        """
+        Starts the listener thread.
+        """
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="change-listener", daemon=True
+        )
+        self._thread.start()
+
+    def wait_connected(self, timeout=None):
+        """
+        Waits until the listener is subscribed, returns whether it is.
+        """
+        return self._connected.wait(timeout)
+
+    def stop(self):
+        """
+        Stops the listener thread and closes its connection.
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def stats(self):
+        return {
+            "connected": self._connected.is_set(),
+            "notifications": self._notifications,
+            "reconnects": self._reconnects,
+        }
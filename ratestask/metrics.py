@@ -0,0 +1,268 @@
+"""
+Request instrumentation.
+
+Code paths of a request are timed with `phase(name)` (validate, acquire,
+resolve, query, serialize). Per request the phase timings are sent in a
+`Server-Timing` header, recorded in latency histograms labelled by endpoint
+and lane type, and logged when the request took longer than the slow request
+threshold. The histograms are rendered in the Prometheus text format by
+`RequestMetrics.render`.
+
+For streamed responses only the time until the response is started is
+measured.
+"""
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import (
+    current_app as app,
+    g,
+    has_request_context,
+    request,
+)
+
+
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    10.0,
+)
+
+# Runtime stats that only ever grow, rendered as counters rather than gauges.
+COUNTER_STATS = frozenset((
+    "acquired", "admitted", "canceled", "closed", "coalesced", "ejections",
+    "evictions", "executions", "expirations", "fallbacks", "hits",
+    "invalidations", "misses", "notifications", "opened", "prepared_executions",
+    "prepares", "queued", "reads", "reconnects", "rejected", "reprepares",
+    "text_executions", "timeouts", "waits",
+))
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(
+        '{}="{}"'.format(
+            name,
+            str(value)
+            .replace("\\", "\\\\")
+            .replace('"', '\\"')
+            .replace("\n", "\\n"),
+        )
+        for name, value in labels
+    ) + "}"
+
+
+class Histogram(object):
+    """
+    Thread-safe Prometheus-style histogram with a fixed set of label names.
+    """
+
+    def __init__(self, name, description, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        with self._lock:
+            series = sorted(
+                (key, (list(counts), total, count))
+                for key, (counts, total, count) in self._series.items()
+            )
+
+        lines = [
+            "# HELP {} {}".format(self.name, self.description),
+            "# TYPE {} histogram".format(self.name),
+        ]
+        for key, (counts, total, count) in series:
+            labels = list(zip(self.label_names, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append("{}_bucket{} {}".format(
+                    self.name,
+                    _format_labels(labels + [("le", _format_value(bound))]),
+                    cumulative,
+                ))
+            lines.append("{}_sum{} {}".format(
+                self.name, _format_labels(labels), _format_value(total)
+            ))
+            lines.append("{}_count{} {}".format(
+                self.name, _format_labels(labels), count
+            ))
+        return lines
+
+
+@contextmanager
+def phase(name):
+    """
+    Context manager adding the time spent in the block to the `name` phase
+    of the current request, a no-op outside of a request.
+    """
+    if not has_request_context():
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = g.setdefault("phase_timings", {})
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - started
+
+
+def record_lane_ports(origin_is_port, destination_is_port):
+    """
+    Records whether the origin and destination of the current request are
+    port codes, as found while querying, for its lane type label.
+    """
+    if has_request_context():
+        g.lane_ports = (origin_is_port, destination_is_port)
+
+
+def lane_type(origin, destination):
+    """
+    Returns the lane type label (e.g. `port_region`) of the given origin and
+    destination, as recorded by `record_lane_ports` or else according to the
+    region hierarchy of the app.
+    """
+    is_port = g.get("lane_ports")
+    if is_port is None:
+        hierarchy = app.db.hierarchy
+        is_port = [hierarchy.is_port(code) for code in (origin, destination)]
+    return "_".join("port" if flag else "region" for flag in is_port)
+
+
+def labelled_by_lane(func):
+    """
+    Decorator labelling the metrics of a request by the lane type of its
+    validated `origin` and `destination` arguments.
+    """
+    @wraps(func)
+    def decorated(*args, **kwargs):
+        # Classified once the request is done, when the hierarchy is loaded.
+        g.lane = (kwargs["origin"], kwargs["destination"])
+        return func(*args, **kwargs)
+
+    return decorated
+
+
+def server_timing(timings, total):
+    """
+    Formats phase timings (in seconds) as a `Server-Timing` header value.
+    """
+    return ", ".join(
+        "{};dur={:.3f}".format(name, seconds * 1000.0)
+        for name, seconds in list(timings.items()) + [("total", total)]
+    )
+
+
+def _stats_lines(prefix, stats):
+    lines = []
+    for key, value in sorted(stats.items()):
+        name = "{}_{}".format(prefix, key)
+        if isinstance(value, dict):
+            lines.extend(_stats_lines(name, value))
+        elif isinstance(value, (bool, int, float)):
+            lines.append("# TYPE {} {}".format(
+                name, "counter" if key in COUNTER_STATS else "gauge"
+            ))
+            lines.append("{} {}".format(name, _format_value(value)))
+    return lines
+
+
+class RequestMetrics(object):
+    """
+    Collects per-request phase timings of an app, see the module docstring.
+    Requests slower than `slow_request_threshold_ms` are logged with their
+    parameters, unless the threshold is None or 0.
+    """
+
+    def __init__(self, slow_request_threshold_ms=None):
+        self.slow_request_threshold_ms = slow_request_threshold_ms
+        self.request_duration = Histogram(
+            "ratestask_request_duration_seconds",
+            "Request latency.",
+            ("endpoint", "lane_type"),
+        )
+        self.phase_duration = Histogram(
+            "ratestask_request_phase_duration_seconds",
+            "Time spent per request phase.",
+            ("endpoint", "lane_type", "phase"),
+        )
+
+    def init_app(self, app):
+        app.metrics = self
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    def _start_request(self):
+        g.request_started = time.perf_counter()
+
+    def _finish_request(self, response):
+        started = g.get("request_started")
+        if started is None:
+            return response
+
+        total = time.perf_counter() - started
+        timings = g.get("phase_timings", {})
+        lane = g.get("lane")
+        labels = {
+            "endpoint": request.endpoint or "unknown",
+            "lane_type": lane_type(*lane) if lane is not None else "none",
+        }
+        self.request_duration.observe(total, **labels)
+        for name, seconds in timings.items():
+            self.phase_duration.observe(seconds, phase=name, **labels)
+
+        header = server_timing(timings, total)
+        response.headers["Server-Timing"] = header
+
+        threshold = self.slow_request_threshold_ms
+        if threshold and total * 1000.0 >= threshold:
+            app.logger.warning(
+                "Slow request %s %s (%s): %s, params: %s",
+                request.method,
+                request.path,
+                response.status_code,
+                header,
+                request.get_json(silent=True) if request.is_json
+                else request.args.to_dict(),
+            )
+        return response
+
+    def render(self, stats=None):
+        """
+        Renders the histograms, and the given (nested) runtime stats as
+        gauges, in the Prometheus text format.
+        """
+        lines = self.request_duration.render() + self.phase_duration.render()
+        if stats:
+            lines.extend(_stats_lines("ratestask", stats))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,384 @@
+"""
+Versioned schema migrations.
+
+Migrations live in `ratestask/migrations` as pairs of SQL scripts named
+`<version>_<name>.up.sql` / `<version>_<name>.down.sql`. Applied versions are
+tracked in the `schema_migrations` table.
+
+Scripts are run in a single transaction unless their first line is
+`-- migrate: no-transaction`, which is needed for statements such as
+`CREATE INDEX CONCURRENTLY`. Those scripts are run statement by statement in
+autocommit mode, so they must be idempotent (`IF [NOT] EXISTS`) and must not
+contain `;` inside statements.
+
+Postgres cannot build or drop indexes of partitioned tables (see
+`ratestask/partitions.py`) concurrently. On those, `CREATE INDEX
+CONCURRENTLY` creates the index on the parent only, builds it concurrently
+on each partition and attaches it, and `DROP INDEX CONCURRENTLY` drops the
+index with a plain `DROP INDEX`.
+
+Usage:
+    python ratestask/migrate.py [--database-uri URI] status
+    python ratestask/migrate.py [--database-uri URI] upgrade [--to VERSION]
+    python ratestask/migrate.py [--database-uri URI] downgrade [--to VERSION]
+
+`--wait SECONDS` retries connecting for up to that long, e.g. while the
+database container is still starting.
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+import psycopg2
+
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+NO_TRANSACTION_MARKER = "-- migrate: no-transaction"
+
+# Arbitrary key of the advisory lock serializing concurrent migration runs.
+MIGRATIONS_LOCK_KEY = 7283901
+
+_FILENAME_RE = re.compile(r"^(\d+)_(\w+)\.(up|down)\.sql$")
+_CREATE_INDEX_RE = re.compile(
+    r"^CREATE\s+(UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(IF\s+NOT\s+EXISTS\s+)?"
+    r"(\w+)\s+ON\s+(\w+)\s+(.*)$",
+    re.IGNORECASE | re.DOTALL,
+)
+_DROP_INDEX_RE = re.compile(
+    r"^DROP\s+INDEX\s+CONCURRENTLY\s+(IF\s+EXISTS\s+)?(\w+)$",
+    re.IGNORECASE,
+)
+
+
+class MigrationError(Exception):
+    pass
+
+
+class Migration(object):
+
+    def __init__(self, version, name, up_path, down_path):
+        self.version = version
+        self.name = name
+        self.up_path = up_path
+        self.down_path = down_path
+
+    def read(self, direction):
+        path = self.up_path if direction == "up" else self.down_path
+        if path is None:
+            raise MigrationError(
+                "Migration {} has no {} script".format(self, direction)
+            )
+        with open(path) as f:
+            return f.read()
+
+    def __str__(self):
+        return "{:04d}_{}".format(self.version, self.name)
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    """
+    Returns the migrations found in the given directory, ordered by version.
+    """
+    found = {}
+    for filename in os.listdir(directory):
+        match = _FILENAME_RE.match(filename)
+        if not match:
+            continue
+
+        version, name, direction = match.groups()
+        version = int(version)
+        paths = found.setdefault(version, {"name": name})
+        if paths["name"] != name:
+            raise MigrationError(
+                "Conflicting names for migration version {}".format(version)
+            )
+        paths[direction] = os.path.join(directory, filename)
+
+    return [
+        Migration(version, paths["name"], paths.get("up"), paths.get("down"))
+        for version, paths in sorted(found.items())
+    ]
+
+
+def split_statements(sql):
+    """
+    Splits a script into its statements, dropping comment-only lines.
+    """
+    lines = [
+        line for line in sql.splitlines()
+        if not line.strip().startswith("--")
+    ]
+    statements = "\n".join(lines).split(";")
+    return [statement.strip() for statement in statements if statement.strip()]
+
+
+def is_transactional(sql):
+    return not sql.lstrip().startswith(NO_TRANSACTION_MARKER)
+
+
+class Migrator(object):
+
+    def __init__(self, db_conn, migrations=None):
+        self.db_conn = db_conn
+        self.migrations = (
+            migrations if migrations is not None else load_migrations()
+        )
+
+    def _execute(self, query, params=None):
+        with self.db_conn.cursor() as db_cursor:
+            db_cursor.execute(query, params)
+            if db_cursor.description is not None:
+                return db_cursor.fetchall()
+
+    def _setup(self):
+        self.db_conn.autocommit = True
+        self._execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version integer PRIMARY KEY,
+                name text NOT NULL,
+                applied_at timestamp with time zone NOT NULL DEFAULT now()
+            )
+        """)
+        self._execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_KEY,))
+
+    def _teardown(self):
+        self._execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_KEY,))
+
+    def _relkind(self, name):
+        """
+        Returns the `pg_class.relkind` of a relation, None if it is missing.
+        """
+        rows = self._execute(
+            "SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (name,)
+        )
+        return rows[0][0] if rows else None
+
+    def _create_partitioned_index(self, unique, index, table, definition):
+        """
+        Creates an index on a partitioned table without blocking writes:
+        the index is created on the parent table only, built concurrently on
+        every partition and attached to the parent, which is valid once all
+        partitions are attached.
+        """
+        self._execute(
+            "CREATE {}INDEX {} ON ONLY {} {}".format(
+                unique, index, table, definition
+            )
+        )
+        children = self._execute(
+            """
+                SELECT pg_inherits.inhrelid::regclass::text, pg_class.relkind
+                FROM pg_inherits
+                INNER JOIN pg_class ON pg_class.oid = pg_inherits.inhrelid
+                WHERE pg_inherits.inhparent = %s::regclass
+                ORDER BY 1
+            """,
+            (table,),
+        )
+        for child, relkind in children:
+            if index.startswith(table + "_"):
+                child_index = child + index[len(table):]
+            else:
+                child_index = "{}_{}".format(child, index)
+
+            # Drops indexes left over by an interrupted run, maybe invalid.
+            if relkind == "p":
+                self._execute("DROP INDEX IF EXISTS {}".format(child_index))
+                self._create_partitioned_index(
+                    unique, child_index, child, definition
+                )
+            else:
+                self._execute(
+                    "DROP INDEX CONCURRENTLY IF EXISTS {}".format(child_index)
+                )
+                self._execute(
+                    "CREATE {}INDEX CONCURRENTLY {} ON {} {}".format(
+                        unique, child_index, child, definition
+                    )
+                )
+            self._execute(
+                "ALTER INDEX {} ATTACH PARTITION {}".format(index, child_index)
+            )
+
+    def _execute_statement(self, statement):
+        """
+        Runs a statement of a no-transaction script, building and dropping
+        indexes of partitioned tables as described in the module docstring.
+        """
+        match = _DROP_INDEX_RE.match(statement)
+        if match is not None and self._relkind(match.group(2)) == "I":
+            if_exists, index = match.groups()
+            self._execute("DROP INDEX {}{}".format(if_exists or "", index))
+            return
+
+        match = _CREATE_INDEX_RE.match(statement)
+        if match is not None and self._relkind(match.group(4)) == "p":
+            unique, if_not_exists, index, table, definition = match.groups()
+            if if_not_exists and self._relkind(index) is not None:
+                return
+            self._create_partitioned_index(
+                unique or "", index, table, definition
+            )
+            return
+
+        self._execute(statement)
+
+    def applied_versions(self):
+        rows = self._execute("SELECT version FROM schema_migrations")
+        return set(version for version, in rows)
+
+    def _run(self, migration, direction):
+        sql = migration.read(direction)
+        if direction == "up":
+            record = (
+                "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                (migration.version, migration.name),
+            )
+        else:
+            record = (
+                "DELETE FROM schema_migrations WHERE version = %s",
+                (migration.version,),
+            )
+
+        if is_transactional(sql):
+            self.db_conn.autocommit = False
+            try:
+                self._execute(sql)
+                self._execute(*record)
+                self.db_conn.commit()
+            except Exception:
+                self.db_conn.rollback()
+                raise
+            finally:
+                self.db_conn.autocommit = True
+        else:
+            for statement in split_statements(sql):
+                self._execute_statement(statement)
+            self._execute(*record)
+
+    def status(self):
+        """
+        Returns `(migration, applied)` tuples for all known migrations.
+        """
+        self._setup()
+        try:
+            applied = self.applied_versions()
+        finally:
+            self._teardown()
+        return [
+            (migration, migration.version in applied)
+            for migration in self.migrations
+        ]
+
+    def upgrade(self, target=None):
+        """
+        Applies all pending migrations up to and including `target`
+        (default: latest). Returns the applied migrations.
+        """
+        self._setup()
+        try:
+            applied = self.applied_versions()
+            done = []
+            for migration in self.migrations:
+                if target is not None and migration.version > target:
+                    break
+                if migration.version in applied:
+                    continue
+                self._run(migration, "up")
+                done.append(migration)
+            return done
+        finally:
+            self._teardown()
+
+    def downgrade(self, target=None):
+        """
+        Rolls back applied migrations newer than `target` (default: only the
+        latest applied one). Returns the rolled back migrations.
+        """
+        self._setup()
+        try:
+            applied = self.applied_versions()
+            pending = [
+                migration for migration in reversed(self.migrations)
+                if migration.version in applied and
+                (target is None or migration.version > target)
+            ]
+            if target is None:
+                pending = pending[:1]
+
+            for migration in pending:
+                self._run(migration, "down")
+            return pending
+        finally:
+            self._teardown()
+
+
+def connect(db_uri, wait=0, interval=1.0):
+    """
+    Connects to `db_uri`, retrying every `interval` seconds for up to `wait`
+    seconds while the server is unavailable.
+    """
+    deadline = time.monotonic() + wait
+    while True:
+        try:
+            return psycopg2.connect(db_uri)
+        except psycopg2.OperationalError as e:
+            if time.monotonic() + interval > deadline:
+                raise
+            print("Waiting for the database: {}".format(
+                str(e).strip()
+            ), file=sys.stderr)
+            time.sleep(interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run schema migrations.")
+    parser.add_argument(
+        "--database-uri",
+        default=os.getenv("DATABASE_URI"),
+        help="Postgres connection URI (default: $DATABASE_URI)",
+    )
+    parser.add_argument(
+        "--wait",
+        type=float,
+        default=0,
+        metavar="SECONDS",
+        help="Retry connecting for up to this long (default: 0)",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("status", help="List migrations and their state")
+    upgrade_parser = subparsers.add_parser(
+        "upgrade", help="Apply pending migrations"
+    )
+    upgrade_parser.add_argument("--to", type=int, help="Target version")
+    downgrade_parser = subparsers.add_parser(
+        "downgrade", help="Roll back applied migrations"
+    )
+    downgrade_parser.add_argument(
+        "--to",
+        type=int,
+        help="Roll back every migration newer than this version "
+             "(default: only the latest one)",
+    )
+    args = parser.parse_args(argv)
+
+    db_conn = connect(args.database_uri, wait=args.wait)
+    try:
+        migrator = Migrator(db_conn)
+        if args.command == "status":
+            for migration, applied in migrator.status():
+                print("[{}] {}".format("x" if applied else " ", migration))
+        elif args.command == "upgrade":
+            for migration in migrator.upgrade(args.to):
+                print("Applied {}".format(migration))
+        else:
+            for migration in migrator.downgrade(args.to):
+                print("Rolled back {}".format(migration))
+    finally:
+        db_conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
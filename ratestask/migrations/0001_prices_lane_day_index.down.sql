@@ -0,0 +1,2 @@
+-- migrate: no-transaction
+DROP INDEX CONCURRENTLY IF EXISTS prices_orig_code_dest_code_day_idx;
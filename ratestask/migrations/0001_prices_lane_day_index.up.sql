@@ -0,0 +1,6 @@
+-- migrate: no-transaction
+-- Covers the lane/day filter of the rates query, including the price so
+-- that the aggregate can be answered from an index-only scan.
+DROP INDEX CONCURRENTLY IF EXISTS prices_orig_code_dest_code_day_idx;
+CREATE INDEX CONCURRENTLY prices_orig_code_dest_code_day_idx
+    ON prices (orig_code, dest_code, day) INCLUDE (price);
@@ -0,0 +1,3 @@
+-- migrate: no-transaction
+DROP INDEX CONCURRENTLY IF EXISTS regions_parent_slug_idx;
+DROP INDEX CONCURRENTLY IF EXISTS ports_parent_slug_idx;
@@ -0,0 +1,5 @@
+-- migrate: no-transaction
+DROP INDEX CONCURRENTLY IF EXISTS ports_parent_slug_idx;
+CREATE INDEX CONCURRENTLY ports_parent_slug_idx ON ports (parent_slug);
+DROP INDEX CONCURRENTLY IF EXISTS regions_parent_slug_idx;
+CREATE INDEX CONCURRENTLY regions_parent_slug_idx ON regions (parent_slug);
@@ -0,0 +1,8 @@
+DROP TRIGGER IF EXISTS daily_lane_stats_truncate ON prices;
+DROP TRIGGER IF EXISTS daily_lane_stats_delete ON prices;
+DROP TRIGGER IF EXISTS daily_lane_stats_update ON prices;
+DROP TRIGGER IF EXISTS daily_lane_stats_insert ON prices;
+DROP FUNCTION IF EXISTS rebuild_daily_lane_stats();
+DROP FUNCTION IF EXISTS daily_lane_stats_truncate();
+DROP FUNCTION IF EXISTS daily_lane_stats_maintain();
+DROP TABLE IF EXISTS daily_lane_stats;
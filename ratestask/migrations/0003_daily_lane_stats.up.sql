@@ -0,0 +1,97 @@
+-- Per lane and day price rollup answering the rates query. Kept current by
+-- statement-level triggers on prices, so bulk loads update each lane-day
+-- once per statement rather than once per row.
+CREATE TABLE daily_lane_stats (
+    orig_code text NOT NULL,
+    dest_code text NOT NULL,
+    day date NOT NULL,
+    price_sum bigint NOT NULL,
+    price_count integer NOT NULL,
+    PRIMARY KEY (orig_code, dest_code, day)
+);
+
+CREATE OR REPLACE FUNCTION daily_lane_stats_maintain() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE daily_lane_stats AS s
+        SET price_sum = s.price_sum - d.price_sum,
+            price_count = s.price_count - d.price_count
+        FROM (
+            SELECT orig_code, dest_code, day,
+                   SUM(price) AS price_sum, COUNT(*) AS price_count
+            FROM old_prices
+            GROUP BY orig_code, dest_code, day
+        ) AS d
+        WHERE s.orig_code = d.orig_code AND
+              s.dest_code = d.dest_code AND
+              s.day = d.day;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO daily_lane_stats AS s
+            (orig_code, dest_code, day, price_sum, price_count)
+        SELECT orig_code, dest_code, day, SUM(price), COUNT(*)
+        FROM new_prices
+        GROUP BY orig_code, dest_code, day
+        ON CONFLICT (orig_code, dest_code, day) DO UPDATE
+        SET price_sum = s.price_sum + EXCLUDED.price_sum,
+            price_count = s.price_count + EXCLUDED.price_count;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM daily_lane_stats AS s
+        USING old_prices AS o
+        WHERE s.orig_code = o.orig_code AND
+              s.dest_code = o.dest_code AND
+              s.day = o.day AND
+              s.price_count <= 0;
+    END IF;
+
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION daily_lane_stats_truncate() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    TRUNCATE daily_lane_stats;
+    RETURN NULL;
+END
+$$;
+
+-- Full rebuild, e.g. to repair the rollup after loading prices with
+-- triggers disabled.
+CREATE OR REPLACE FUNCTION rebuild_daily_lane_stats() RETURNS void
+LANGUAGE plpgsql AS $$
+BEGIN
+    LOCK TABLE prices IN SHARE MODE;
+    DELETE FROM daily_lane_stats;
+    INSERT INTO daily_lane_stats
+        (orig_code, dest_code, day, price_sum, price_count)
+    SELECT orig_code, dest_code, day, SUM(price), COUNT(*)
+    FROM prices
+    GROUP BY orig_code, dest_code, day;
+END
+$$;
+
+CREATE TRIGGER daily_lane_stats_insert
+    AFTER INSERT ON prices
+    REFERENCING NEW TABLE AS new_prices
+    FOR EACH STATEMENT EXECUTE FUNCTION daily_lane_stats_maintain();
+
+CREATE TRIGGER daily_lane_stats_update
+    AFTER UPDATE ON prices
+    REFERENCING OLD TABLE AS old_prices NEW TABLE AS new_prices
+    FOR EACH STATEMENT EXECUTE FUNCTION daily_lane_stats_maintain();
+
+CREATE TRIGGER daily_lane_stats_delete
+    AFTER DELETE ON prices
+    REFERENCING OLD TABLE AS old_prices
+    FOR EACH STATEMENT EXECUTE FUNCTION daily_lane_stats_maintain();
+
+CREATE TRIGGER daily_lane_stats_truncate
+    AFTER TRUNCATE ON prices
+    FOR EACH STATEMENT EXECUTE FUNCTION daily_lane_stats_truncate();
+
+SELECT rebuild_daily_lane_stats();
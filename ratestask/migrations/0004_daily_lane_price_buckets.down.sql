@@ -0,0 +1,9 @@
+DROP TRIGGER IF EXISTS daily_lane_price_buckets_truncate ON prices;
+DROP TRIGGER IF EXISTS daily_lane_price_buckets_delete ON prices;
+DROP TRIGGER IF EXISTS daily_lane_price_buckets_update ON prices;
+DROP TRIGGER IF EXISTS daily_lane_price_buckets_insert ON prices;
+DROP FUNCTION IF EXISTS rebuild_daily_lane_price_buckets();
+DROP FUNCTION IF EXISTS daily_lane_price_buckets_truncate();
+DROP FUNCTION IF EXISTS daily_lane_price_buckets_maintain();
+DROP TABLE IF EXISTS daily_lane_price_buckets;
+DROP FUNCTION IF EXISTS price_bucket(integer);
@@ -0,0 +1,106 @@
+-- Per lane and day price distribution sketches answering percentile queries.
+-- Prices are counted in logarithmic buckets (see ratestask/sketches.py), so
+-- that sketches of any set of lanes and days merge by adding up counts and
+-- quantiles are estimated within 1% of the price. Kept current by
+-- statement-level triggers on prices, like daily_lane_stats.
+CREATE OR REPLACE FUNCTION price_bucket(price integer) RETURNS smallint
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT CASE
+        WHEN price < 1 THEN 0
+        ELSE ceil(ln(price) / ln(101.0 / 99.0))::smallint + 1
+    END
+$$;
+
+CREATE TABLE daily_lane_price_buckets (
+    orig_code text NOT NULL,
+    dest_code text NOT NULL,
+    day date NOT NULL,
+    bucket smallint NOT NULL,
+    price_count integer NOT NULL,
+    PRIMARY KEY (orig_code, dest_code, day, bucket)
+);
+
+CREATE OR REPLACE FUNCTION daily_lane_price_buckets_maintain() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE daily_lane_price_buckets AS b
+        SET price_count = b.price_count - d.price_count
+        FROM (
+            SELECT orig_code, dest_code, day, price_bucket(price) AS bucket,
+                   COUNT(*) AS price_count
+            FROM old_prices
+            GROUP BY 1, 2, 3, 4
+        ) AS d
+        WHERE b.orig_code = d.orig_code AND
+              b.dest_code = d.dest_code AND
+              b.day = d.day AND
+              b.bucket = d.bucket;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO daily_lane_price_buckets AS b
+            (orig_code, dest_code, day, bucket, price_count)
+        SELECT orig_code, dest_code, day, price_bucket(price), COUNT(*)
+        FROM new_prices
+        GROUP BY 1, 2, 3, 4
+        ON CONFLICT (orig_code, dest_code, day, bucket) DO UPDATE
+        SET price_count = b.price_count + EXCLUDED.price_count;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM daily_lane_price_buckets AS b
+        USING old_prices AS o
+        WHERE b.orig_code = o.orig_code AND
+              b.dest_code = o.dest_code AND
+              b.day = o.day AND
+              b.price_count <= 0;
+    END IF;
+
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION daily_lane_price_buckets_truncate() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    TRUNCATE daily_lane_price_buckets;
+    RETURN NULL;
+END
+$$;
+
+-- Full rebuild, e.g. to repair the sketches after loading prices with
+-- triggers disabled.
+CREATE OR REPLACE FUNCTION rebuild_daily_lane_price_buckets() RETURNS void
+LANGUAGE plpgsql AS $$
+BEGIN
+    LOCK TABLE prices IN SHARE MODE;
+    DELETE FROM daily_lane_price_buckets;
+    INSERT INTO daily_lane_price_buckets
+        (orig_code, dest_code, day, bucket, price_count)
+    SELECT orig_code, dest_code, day, price_bucket(price), COUNT(*)
+    FROM prices
+    GROUP BY 1, 2, 3, 4;
+END
+$$;
+
+CREATE TRIGGER daily_lane_price_buckets_insert
+    AFTER INSERT ON prices
+    REFERENCING NEW TABLE AS new_prices
+    FOR EACH STATEMENT EXECUTE FUNCTION daily_lane_price_buckets_maintain();
+
+CREATE TRIGGER daily_lane_price_buckets_update
+    AFTER UPDATE ON prices
+    REFERENCING OLD TABLE AS old_prices NEW TABLE AS new_prices
+    FOR EACH STATEMENT EXECUTE FUNCTION daily_lane_price_buckets_maintain();
+
+CREATE TRIGGER daily_lane_price_buckets_delete
+    AFTER DELETE ON prices
+    REFERENCING OLD TABLE AS old_prices
+    FOR EACH STATEMENT EXECUTE FUNCTION daily_lane_price_buckets_maintain();
+
+CREATE TRIGGER daily_lane_price_buckets_truncate
+    AFTER TRUNCATE ON prices
+    FOR EACH STATEMENT EXECUTE FUNCTION daily_lane_price_buckets_truncate();
+
+SELECT rebuild_daily_lane_price_buckets();
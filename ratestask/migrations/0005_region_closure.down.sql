@@ -0,0 +1,9 @@
+DROP TRIGGER IF EXISTS region_closure_ports_truncate ON ports;
+DROP TRIGGER IF EXISTS region_closure_ports ON ports;
+DROP TRIGGER IF EXISTS region_closure_regions_truncate ON regions;
+DROP TRIGGER IF EXISTS region_closure_regions ON regions;
+DROP FUNCTION IF EXISTS region_closure_maintain();
+DROP FUNCTION IF EXISTS rebuild_port_ancestors();
+DROP FUNCTION IF EXISTS rebuild_region_ancestors();
+DROP TABLE IF EXISTS port_ancestors;
+DROP TABLE IF EXISTS region_ancestors;
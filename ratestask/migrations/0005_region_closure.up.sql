@@ -0,0 +1,93 @@
+-- Closure tables of the region hierarchy, so that SQL consumers look up every
+-- descendant region of a region, or every port below it, with an index scan
+-- instead of walking regions recursively. region_ancestors holds every
+-- (ancestor, descendant) pair, each region being its own ancestor at depth
+-- 0; port_ancestors holds every region a port lies in, its parent at depth
+-- 1. Regions and ports change rarely and are few, so statement-level
+-- triggers rebuild the tables as a whole.
+CREATE TABLE region_ancestors (
+    ancestor_slug text NOT NULL,
+    descendant_slug text NOT NULL,
+    depth integer NOT NULL,
+    PRIMARY KEY (ancestor_slug, descendant_slug)
+);
+
+CREATE INDEX region_ancestors_descendant_slug_idx
+    ON region_ancestors (descendant_slug);
+
+CREATE TABLE port_ancestors (
+    port_code text NOT NULL,
+    ancestor_slug text NOT NULL,
+    depth integer NOT NULL,
+    PRIMARY KEY (ancestor_slug, port_code)
+);
+
+CREATE INDEX port_ancestors_port_code_idx ON port_ancestors (port_code);
+
+-- The depth bound keeps parent_slug cycles from recursing forever, no sane
+-- hierarchy is 100 levels deep.
+CREATE OR REPLACE FUNCTION rebuild_region_ancestors() RETURNS void
+LANGUAGE plpgsql AS $$
+BEGIN
+    LOCK TABLE region_ancestors IN EXCLUSIVE MODE;
+    DELETE FROM region_ancestors;
+    INSERT INTO region_ancestors (ancestor_slug, descendant_slug, depth)
+    WITH RECURSIVE closure (ancestor_slug, descendant_slug, depth) AS (
+        SELECT slug, slug, 0
+        FROM regions
+        UNION ALL
+        SELECT closure.ancestor_slug, regions.slug, closure.depth + 1
+        FROM closure
+        JOIN regions ON regions.parent_slug = closure.descendant_slug
+        WHERE closure.depth < 100
+    )
+    SELECT ancestor_slug, descendant_slug, MIN(depth)
+    FROM closure
+    GROUP BY 1, 2;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION rebuild_port_ancestors() RETURNS void
+LANGUAGE plpgsql AS $$
+BEGIN
+    LOCK TABLE port_ancestors IN EXCLUSIVE MODE;
+    DELETE FROM port_ancestors;
+    INSERT INTO port_ancestors (port_code, ancestor_slug, depth)
+    SELECT ports.code, region_ancestors.ancestor_slug,
+           MIN(region_ancestors.depth) + 1
+    FROM ports
+    JOIN region_ancestors
+        ON region_ancestors.descendant_slug = ports.parent_slug
+    GROUP BY 1, 2;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION region_closure_maintain() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'regions' THEN
+        PERFORM rebuild_region_ancestors();
+    END IF;
+    PERFORM rebuild_port_ancestors();
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER region_closure_regions
+    AFTER INSERT OR UPDATE OR DELETE ON regions
+    FOR EACH STATEMENT EXECUTE FUNCTION region_closure_maintain();
+
+CREATE TRIGGER region_closure_regions_truncate
+    AFTER TRUNCATE ON regions
+    FOR EACH STATEMENT EXECUTE FUNCTION region_closure_maintain();
+
+CREATE TRIGGER region_closure_ports
+    AFTER INSERT OR UPDATE OR DELETE ON ports
+    FOR EACH STATEMENT EXECUTE FUNCTION region_closure_maintain();
+
+CREATE TRIGGER region_closure_ports_truncate
+    AFTER TRUNCATE ON ports
+    FOR EACH STATEMENT EXECUTE FUNCTION region_closure_maintain();
+
+SELECT rebuild_region_ancestors();
+SELECT rebuild_port_ancestors();
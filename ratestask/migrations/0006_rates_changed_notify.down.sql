@@ -0,0 +1,8 @@
+DROP TRIGGER IF EXISTS rates_changed_regions ON regions;
+DROP TRIGGER IF EXISTS rates_changed_ports ON ports;
+DROP TRIGGER IF EXISTS rates_changed_truncate ON prices;
+DROP TRIGGER IF EXISTS rates_changed_delete ON prices;
+DROP TRIGGER IF EXISTS rates_changed_update ON prices;
+DROP TRIGGER IF EXISTS rates_changed_insert ON prices;
+DROP FUNCTION IF EXISTS notify_table_changed();
+DROP FUNCTION IF EXISTS notify_prices_changed();
@@ -0,0 +1,90 @@
+-- Notifications on the rates_changed channel when prices, ports or regions
+-- change, so that app processes evict exactly the cached rates (and region
+-- hierarchy) a transaction made stale. Payloads are JSON: the table, and for
+-- prices the changed lanes with the first and last day changed. Changes of
+-- too many lanes to fit a notification, truncates and changes of ports or
+-- regions are sent without lanes, meaning anything may have changed.
+-- Notifications are delivered when the transaction commits.
+CREATE OR REPLACE FUNCTION notify_prices_changed() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    lanes json;
+    payload text;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT json_agg(changed) INTO lanes FROM (
+            SELECT orig_code AS orig, dest_code AS dest,
+                   MIN(day) AS "from", MAX(day) AS "to"
+            FROM new_prices
+            GROUP BY 1, 2
+        ) AS changed;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT json_agg(changed) INTO lanes FROM (
+            SELECT orig_code AS orig, dest_code AS dest,
+                   MIN(day) AS "from", MAX(day) AS "to"
+            FROM old_prices
+            GROUP BY 1, 2
+        ) AS changed;
+    ELSE
+        SELECT json_agg(changed) INTO lanes FROM (
+            SELECT orig_code AS orig, dest_code AS dest,
+                   MIN(day) AS "from", MAX(day) AS "to"
+            FROM (
+                SELECT orig_code, dest_code, day FROM old_prices
+                UNION ALL
+                SELECT orig_code, dest_code, day FROM new_prices
+            ) AS rows
+            GROUP BY 1, 2
+        ) AS changed;
+    END IF;
+
+    IF lanes IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    payload := json_build_object('table', TG_TABLE_NAME, 'lanes', lanes)::text;
+    -- Notification payloads are limited to 8000 bytes.
+    IF octet_length(payload) > 7900 THEN
+        payload := json_build_object('table', TG_TABLE_NAME)::text;
+    END IF;
+    PERFORM pg_notify('rates_changed', payload);
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION notify_table_changed() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_notify(
+        'rates_changed', json_build_object('table', TG_TABLE_NAME)::text
+    );
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER rates_changed_insert
+    AFTER INSERT ON prices
+    REFERENCING NEW TABLE AS new_prices
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_prices_changed();
+
+CREATE TRIGGER rates_changed_update
+    AFTER UPDATE ON prices
+    REFERENCING OLD TABLE AS old_prices NEW TABLE AS new_prices
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_prices_changed();
+
+CREATE TRIGGER rates_changed_delete
+    AFTER DELETE ON prices
+    REFERENCING OLD TABLE AS old_prices
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_prices_changed();
+
+CREATE TRIGGER rates_changed_truncate
+    AFTER TRUNCATE ON prices
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_table_changed();
+
+CREATE TRIGGER rates_changed_ports
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON ports
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_table_changed();
+
+CREATE TRIGGER rates_changed_regions
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON regions
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_table_changed();
@@ -0,0 +1,538 @@
+"""
+Monthly range partitioning of `prices` and its rollups `daily_lane_stats` and
+`daily_lane_price_buckets` by `day`.
+
+`convert` replaces a plain table by a table partitioned by month, in a
+single transaction holding an exclusive lock on the table while its rows are
+copied. Constraints, indexes and triggers (e.g. the rollup triggers on
+`prices`) are recreated from their definitions on the new table. Partitions
+are named `<table>_y<YYYY>m<MM>`, with a `<table>_default` partition catching
+days outside of all monthly partitions.
+
+`premake` creates the partitions of the coming months, `detach` detaches
+(and archives into another schema, or drops) the partitions of months ending
+before a given day. The rollup of detached `prices` partitions stays in
+`daily_lane_stats`, so their rates are still served until the matching
+`daily_lane_stats` partitions are detached too.
+
+`explain` shows which partitions the rates query scans for a given lane and
+date range.
+
+Schema migrations keep working on partitioned tables: `ratestask/migrate.py`
+builds their concurrent indexes partition by partition.
+
+Usage:
+    python ratestask/partitions.py [--database-uri URI] convert [--table T] [--premake N]
+    python ratestask/partitions.py [--database-uri URI] premake [--table T] [--months N]
+    python ratestask/partitions.py [--database-uri URI] detach --before YYYY-MM-DD
+                                   [--table T] [--archive-schema S | --drop]
+    python ratestask/partitions.py [--database-uri URI] list [--table T]
+    python ratestask/partitions.py [--database-uri URI] explain --date-from D --date-to D
+                                   --origin O --destination D
+"""
+import argparse
+import os
+import re
+import sys
+from datetime import date, datetime
+
+import psycopg2
+from psycopg2 import sql
+
+from ratestask.db import AVG_RATES_QUERY, avg_rates_params
+from ratestask.hierarchy import RegionHierarchy
+
+
+PARTITIONED_TABLES = ("prices", "daily_lane_stats", "daily_lane_price_buckets")
+DEFAULT_PREMAKE_MONTHS = 3
+
+_PARTITION_NAME_RE = re.compile(r"^(\w+)_y(\d{4})m(\d{2})$")
+
+
+class PartitionError(Exception):
+    pass
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def next_month(month):
+    if month.month == 12:
+        return date(month.year + 1, 1, 1)
+    return date(month.year, month.month + 1, 1)
+
+
+def months_between(first, last):
+    """
+    Returns the first days of all months from `first` to `last` inclusive.
+    """
+    months = []
+    month = month_start(first)
+    while month <= last:
+        months.append(month)
+        month = next_month(month)
+    return months
+
+
+def partition_name(table, month):
+    return "{}_y{:04d}m{:02d}".format(table, month.year, month.month)
+
+
+def default_partition_name(table):
+    return "{}_default".format(table)
+
+
+def parse_partition_name(name):
+    """
+    Returns `(table, month)` of a monthly partition name, None for other
+    names.
+    """
+    match = _PARTITION_NAME_RE.match(name)
+    if match is None:
+        return None
+    table, year, month = match.groups()
+    return table, date(int(year), int(month), 1)
+
+
+def is_partitioned(db_cursor, table):
+    db_cursor.execute(
+        "SELECT relkind = 'p' FROM pg_class WHERE oid = %s::regclass",
+        (table,),
+    )
+    return db_cursor.fetchone()[0]
+
+
+def create_partition(db_cursor, table, month):
+    """
+    Creates the partition of a month unless it exists. Rows of that month
+    already in the default partition, which would violate its new bounds,
+    are moved into it: deleted through the table before the partition is
+    created and inserted again after, so its triggers (e.g. the rollup of
+    `prices`) see them removed and added back. Returns the number of moved
+    rows.
+    """
+    name = partition_name(table, month)
+    bounds = (month, next_month(month))
+    db_cursor.execute(
+        "SELECT to_regclass(%s), to_regclass(%s)",
+        (name, default_partition_name(table)),
+    )
+    partition, default = db_cursor.fetchone()
+    if partition is not None:
+        return 0
+
+    moved = 0
+    if default is not None:
+        # Keeps rows of the month from landing in the default partition
+        # until the new partition is created.
+        db_cursor.execute(
+            sql.SQL("LOCK TABLE {} IN EXCLUSIVE MODE").format(
+                sql.Identifier(table)
+            )
+        )
+        db_cursor.execute(
+            sql.SQL(
+                "SELECT EXISTS (SELECT 1 FROM {} WHERE day >= %s AND day < %s)"
+            ).format(sql.Identifier(default_partition_name(table))),
+            bounds,
+        )
+        if db_cursor.fetchone()[0]:
+            db_cursor.execute(
+                sql.SQL(
+                    "CREATE TEMPORARY TABLE partition_rows (LIKE {}) "
+                    "ON COMMIT DROP"
+                ).format(sql.Identifier(table))
+            )
+            db_cursor.execute(
+                sql.SQL(
+                    "WITH deleted AS ("
+                    "DELETE FROM {} WHERE day >= %s AND day < %s RETURNING *"
+                    ") INSERT INTO partition_rows SELECT * FROM deleted"
+                ).format(sql.Identifier(table)),
+                bounds,
+            )
+            moved = db_cursor.rowcount
+
+    db_cursor.execute(
+        sql.SQL(
+            "CREATE TABLE {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s)"
+        ).format(sql.Identifier(name), sql.Identifier(table)),
+        bounds,
+    )
+    if moved:
+        db_cursor.execute(
+            sql.SQL("INSERT INTO {} SELECT * FROM partition_rows").format(
+                sql.Identifier(table)
+            )
+        )
+        db_cursor.execute("DROP TABLE partition_rows")
+    return moved
+
+
+def list_partitions(db_cursor, table):
+    """
+    Returns `(name, bounds, estimated_rows)` of the partitions of a table.
+    """
+    db_cursor.execute(
+        """
+            SELECT child.relname,
+                   pg_get_expr(child.relpartbound, child.oid),
+                   child.reltuples::bigint
+            FROM pg_inherits
+            INNER JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = %s::regclass
+            ORDER BY child.relname
+        """,
+        (table,),
+    )
+    return db_cursor.fetchall()
+
+
+def _table_definitions(db_cursor, table):
+    """
+    Returns the constraint, index and trigger definitions of a table, to be
+    recreated on its replacement.
+    """
+    db_cursor.execute(
+        """
+            SELECT conname, pg_get_constraintdef(oid)
+            FROM pg_constraint
+            WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'c', 'f', 'x')
+            ORDER BY contype = 'f', conname
+        """,
+        (table,),
+    )
+    constraints = db_cursor.fetchall()
+
+    # Indexes backing constraints are recreated with the constraints.
+    db_cursor.execute(
+        """
+            SELECT pg_get_indexdef(pg_index.indexrelid)
+            FROM pg_index
+            WHERE pg_index.indrelid = %s::regclass AND NOT EXISTS (
+                SELECT 1 FROM pg_constraint
+                WHERE pg_constraint.conrelid = pg_index.indrelid AND
+                      pg_constraint.conindid = pg_index.indexrelid
+            )
+        """,
+        (table,),
+    )
+    indexes = [definition for definition, in db_cursor.fetchall()]
+
+    db_cursor.execute(
+        """
+            SELECT pg_get_triggerdef(oid)
+            FROM pg_trigger
+            WHERE tgrelid = %s::regclass AND NOT tgisinternal
+            ORDER BY tgname
+        """,
+        (table,),
+    )
+    triggers = [definition for definition, in db_cursor.fetchall()]
+
+    return constraints, indexes, triggers
+
+
+def convert(db_conn, table, premake_months=DEFAULT_PREMAKE_MONTHS, today=None):
+    """
+    Replaces a plain table by one partitioned by month, with partitions from
+    the month of its first day up to `premake_months` months after the
+    current (or last) month. Returns the names of the created partitions.
+    """
+    today = today or date.today()
+    staging = "{}_partitioned".format(table)
+
+    with db_conn:
+        with db_conn.cursor() as db_cursor:
+            db_cursor.execute(
+                sql.SQL("LOCK TABLE {} IN ACCESS EXCLUSIVE MODE").format(
+                    sql.Identifier(table)
+                )
+            )
+            if is_partitioned(db_cursor, table):
+                raise PartitionError("{} is already partitioned".format(table))
+
+            constraints, indexes, triggers = _table_definitions(db_cursor, table)
+
+            db_cursor.execute(
+                sql.SQL("SELECT MIN(day), MAX(day) FROM {}").format(
+                    sql.Identifier(table)
+                )
+            )
+            first_day, last_day = db_cursor.fetchone()
+            last_month = month_start(max(last_day or today, today))
+            for _ in range(premake_months):
+                last_month = next_month(last_month)
+
+            db_cursor.execute(
+                sql.SQL(
+                    "CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING STORAGE) "
+                    "PARTITION BY RANGE (day)"
+                ).format(sql.Identifier(staging), sql.Identifier(table))
+            )
+            created = []
+            for month in months_between(first_day or today, last_month):
+                db_cursor.execute(
+                    sql.SQL(
+                        "CREATE TABLE {} PARTITION OF {} "
+                        "FOR VALUES FROM (%s) TO (%s)"
+                    ).format(
+                        sql.Identifier(partition_name(table, month)),
+                        sql.Identifier(staging),
+                    ),
+                    (month, next_month(month)),
+                )
+                created.append(partition_name(table, month))
+            db_cursor.execute(
+                sql.SQL("CREATE TABLE {} PARTITION OF {} DEFAULT").format(
+                    sql.Identifier(default_partition_name(table)),
+                    sql.Identifier(staging),
+                )
+            )
+
+            db_cursor.execute(
+                sql.SQL("INSERT INTO {} SELECT * FROM {}").format(
+                    sql.Identifier(staging), sql.Identifier(table)
+                )
+            )
+            db_cursor.execute(
+                sql.SQL("DROP TABLE {}").format(sql.Identifier(table))
+            )
+            db_cursor.execute(
+                sql.SQL("ALTER TABLE {} RENAME TO {}").format(
+                    sql.Identifier(staging), sql.Identifier(table)
+                )
+            )
+
+            # The definitions refer to the table by name, so they apply to
+            # the renamed partitioned table. Triggers are created last, the
+            # rows were copied without firing them.
+            for name, definition in constraints:
+                db_cursor.execute(
+                    sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} ").format(
+                        sql.Identifier(table), sql.Identifier(name)
+                    ) + sql.SQL(definition)
+                )
+            for definition in indexes + triggers:
+                db_cursor.execute(definition)
+
+            db_cursor.execute(
+                sql.SQL("ANALYZE {}").format(sql.Identifier(table))
+            )
+
+    return created
+
+
+def premake(db_conn, table, months=DEFAULT_PREMAKE_MONTHS, today=None):
+    """
+    Creates any missing partitions from the current month up to `months`
+    months ahead, moving their rows out of the default partition (see
+    `create_partition`). Returns the names of the partitions of that range.
+    """
+    first_month = month_start(today or date.today())
+    last_month = first_month
+    for _ in range(months):
+        last_month = next_month(last_month)
+
+    names = []
+    with db_conn:
+        with db_conn.cursor() as db_cursor:
+            if not is_partitioned(db_cursor, table):
+                raise PartitionError("{} is not partitioned".format(table))
+            for month in months_between(first_month, last_month):
+                create_partition(db_cursor, table, month)
+                names.append(partition_name(table, month))
+    return names
+
+
+def detach(db_conn, table, before, archive_schema=None, drop=False):
+    """
+    Detaches the monthly partitions of months ending on or before `before`,
+    then moves them to `archive_schema` or drops them. Returns the names of
+    the detached partitions.
+    """
+    detached = []
+    with db_conn:
+        with db_conn.cursor() as db_cursor:
+            if archive_schema is not None:
+                db_cursor.execute(
+                    sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(
+                        sql.Identifier(archive_schema)
+                    )
+                )
+
+            for name, _, _ in list_partitions(db_cursor, table):
+                parsed = parse_partition_name(name)
+                if parsed is None or parsed[0] != table:
+                    continue
+                if next_month(parsed[1]) > before:
+                    continue
+
+                db_cursor.execute(
+                    sql.SQL("ALTER TABLE {} DETACH PARTITION {}").format(
+                        sql.Identifier(table), sql.Identifier(name)
+                    )
+                )
+                if drop:
+                    db_cursor.execute(
+                        sql.SQL("DROP TABLE {}").format(sql.Identifier(name))
+                    )
+                elif archive_schema is not None:
+                    db_cursor.execute(
+                        sql.SQL("ALTER TABLE {} SET SCHEMA {}").format(
+                            sql.Identifier(name),
+                            sql.Identifier(archive_schema),
+                        )
+                    )
+                detached.append(name)
+    return detached
+
+
+def _plan_relations(plan):
+    relations = set()
+    if "Relation Name" in plan:
+        relations.add(plan["Relation Name"])
+    for sub_plan in plan.get("Plans", ()):
+        relations.update(_plan_relations(sub_plan))
+    return relations
+
+
+def scanned_relations(db_cursor, query, params=None):
+    """
+    Returns the names of the tables (or partitions) scanned by the plan of
+    a query.
+    """
+    db_cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+    plan, = db_cursor.fetchone()
+    return _plan_relations(plan[0]["Plan"])
+
+
+def explain_avg_rates(db_cursor, start_date, end_date, origin, destination):
+    """
+    Returns the `daily_lane_stats` partitions scanned by the rates query of
+    the given lane and date range.
+    """
+    hierarchy = RegionHierarchy()
+    hierarchy.refresh(db_cursor)
+    params = avg_rates_params(
+        start_date,
+        end_date,
+        hierarchy.resolve(db_cursor, origin),
+        hierarchy.resolve(db_cursor, destination),
+        3,
+    )
+    return scanned_relations(db_cursor, AVG_RATES_QUERY, params)
+
+
+def _parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage monthly partitions.")
+    parser.add_argument(
+        "--database-uri",
+        default=os.getenv("DATABASE_URI"),
+        help="Postgres connection URI (default: $DATABASE_URI)",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_table_argument(subparser):
+        subparser.add_argument(
+            "--table",
+            choices=PARTITIONED_TABLES,
+            action="append",
+            help="Table to manage, repeatable (default: all)",
+        )
+
+    convert_parser = subparsers.add_parser(
+        "convert", help="Partition existing tables by month"
+    )
+    add_table_argument(convert_parser)
+    convert_parser.add_argument(
+        "--premake", type=int, default=DEFAULT_PREMAKE_MONTHS
+    )
+
+    premake_parser = subparsers.add_parser(
+        "premake", help="Create the partitions of the coming months"
+    )
+    add_table_argument(premake_parser)
+    premake_parser.add_argument(
+        "--months", type=int, default=DEFAULT_PREMAKE_MONTHS
+    )
+
+    detach_parser = subparsers.add_parser(
+        "detach", help="Detach partitions of months ending before a day"
+    )
+    add_table_argument(detach_parser)
+    detach_parser.add_argument("--before", type=_parse_date, required=True)
+    detach_action = detach_parser.add_mutually_exclusive_group()
+    detach_action.add_argument("--archive-schema")
+    detach_action.add_argument("--drop", action="store_true")
+
+    list_parser = subparsers.add_parser("list", help="List partitions")
+    add_table_argument(list_parser)
+
+    explain_parser = subparsers.add_parser(
+        "explain", help="Show the partitions scanned by the rates query"
+    )
+    explain_parser.add_argument("--date-from", type=_parse_date, required=True)
+    explain_parser.add_argument("--date-to", type=_parse_date, required=True)
+    explain_parser.add_argument("--origin", required=True)
+    explain_parser.add_argument("--destination", required=True)
+
+    args = parser.parse_args(argv)
+
+    db_conn = psycopg2.connect(args.database_uri)
+    try:
+        if args.command == "explain":
+            with db_conn.cursor() as db_cursor:
+                scanned = explain_avg_rates(
+                    db_cursor,
+                    args.date_from,
+                    args.date_to,
+                    args.origin,
+                    args.destination,
+                )
+                total = list_partitions(db_cursor, "daily_lane_stats")
+            print("Scanned {} of {} daily_lane_stats partitions:".format(
+                len(scanned), len(total)
+            ))
+            for name in sorted(scanned):
+                print("  {}".format(name))
+            return
+
+        for table in args.table or PARTITIONED_TABLES:
+            if args.command == "convert":
+                names = convert(db_conn, table, premake_months=args.premake)
+                print("{}: partitioned into {} monthly partitions".format(
+                    table, len(names)
+                ))
+            elif args.command == "premake":
+                names = premake(db_conn, table, months=args.months)
+                print("{}: partitions up to {}".format(table, names[-1]))
+            elif args.command == "detach":
+                names = detach(
+                    db_conn,
+                    table,
+                    args.before,
+                    archive_schema=args.archive_schema,
+                    drop=args.drop,
+                )
+                print("{}: detached {}".format(
+                    table, ", ".join(names) or "nothing"
+                ))
+            elif args.command == "list":
+                with db_conn.cursor() as db_cursor:
+                    for name, bounds, rows in list_partitions(db_cursor, table):
+                        print("{:<32} {:>12}  {}".format(name, rows, bounds))
+    except PartitionError as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        db_conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,284 @@
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2.extensions import (
+    TRANSACTION_STATUS_IDLE,
+    TRANSACTION_STATUS_UNKNOWN,
+    connection as _connection,
+)
+
+
+class PoolTimeout(Exception):
+    """
+    Raised when no DB connection could be acquired from the pool within the
+    configured timeout.
+    """
+
+
+class PooledConnection(_connection):
+    """
+    psycopg2 connection keeping track of when it was opened and last used,
+    which the pool needs for max-age recycling and idle validation, and of
+    the names of the statements prepared on it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(PooledConnection, self).__init__(*args, **kwargs)
+        self.created_at = time.monotonic()
+        self.last_used_at = self.created_at
+        self.prepared = set()
+
+
+class ConnectionPool(object):
+    """
+    Thread-safe pool of psycopg2 connections.
+
+    Connections are opened lazily (up to `max_size`), validated with a cheap
+    round trip when they have been idle for longer than `validate_after`
+    seconds and recycled once they are older than `max_age` seconds.
+    Callers wait at most `timeout` seconds for a free connection.
+    `connect_kwargs` are passed on to `psycopg2.connect`.
+    """
+
+    def __init__(
+        self,
+        db_uri,
+        min_size=1,
+        max_size=10,
+        timeout=30.0,
+        max_age=3600.0,
+        validate_after=30.0,
+        connect_kwargs=None
+    ):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError(
+                "Invalid pool size: min={}, max={}".format(min_size, max_size)
+            )
+
+        self.db_uri = db_uri
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.validate_after = validate_after
+        self.connect_kwargs = connect_kwargs or {}
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._size = 0
+        self._in_use = 0
+        self._filled = False
+
+        self._waits = 0
+        self._timeouts = 0
+        self._acquired = 0
+        self._acquire_time_total = 0.0
+        self._acquire_time_max = 0.0
+        self._opened = 0
+        self._closed = 0
+
+    def _connect(self):
+        conn = psycopg2.connect(
+            self.db_uri,
+            connection_factory=PooledConnection,
+            **self.connect_kwargs
+        )
+        with self._cond:
+            self._opened += 1
+        return conn
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self._closed += 1
+
+    def _is_expired(self, conn, now):
+        return self.max_age is not None and now - conn.created_at > self.max_age
+
+    def _is_usable(self, conn, now):
+        """
+        Checks an idle connection before handing it out again.
+        """
+        if conn.closed or self._is_expired(conn, now):
+            return False
+
+        if (
+            self.validate_after is None or
+            now - conn.last_used_at <= self.validate_after
+        ):
+            return True
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def fill(self):
+        """
+        Opens connections until the pool holds at least `min_size` of them.
+        """
+        with self._cond:
+            self._filled = True
+            missing = max(self.min_size - self._size, 0)
+            self._size += missing
+
+        opened = []
+        try:
+            for _ in range(missing):
+                opened.append(self._connect())
+        finally:
+            with self._cond:
+                self._size -= missing - len(opened)
+                self._idle.extend(opened)
+                self._cond.notify(len(opened))
+
+    def getconn(self, timeout=None):
+        """
+        Acquires a connection, waiting up to `timeout` seconds (the pool's
+        timeout by default) for one to be released when the pool is
+        exhausted.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if not self._filled:
+            self.fill()
+
+        started = time.monotonic()
+        deadline = started + timeout
+        conn = None
+        waited = False
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    # LIFO, so that rarely needed connections age out.
+                    conn = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    # Reserve the slot, the connection is opened unlocked.
+                    self._size += 1
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(
+                        "No DB connection available within {}s".format(
+                            timeout
+                        )
+                    )
+                waited = True
+                self._cond.wait(remaining)
+
+            self._in_use += 1
+            if waited:
+                self._waits += 1
+
+        try:
+            if conn is not None and not self._is_usable(conn, time.monotonic()):
+                self._close(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        elapsed = time.monotonic() - started
+        with self._cond:
+            self._acquired += 1
+            self._acquire_time_total += elapsed
+            self._acquire_time_max = max(self._acquire_time_max, elapsed)
+
+        return conn
+
+    def putconn(self, conn, discard=False):
+        """
+        Returns a connection to the pool. Connections that are broken,
+        expired or explicitly discarded are closed instead.
+        """
+        now = time.monotonic()
+
+        if not conn.closed and not discard:
+            status = conn.info.transaction_status
+            if status == TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+
+        if conn.closed or discard or self._is_expired(conn, now):
+            self._close(conn)
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            return
+
+        conn.last_used_at = now
+        with self._cond:
+            self._in_use -= 1
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def closeall(self):
+        """
+        Closes every idle connection, the pool refills itself on next use.
+        """
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._filled = False
+
+        for conn in idle:
+            self._close(conn)
+
+    @property
+    def in_use(self):
+        return self._in_use
+
+    def reset(self):
+        """
+        Forgets every connection without closing it, in a forked child
+        process. The connections' sockets are shared with the parent, so
+        closing them here would end the parent's sessions.
+        """
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._size = 0
+        self._in_use = 0
+        self._filled = False
+
+    def stats(self):
+        with self._cond:
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "acquired": self._acquired,
+                "acquire_time_avg_ms": (
+                    self._acquire_time_total / self._acquired * 1000
+                    if self._acquired else 0.0
+                ),
+                "acquire_time_max_ms": self._acquire_time_max * 1000,
+                "opened": self._opened,
+                "closed": self._closed,
+            }
@@ -0,0 +1,219 @@
+import itertools
+import logging
+import threading
+import time
+
+import psycopg2
+
+from ratestask.pool import PoolTimeout
+
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ("round_robin", "least_connections")
+
+# Seconds the replica is behind the primary, 0 when it has replayed all WAL
+# it received (an idle primary writes no new transactions to compare with).
+# NULL when it is not streaming from the primary, as it then has no way of
+# knowing what it is missing.
+REPLICATION_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN NOT EXISTS (
+            SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming'
+        )
+        THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(
+            EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0
+        )
+    END
+"""
+
+
+class ReplicaNode(object):
+    """
+    A replica connection pool with its health: ejected nodes are skipped
+    until `ejected_until`, lagging nodes until their lag is checked again.
+    The lag is None when unknown, for a replica not streaming WAL.
+    """
+
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        self.ejected_until = 0.0
+        self.ejections = 0
+        self.lag = None
+        self.lag_checked_at = None
+        self.acquired = 0
+
+    def stats(self, now):
+        stats = self.pool.stats()
+        stats.update({
+            "ejected": now < self.ejected_until,
+            "ejections": self.ejections,
+            "lag_seconds": self.lag,
+            "reads": self.acquired,
+        })
+        return stats
+
+
+class ReplicaRouter(object):
+    """
+    Spreads read connections over replica pools, by `round_robin` or
+    `least_connections` (fewest connections in use), falling back to the
+    `primary` pool when no replica is usable.
+
+    Replicas failing to connect are ejected for `eject_for` seconds, the
+    next replica is tried when one has no free connection. Only the last
+    candidate is waited on, for its pool's timeout.
+    Replicas lagging more than `max_lag` seconds behind the primary are
+    skipped; the lag is checked when a connection is acquired and the last
+    check is older than `check_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        primary,
+        replicas,
+        strategy="round_robin",
+        max_lag=None,
+        eject_for=30.0,
+        check_interval=5.0
+    ):
+        if strategy not in STRATEGIES:
+            raise ValueError("Unknown replica strategy: {}".format(strategy))
+
+        self.primary = primary
+        self.replicas = [
+            ReplicaNode("replica_{}".format(i), pool)
+            for i, pool in enumerate(replicas)
+        ]
+        self.strategy = strategy
+        self.max_lag = max_lag
+        self.eject_for = eject_for
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._turn = itertools.count()
+        self._fallbacks = 0
+
+    def _lag_is_fresh(self, node, now):
+        return (
+            node.lag_checked_at is not None and
+            now - node.lag_checked_at <= self.check_interval
+        )
+
+    def _within_max_lag(self, lag):
+        return lag is not None and lag <= self.max_lag
+
+    def _usable(self, node, now):
+        if now < node.ejected_until:
+            return False
+        if self.max_lag is None or not self._lag_is_fresh(node, now):
+            return True
+        return self._within_max_lag(node.lag)
+
+    def candidates(self):
+        """
+        Returns the usable replicas in the order they should be tried.
+        """
+        now = time.monotonic()
+        with self._lock:
+            nodes = [node for node in self.replicas if self._usable(node, now)]
+            if not nodes:
+                return []
+            start = next(self._turn) % len(nodes)
+        nodes = nodes[start:] + nodes[:start]
+        if self.strategy == "least_connections":
+            # Stable, so ties keep the round-robin order.
+            nodes.sort(key=lambda node: node.pool.in_use)
+        return nodes
+
+    def eject(self, node, error):
+        with self._lock:
+            node.ejected_until = time.monotonic() + self.eject_for
+            node.ejections += 1
+        logger.warning(
+            "Ejected %s for %ss: %s", node.name, self.eject_for, error
+        )
+
+    def _check_lag(self, node, conn):
+        with conn.cursor() as cursor:
+            cursor.execute(REPLICATION_LAG_QUERY)
+            lag = cursor.fetchone()[0]
+        if lag is not None:
+            lag = float(lag)
+        conn.rollback()
+        with self._lock:
+            node.lag = lag
+            node.lag_checked_at = time.monotonic()
+        return lag
+
+    def getconn(self):
+        """
+        Acquires a read connection, returns it with the replica it belongs
+        to (None for the primary).
+        """
+        candidates = self.candidates()
+        for i, node in enumerate(candidates):
+            last = i == len(candidates) - 1
+            try:
+                conn = node.pool.getconn(timeout=None if last else 0)
+            except psycopg2.OperationalError as e:
+                self.eject(node, e)
+                continue
+            except PoolTimeout as e:
+                # Saturated rather than broken, so it is not ejected.
+                if last:
+                    logger.warning("Skipped %s: %s", node.name, e)
+                continue
+
+            try:
+                if (
+                    self.max_lag is not None and
+                    not self._lag_is_fresh(node, time.monotonic()) and
+                    not self._within_max_lag(self._check_lag(node, conn))
+                ):
+                    node.pool.putconn(conn)
+                    continue
+            except psycopg2.Error as e:
+                node.pool.putconn(conn, discard=True)
+                self.eject(node, e)
+                continue
+
+            with self._lock:
+                node.acquired += 1
+            return node, conn
+
+        conn = self.primary.getconn()
+        with self._lock:
+            self._fallbacks += 1
+        return None, conn
+
+    def putconn(self, node, conn, error=None):
+        """
+        Returns a connection acquired by `getconn`. Replicas whose connection
+        broke with `error` are ejected.
+        """
+        if node is None:
+            self.primary.putconn(conn)
+            return
+
+        broken = isinstance(error, psycopg2.OperationalError) and conn.closed
+        if broken:
+            self.eject(node, error)
+        node.pool.putconn(conn, discard=broken)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            stats = {
+                "strategy": self.strategy,
+                "max_lag_seconds": self.max_lag,
+                "fallbacks": self._fallbacks,
+            }
+        stats["replicas"] = {
+            node.name: node.stats(now) for node in self.replicas
+        }
+        return stats
@@ -0,0 +1,238 @@
+"""
+Serializers of daily average rates, chosen by the `Accept` header.
+
+Rates are turned into a `day` and an `average_price` column once, which
+every format writes directly without building per-row dicts:
+
+    application/json                    `[{"average_price": ..., "day": ...}]`
+    text/csv                            `day,average_price` rows
+    application/x-msgpack               `{"day": [...], "average_price": [...]}`
+    application/vnd.apache.arrow.stream Arrow IPC stream of a
+                                        `day: date32, average_price: float64`
+                                        table
+
+Requested price `stats` (e.g. `p50`) are written as further columns after
+`day`, in request order.
+
+MessagePack and Arrow need the optional `msgpack` and `pyarrow` packages and
+are only offered when those are installed.
+"""
+from collections import OrderedDict
+from functools import wraps
+from itertools import repeat
+
+from flask import (
+    jsonify,
+    make_response,
+    request,
+)
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+JSON_MIMETYPE = "application/json"
+CSV_MIMETYPE = "text/csv"
+MSGPACK_MIMETYPE = "application/x-msgpack"
+ARROW_MIMETYPE = "application/vnd.apache.arrow.stream"
+
+
+def _round_price(price):
+    return round(float(price), 3) if price is not None else None
+
+
+def rates_columns(rates, stats=()):
+    """
+    Splits `(day, average_price, *stats)` rows into a list of days, a list
+    of prices rounded to 3 decimals (None where there is no average) and an
+    ordered dict of the `stats` columns, rounded likewise.
+    """
+    days = []
+    prices = []
+    stat_columns = OrderedDict((name, []) for name in stats)
+    stat_values = list(stat_columns.values())
+    for rate in rates:
+        days.append(rate[0])
+        prices.append(_round_price(rate[1]))
+        for values, value in zip(stat_values, rate[2:]):
+            values.append(_round_price(value))
+    return days, prices, stat_columns
+
+
+def _json_value(value):
+    # float repr is valid JSON, prices are never NaN or infinite.
+    return "null" if value is None else repr(value)
+
+
+def _stat_rows(stats, format_stat):
+    """
+    Yields the stats of every row formatted by `format_stat(name, value)`,
+    empty strings without stats.
+    """
+    if not stats:
+        return repeat("")
+    names = list(stats)
+    return (
+        "".join(format_stat(name, value) for name, value in zip(names, values))
+        for values in zip(*stats.values())
+    )
+
+
+def _json_stat(name, value):
+    return ',"%s":%s' % (name, _json_value(value))
+
+
+def _json_rows(days, prices, stats=None):
+    return [
+        '{"average_price":%s,"day":"%s"%s}' % (
+            _json_value(price), day.isoformat(), extra
+        )
+        for day, price, extra in zip(
+            days, prices, _stat_rows(stats, _json_stat)
+        )
+    ]
+
+
+def dump_json(days, prices, stats=None):
+    return "[" + ",".join(_json_rows(days, prices, stats)) + "]"
+
+
+def _csv_value(value):
+    return "" if value is None else repr(value)
+
+
+def _csv_stat(name, value):
+    return "," + _csv_value(value)
+
+
+def _csv_header(stats):
+    return ",".join(["day", "average_price"] + list(stats or ())) + "\r\n"
+
+
+def _csv_rows(days, prices, stats=None):
+    return [
+        "{},{}{}\r\n".format(day.isoformat(), _csv_value(price), extra)
+        for day, price, extra in zip(
+            days, prices, _stat_rows(stats, _csv_stat)
+        )
+    ]
+
+
+def dump_csv(days, prices, stats=None):
+    return _csv_header(stats) + "".join(_csv_rows(days, prices, stats))
+
+
+def dump_msgpack(days, prices, stats=None):
+    return msgpack.packb(
+        OrderedDict(
+            [
+                ("day", [day.isoformat() for day in days]),
+                ("average_price", prices),
+            ] +
+            list((stats or {}).items())
+        ),
+        use_bin_type=True,
+    )
+
+
+def dump_arrow(days, prices, stats=None):
+    stats = stats or {}
+    table = pyarrow.Table.from_arrays(
+        [
+            pyarrow.array(days, type=pyarrow.date32()),
+            pyarrow.array(prices, type=pyarrow.float64()),
+        ] +
+        [
+            pyarrow.array(values, type=pyarrow.float64())
+            for values in stats.values()
+        ],
+        names=["day", "average_price"] + list(stats),
+    )
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _chunked(rates, chunk_size, stats):
+    chunk = []
+    for rate in rates:
+        chunk.append(rate)
+        if len(chunk) >= chunk_size:
+            yield rates_columns(chunk, stats)
+            chunk = []
+    if chunk:
+        yield rates_columns(chunk, stats)
+
+
+def stream_json(rates, chunk_size=500, stats=()):
+    """
+    Yields rates as a JSON array in chunks of `chunk_size` rates.
+    """
+    separator = "["
+    for columns in _chunked(rates, chunk_size, stats):
+        yield separator + ",".join(_json_rows(*columns))
+        separator = ","
+    yield "[]" if separator == "[" else "]"
+
+
+def stream_csv(rates, chunk_size=500, stats=()):
+    """
+    Yields rates as CSV in chunks of `chunk_size` rates.
+    """
+    yield _csv_header(stats)
+    for columns in _chunked(rates, chunk_size, stats):
+        yield "".join(_csv_rows(*columns))
+
+
+# In order of preference for `*/*`. Formats without a streaming writer are
+# written in one go when streaming is requested.
+SERIALIZERS = OrderedDict([
+    (JSON_MIMETYPE, (dump_json, stream_json)),
+    (CSV_MIMETYPE, (dump_csv, stream_csv)),
+])
+if msgpack is not None:
+    SERIALIZERS[MSGPACK_MIMETYPE] = (dump_msgpack, None)
+if pyarrow is not None:
+    SERIALIZERS[ARROW_MIMETYPE] = (dump_arrow, None)
+
+
+def negotiate_mimetype():
+    """
+    Returns the serializer mimetype best matching the request `Accept`
+    header, JSON without one, None if nothing matches.
+    """
+    if not request.accept_mimetypes:
+        return JSON_MIMETYPE
+    return request.accept_mimetypes.best_match(list(SERIALIZERS))
+
+
+def negotiated(func):
+    """
+    Decorator passing the negotiated serializer `mimetype` to an API
+    handler, or answering 406 Not Acceptable if no serializer matches.
+    """
+    @wraps(func)
+    def decorated(*args, **kwargs):
+        mimetype = negotiate_mimetype()
+        if mimetype is None:
+            response = make_response(jsonify(
+                message="Not Acceptable",
+                errors=["Supported media types: {}".format(
+                    ", ".join(SERIALIZERS)
+                )],
+            ), 406)
+        else:
+            kwargs["mimetype"] = mimetype
+            response = make_response(func(*args, **kwargs))
+        response.vary.add("Accept")
+        return response
+
+    return decorated
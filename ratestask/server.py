@@ -0,0 +1,102 @@
+"""
+Pre-fork production server.
+
+The master process creates the app, which warms up the read-only state
+(region hierarchy, and with the columnar backend the prices columns), then
+forks the workers. The workers share that state copy-on-write; each of them
+opens its own DB pool, and restarts the background threads, after the fork.
+
+Usage:
+    python ratestask/server.py [--bind ADDRESS] [--workers N] [--threads N]
+"""
+import argparse
+import gc
+import os
+import sys
+
+from gunicorn.app.base import BaseApplication
+
+
+def default_workers():
+    return 2 * (os.cpu_count() or 1) + 1
+
+
+def pre_fork(server, worker):
+    app = server.app.wsgi()
+    app.db.before_fork()
+    if app.change_listener is not None:
+        app.change_listener.stop()
+    # Moves everything allocated so far out of the collector's reach, so
+    # that collections in the workers do not write to (and copy) the pages
+    # of the shared state.
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    app = server.app.wsgi()
+    app.db.after_fork()
+    # Every worker caches on its own, so each one listens to changes.
+    if app.change_listener is not None:
+        app.change_listener.start()
+
+
+class Server(BaseApplication):
+    """
+    gunicorn application serving `ratestask.wsgi:app` with the app loaded
+    in the master process.
+    """
+
+    def __init__(self, options=None):
+        self.options = options or {}
+        super(Server, self).__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+        self.cfg.set("preload_app", True)
+        self.cfg.set("pre_fork", pre_fork)
+        self.cfg.set("post_fork", post_fork)
+
+    def load(self):
+        from ratestask.wsgi import app
+        return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the pre-fork server.")
+    parser.add_argument(
+        "--bind",
+        default=os.getenv("BIND", "0.0.0.0:80"),
+        help="Address to listen on (default: $BIND or 0.0.0.0:80)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("WORKERS", default_workers())),
+        help="Number of worker processes (default: $WORKERS or 2 * CPUs + 1)",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=int(os.getenv("WORKER_THREADS", 1)),
+        help="Threads per worker (default: $WORKER_THREADS or 1)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=int,
+        default=int(os.getenv("WORKER_TIMEOUT", 30)),
+        help="Seconds after which a silent worker is restarted "
+             "(default: $WORKER_TIMEOUT or 30)",
+    )
+    args = parser.parse_args(argv)
+
+    Server({
+        "bind": args.bind,
+        "workers": args.workers,
+        "threads": args.threads,
+        "timeout": args.timeout,
+    }).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
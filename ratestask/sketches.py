@@ -0,0 +1,93 @@
+"""
+Mergeable price distribution sketches.
+
+Prices are counted per lane and day in logarithmic buckets (as in DDSketch),
+in the `daily_lane_price_buckets` table. Bucket `i >= 1` holds the prices in
+`(GAMMA ** (i - 2), GAMMA ** (i - 1)]`, bucket 0 the prices below 1. Adding up
+the counts of any set of lanes and days gives the sketch of their union,
+from which quantiles are estimated within `RELATIVE_ACCURACY` of the exact
+price.
+"""
+import math
+import re
+from bisect import bisect_right
+from itertools import accumulate
+
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+
+MAX_STATS = 10
+
+_PERCENTILE_RE = re.compile(r"^p([1-9][0-9]?)$")
+
+
+def price_bucket(price):
+    """
+    Bucket of a price, mirrors `price_bucket()` of the 0004 migration.
+    """
+    if price < 1:
+        return 0
+    return math.ceil(math.log(price) / LOG_GAMMA) + 1
+
+
+def bucket_value(bucket):
+    """
+    Estimate of the prices in a bucket, with a relative error of at most
+    `RELATIVE_ACCURACY`.
+    """
+    if bucket <= 0:
+        return 0.0
+    return 2 * GAMMA ** (bucket - 1) / (GAMMA + 1)
+
+
+def stat_quantile(name):
+    """
+    Quantile of a stat name, `median` or a percentile `p1` to `p99`. Raises
+    ValueError for other names.
+    """
+    if name == "median":
+        return 0.5
+    match = _PERCENTILE_RE.match(name)
+    if match is None:
+        raise ValueError("Unknown stat: {}".format(name))
+    return int(match.group(1)) / 100.0
+
+
+def quantiles(buckets, counts, qs):
+    """
+    Estimates the quantiles `qs` of a sketch given as its buckets, in
+    ascending order, and their price counts.
+    """
+    cumulative = list(accumulate(counts))
+    total = cumulative[-1]
+    return [
+        bucket_value(buckets[
+            min(bisect_right(cumulative, q * (total - 1)), len(buckets) - 1)
+        ])
+        for q in qs
+    ]
+
+
+def with_quantiles(rates, bucket_rows, qs, min_price_count=3):
+    """
+    Appends the quantiles `qs` to `(day, average_price)` rates, estimated from
+    the `(day, bucket, price_count)` rows of the same days, ordered by day and
+    bucket. Days with less than `min_price_count` prices get None quantiles.
+    """
+    sketches = {}
+    for day, bucket, count in bucket_rows:
+        buckets, counts = sketches.setdefault(day, ([], []))
+        buckets.append(bucket)
+        counts.append(count)
+
+    result = []
+    for day, average_price in rates:
+        buckets, counts = sketches.get(day, ((), ()))
+        if sum(counts) >= max(min_price_count, 1):
+            values = quantiles(buckets, counts, qs)
+        else:
+            values = [None] * len(qs)
+        result.append((day, average_price) + tuple(values))
+    return result
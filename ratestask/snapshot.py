@@ -0,0 +1,252 @@
+"""
+Binary snapshots of the rates data for the columnar backend.
+
+A snapshot holds the `RatesColumns` arrays (already sorted by lane and day
+and indexed by lane), the port code dictionary and the region hierarchy.
+Loading memory-maps the file and wraps the arrays without copying them, so
+it takes milliseconds and every process serving from the same file shares
+its pages through the OS page cache.
+
+Layout (little-endian): the magic `RATESNAP`, a uint32 format version and
+the uint32 length of a JSON header, followed by the header and the column
+arrays, each starting at a multiple of `ALIGNMENT` bytes. The header lists
+the port codes, the `(slug, parent_slug)` regions, the `(code, parent_slug)`
+ports and the dtype, offset and length of every array.
+
+Usage:
+    python ratestask/snapshot.py [--database-uri URI] export PATH
+    python ratestask/snapshot.py info PATH
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+import psycopg2
+
+from ratestask.columnar import RatesColumns, fetch_columns
+from ratestask.hierarchy import PORTS_QUERY, REGIONS_QUERY
+
+
+MAGIC = b"RATESNAP"
+VERSION = 1
+ALIGNMENT = 64
+
+_PREAMBLE = struct.Struct("<8sII")
+
+# Fixed-width, little-endian column arrays in file order.
+ARRAYS = (
+    ("orig", "<i4"),
+    ("dest", "<i4"),
+    ("day", "<i4"),
+    ("price", "<i4"),
+    ("bucket", "<i2"),
+    ("lanes", "<i8"),
+    ("lane_offsets", "<i8"),
+)
+
+
+class SnapshotError(Exception):
+    """
+    Raised for files that are no (complete) snapshot of a supported version.
+    """
+
+
+class Snapshot(
+    namedtuple("Snapshot", ["columns", "regions", "ports", "created_at"])
+):
+    pass
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_snapshot(path, columns, regions, ports):
+    """
+    Writes `RatesColumns` and the `(slug, parent_slug)` regions and
+    `(code, parent_slug)` ports of the hierarchy to a snapshot file. The file
+    is written next to `path` and renamed over it, so processes mapping the
+    previous snapshot keep reading it unchanged.
+    """
+    arrays = [
+        (name, np.ascontiguousarray(getattr(columns, name), dtype=dtype))
+        for name, dtype in ARRAYS
+    ]
+    header = {
+        "created_at": time.time(),
+        "rows": len(columns),
+        "port_codes": columns.port_codes,
+        "regions": [list(region) for region in regions],
+        "ports": [list(port) for port in ports],
+        "arrays": {},
+    }
+
+    # Offsets depend on the header length, which depends on the offsets:
+    # lay the arrays out after a header with room to spare.
+    header_size = len(json.dumps(header)) + 64 * (len(arrays) + 1)
+    offset = _aligned(_PREAMBLE.size + header_size)
+    for name, array in arrays:
+        header["arrays"][name] = {
+            "dtype": array.dtype.str,
+            "offset": offset,
+            "length": len(array),
+        }
+        offset = _aligned(offset + array.nbytes)
+    header_bytes = json.dumps(header).encode("utf-8")
+    assert len(header_bytes) <= header_size
+
+    tmp_path = "{}.tmp".format(path)
+    with open(tmp_path, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in arrays:
+            f.seek(header["arrays"][name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(offset)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def export_snapshot(db_conn, path, chunk_size=100000):
+    """
+    Writes a snapshot of the `prices`, `regions` and `ports` tables, read in
+    one repeatable-read transaction. Returns the number of prices written.
+    """
+    db_conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+    try:
+        with db_conn.cursor() as db_cursor:
+            db_cursor.execute(REGIONS_QUERY)
+            regions = db_cursor.fetchall()
+            db_cursor.execute(PORTS_QUERY)
+            ports = db_cursor.fetchall()
+            columns = fetch_columns(db_cursor, chunk_size=chunk_size)
+        db_conn.rollback()
+    finally:
+        db_conn.set_session(isolation_level="DEFAULT", readonly="DEFAULT")
+
+    write_snapshot(path, columns, regions, ports)
+    return len(columns)
+
+
+def read_header(buf):
+    """
+    Returns the header of the snapshot in `buf` after checking its format.
+    """
+    if len(buf) < _PREAMBLE.size:
+        raise SnapshotError("Not a rates snapshot")
+    magic, version, header_size = _PREAMBLE.unpack_from(buf)
+    if magic != MAGIC:
+        raise SnapshotError("Not a rates snapshot")
+    if version != VERSION:
+        raise SnapshotError(
+            "Unsupported snapshot version {} (expected {})".format(
+                version, VERSION
+            )
+        )
+
+    header_end = _PREAMBLE.size + header_size
+    if len(buf) < header_end:
+        raise SnapshotError("Truncated snapshot")
+    header = json.loads(bytes(buf[_PREAMBLE.size:header_end]).decode("utf-8"))
+    for name, dtype in ARRAYS:
+        spec = header["arrays"].get(name)
+        if spec is None or spec["dtype"] != np.dtype(dtype).str:
+            raise SnapshotError("Invalid snapshot array: {}".format(name))
+        end = spec["offset"] + spec["length"] * np.dtype(dtype).itemsize
+        if end > len(buf):
+            raise SnapshotError("Truncated snapshot")
+    return header
+
+
+def load_snapshot(path):
+    """
+    Maps a snapshot file into memory and returns it as a `Snapshot`, whose
+    read-only columns reference the mapped pages.
+    """
+    with open(path, "rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            raise SnapshotError("Not a rates snapshot")
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    header = read_header(buf)
+
+    arrays = {}
+    for name, dtype in ARRAYS:
+        spec = header["arrays"][name]
+        if spec["length"]:
+            # The arrays keep the mapping alive, it is unmapped once they
+            # are all garbage collected.
+            arrays[name] = np.frombuffer(
+                buf, dtype=dtype, count=spec["length"], offset=spec["offset"]
+            )
+        else:
+            arrays[name] = np.empty(0, dtype=dtype)
+
+    columns = RatesColumns.from_sorted(header["port_codes"], **arrays)
+    return Snapshot(
+        columns,
+        [tuple(region) for region in header["regions"]],
+        [tuple(port) for port in header["ports"]],
+        header["created_at"],
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Export and inspect rates snapshots."
+    )
+    parser.add_argument(
+        "--database-uri",
+        default=os.getenv("DATABASE_URI"),
+        help="Postgres connection URI (default: $DATABASE_URI)",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser(
+        "export", help="Write a snapshot of the rates data"
+    )
+    export_parser.add_argument("path", metavar="PATH")
+    info_parser = subparsers.add_parser("info", help="Describe a snapshot")
+    info_parser.add_argument("path", metavar="PATH")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        started = time.monotonic()
+        db_conn = psycopg2.connect(args.database_uri)
+        try:
+            rows = export_snapshot(db_conn, args.path)
+        finally:
+            db_conn.close()
+        print("{}: wrote {} prices in {:.2f}s".format(
+            args.path, rows, time.monotonic() - started
+        ))
+        return 0
+
+    started = time.monotonic()
+    try:
+        snapshot = load_snapshot(args.path)
+    except SnapshotError as e:
+        print("{}: {}".format(args.path, e), file=sys.stderr)
+        return 1
+    elapsed = time.monotonic() - started
+    print("{}: {} prices, {} lanes, {} ports, {} regions, created {}".format(
+        args.path,
+        len(snapshot.columns),
+        len(snapshot.columns.lanes),
+        len(snapshot.ports),
+        len(snapshot.regions),
+        time.strftime(
+            "%Y-%m-%d %H:%M:%S", time.localtime(snapshot.created_at)
+        ),
+    ))
+    print("loaded in {:.1f}ms".format(elapsed * 1000))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
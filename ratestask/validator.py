@@ -3,50 +3,126 @@ from flask import (
     request,
 )
 from datetime import datetime
+from functools import wraps
+from ratestask.db import GRANULARITIES
+from ratestask.metrics import phase
+from ratestask.sketches import MAX_STATS, stat_quantile
 from voluptuous import (
+    All,
+    Boolean,
+    In,
     Invalid,
+    Length,
     MultipleInvalid,
+    Optional,
     Required,
     Schema,
 )
 
 DEFAULT_DATE_FMT = "%Y-%m-%d"
+MAX_BATCH_LANES = 1000
 
 def validate_date(str_date):
     try:
         date_obj = datetime.strptime(str_date, DEFAULT_DATE_FMT)
         return date_obj.date()
-    except ValueError:
+    except (TypeError, ValueError):
         raise Invalid("Invalid date format: {}".format(str_date))
 
 
-rates_input_schema = Schema({
+def validate_stats(str_stats):
+    stats = tuple(name.strip() for name in str_stats.split(","))
+    for name in stats:
+        try:
+            stat_quantile(name)
+        except ValueError as e:
+            raise Invalid(str(e))
+    if len(set(stats)) != len(stats) or len(stats) > MAX_STATS:
+        raise Invalid(
+            "Stats must be at most {} distinct names".format(MAX_STATS)
+        )
+    return stats
+
+
+rates_lane_schema = Schema({
     Required("date_from"): validate_date,
     Required("date_to"): validate_date,
     Required("origin"): str,
     Required("destination"): str,
+    Optional("granularity"): In(GRANULARITIES),
 })
 
+rates_input_schema = rates_lane_schema.extend({
+    Optional("stream"): Boolean(),
+    Optional("stats"): validate_stats,
+})
 
-def validate_rates_inputs(func):
+def validate_unique_lane_ids(lanes):
+    lane_ids = [lane["id"] for lane in lanes if "id" in lane]
+    if len(lane_ids) != len(set(lane_ids)):
+        raise Invalid("Lane ids must be unique")
+    return lanes
+
+
+rates_batch_input_schema = Schema({
+    Required("lanes"): All(
+        [rates_lane_schema.extend({Optional("id"): str})],
+        Length(min=1, max=MAX_BATCH_LANES),
+        validate_unique_lane_ids,
+    ),
+})
+
+
+def _bad_request(input_args, error):
+    errors = [str(e) for e in error.errors]
+    return jsonify(
+        message="Bad Request",
+        args=input_args,
+        errors=errors
+    ), 400
+
+
+def validate_rates_inputs(func=None, schema=rates_input_schema):
     """
-    Decorator for validating rates API payload.
+    Decorator for validating rates API payload, the query arguments, against
+    `schema`. Used as `@validate_rates_inputs`, or as
+    `@validate_rates_inputs(schema=...)` for another schema.
     """
+    if func is None:
+        return lambda func: validate_rates_inputs(func, schema=schema)
+
+    @wraps(func)
     def decorated(*args, **kwargs):
         try:
             input_args =  {
                 key: val for key, val in request.args.items()
             }
-            validated_args = rates_input_schema(input_args)
+            with phase("validate"):
+                validated_args = schema(input_args)
+            kwargs.update(validated_args)
+
+        except MultipleInvalid as e:
+            return _bad_request(input_args, e)
+
+        return func(*args, **kwargs)
+
+    return decorated
+
+
+def validate_rates_batch_inputs(func):
+    """
+    Decorator for validating the JSON payload of the rates batch API.
+    """
+    @wraps(func)
+    def decorated(*args, **kwargs):
+        input_args = request.get_json(silent=True)
+        try:
+            with phase("validate"):
+                validated_args = rates_batch_input_schema(input_args)
             kwargs.update(validated_args)
 
         except MultipleInvalid as e:
-            errors = [str(error) for error in e.errors]
-            return jsonify(
-                message="Bad Request",
-                args=input_args,
-                errors=errors
-            ), 400
+            return _bad_request(input_args, e)
 
         return func(*args, **kwargs)
 
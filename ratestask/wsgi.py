@@ -0,0 +1,11 @@
+"""
+WSGI entry point of the app, e.g. for `gunicorn ratestask.wsgi:app`.
+
+`ratestask/server.py` runs it pre-forked, with the state warmed up once in
+the master process.
+"""
+from ratestask.app import config_from_env, create_app
+
+app = create_app(config_from_env())
+
+application = app
@@ -1,4 +1,21 @@
 
+DROP TABLE IF EXISTS public.schema_migrations;
+DROP TABLE IF EXISTS public.daily_lane_stats;
+DROP TABLE IF EXISTS public.daily_lane_price_buckets;
 DROP TABLE IF EXISTS public.prices;
+DROP TABLE IF EXISTS public.port_ancestors;
+DROP TABLE IF EXISTS public.region_ancestors;
 DROP TABLE IF EXISTS public.ports;
 DROP TABLE IF EXISTS public.regions;
+DROP FUNCTION IF EXISTS public.rebuild_daily_lane_stats();
+DROP FUNCTION IF EXISTS public.daily_lane_stats_truncate();
+DROP FUNCTION IF EXISTS public.daily_lane_stats_maintain();
+DROP FUNCTION IF EXISTS public.rebuild_daily_lane_price_buckets();
+DROP FUNCTION IF EXISTS public.daily_lane_price_buckets_truncate();
+DROP FUNCTION IF EXISTS public.daily_lane_price_buckets_maintain();
+DROP FUNCTION IF EXISTS public.price_bucket(integer);
+DROP FUNCTION IF EXISTS public.region_closure_maintain();
+DROP FUNCTION IF EXISTS public.rebuild_port_ancestors();
+DROP FUNCTION IF EXISTS public.rebuild_region_ancestors();
+DROP FUNCTION IF EXISTS public.notify_table_changed();
+DROP FUNCTION IF EXISTS public.notify_prices_changed();
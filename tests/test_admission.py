@@ -0,0 +1,139 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import threading
+import unittest
+
+from flask import Response
+
+from ratestask.admission import (
+    AdmissionController,
+    Overloaded,
+    admitted,
+    cost_class,
+)
+from ratestask.app import create_app
+
+
+class CostClassTest(unittest.TestCase):
+
+    def test_cost_class(self):
+        self.assertEqual(cost_class(True, True, 30), "light")
+        self.assertEqual(cost_class(True, False, 30), "medium")
+        self.assertEqual(cost_class(True, True, 365), "medium")
+        self.assertEqual(cost_class(False, False, 30), "heavy")
+        self.assertEqual(cost_class(False, False, 365), "heavy")
+
+
+class AdmissionControllerTest(unittest.TestCase):
+
+    def test_queue_full_rejected(self):
+        """
+        Test that requests beyond the in-flight limit and the queue are shed
+        at once.
+        """
+        admission = AdmissionController(max_in_flight=1, max_queue=0)
+        admission.acquire()
+        with self.assertRaises(Overloaded) as cm:
+            admission.acquire()
+        self.assertEqual(cm.exception.retry_after, 1)
+
+        admission.release()
+        admission.acquire()
+        stats = admission.stats()
+        self.assertEqual(stats["in_flight"], 1)
+        self.assertEqual(stats["admitted"], 2)
+        self.assertEqual(stats["rejected"], 1)
+
+    def test_queue_timeout(self):
+        admission = AdmissionController(
+            max_in_flight=1, max_queue=1, queue_timeout=0.01
+        )
+        admission.acquire()
+        with self.assertRaises(Overloaded):
+            admission.acquire()
+        stats = admission.stats()
+        self.assertEqual(stats["queued"], 1)
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertEqual(stats["waiting"], 0)
+
+    def test_queued_request_admitted_on_release(self):
+        admission = AdmissionController(
+            max_in_flight=1, max_queue=1, queue_timeout=10
+        )
+        admission.acquire()
+        admitted = threading.Event()
+
+        def wait():
+            admission.acquire()
+            admitted.set()
+
+        thread = threading.Thread(target=wait)
+        thread.start()
+        self.assertFalse(admitted.wait(0.05))
+        admission.release()
+        self.assertTrue(admitted.wait(5))
+        thread.join()
+        self.assertEqual(admission.stats()["queued"], 1)
+
+    def test_invalid_limits(self):
+        with self.assertRaises(ValueError):
+            AdmissionController(max_in_flight=0)
+
+
+class AdmissionAPITest(unittest.TestCase):
+
+    def test_overloaded_response(self):
+        """
+        Test that /rates requests beyond the admission limits get a 503
+        with a Retry-After header.
+        """
+        app = create_app({
+            "DATABASE_URI": None,
+            "TESTING": True,
+            "MAX_IN_FLIGHT": 1,
+            "ADMISSION_QUEUE_SIZE": 0,
+            "RETRY_AFTER": 3,
+        })
+        app.admission.acquire()
+        response = app.test_client().get(
+            "/rates?date_from=2021-01-01&date_to=2021-01-10"
+            "&origin=CNSGH&destination=north_europe_main"
+        )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "3")
+        self.assertEqual(response.json["message"], "Service Unavailable")
+        self.assertEqual(app.admission.stats()["rejected"], 1)
+
+    def test_streamed_response_holds_slot(self):
+        """
+        Test that a streamed response keeps its admission slot until it has
+        been written, and other responses release it right away.
+        """
+        app = create_app({"DATABASE_URI": None, "TESTING": True})
+
+        @app.route("/streamed")
+        @admitted
+        def streamed():
+            return Response(iter(["a", "b"]))
+
+        @app.route("/buffered")
+        @admitted
+        def buffered():
+            return Response("a")
+
+        client = app.test_client()
+        response = client.get("/buffered")
+        self.assertEqual(app.admission.stats()["in_flight"], 0)
+
+        response = client.get("/streamed", buffered=False)
+        self.assertEqual(app.admission.stats()["in_flight"], 1)
+        self.assertEqual(response.get_data(), b"ab")
+        response.close()
+        self.assertEqual(app.admission.stats()["in_flight"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import unittest
+from statistics import mean
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from tests.test_base import TestBase
+from ratestask.aio import create_aio_app, to_numbered_params
+
+
+class NumberedParamsTest(unittest.TestCase):
+
+    def test_to_numbered_params(self):
+        """
+        Test that named placeholders are numbered in order of first use,
+        and repeated names reuse their number.
+        """
+        query, args = to_numbered_params(
+            "SELECT %(b)s, %(a)s, %(b)s",
+            {"a": 1, "b": 2, "unused": 3},
+        )
+        self.assertEqual(query, "SELECT $1, $2, $1")
+        self.assertEqual(args, [2, 1])
+
+
+class AsyncAPITest(TestBase, unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        app = create_aio_app({"DATABASE_URI": self.db_uri})
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    async def test_get_avg_rates_region_name_given(self):
+        """
+        Test async API for fetching daily average rates, when the given origin
+        and/or destination is a region rather than port code, all ports prices
+        within that region should be included in the average.
+        """
+        test_regions = [
+            {"slug": "china_east_main", "name": "China East Main", "parent_slug": None},
+            {"slug": "uk_sub", "name": "UK Sub", "parent_slug": None},
+        ]
+        test_ports = [
+            {"code": "CNSGH", "name": "Shanghai", "parent_slug": "china_east_main"},
+            {"code": "CNNBO", "name": "Ningbo", "parent_slug": "china_east_main"},
+            {"code": "GBLON", "name": "London", "parent_slug": "uk_sub"},
+            {"code": "GBMNC", "name": "Manchester", "parent_slug": "uk_sub"},
+        ]
+        test_rates =[
+            {"day": "2021-01-01", "price": 1000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-01", "price": 3000.0, "orig_code": "CNNBO", "dest_code": "GBMNC"},
+            {"day": "2021-01-01", "price": 2000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-02", "price": 3000.0, "orig_code": "CNNBO", "dest_code": "GBMNC"},
+        ]
+
+        db_cursor = self.get_db_cursor()
+        self.create_db_entries(db_cursor, table_name="regions", data_dicts=test_regions)
+        self.create_db_entries(db_cursor, table_name="ports", data_dicts=test_ports)
+        self.create_db_entries(db_cursor, table_name="prices", data_dicts=test_rates)
+
+        args = {
+            "date_from": "2021-01-01",
+            "date_to": "2021-01-02",
+            "origin": "china_east_main",
+            "destination": "uk_sub",
+        }
+        resp = await self.client.get("/rates", params=args)
+        self.assertEqual(resp.status, 200)
+
+        daily_avg_rates = json.loads(await resp.text())
+        self.assertEqual(
+            daily_avg_rates,
+            [
+                {
+                    "day": "2021-01-01",
+                    "average_price": round(float(mean([1000, 3000, 2000])), 3),
+                },
+                {"day": "2021-01-02", "average_price": None},
+            ]
+        )
+
+    async def test_get_avg_rates_invalid_date(self):
+        """
+        Test async API for fetching rates, when the supplied date format is
+        invalid a 400 Bad Request response is returned.
+        """
+        args = {
+            "date_from": "01/01/2021",
+            "date_to": "2021-01-02",
+            "origin": "CNSGH",
+            "destination": "GBLON",
+        }
+        resp = await self.client.get("/rates", params=args)
+        self.assertEqual(resp.status, 400)
+
+    async def test_get_avg_rates_stream_rejected(self):
+        """
+        Test async API for fetching rates, `stream` is not supported and a
+        400 Bad Request response is returned rather than ignoring it.
+        """
+        args = {
+            "date_from": "2021-01-01",
+            "date_to": "2021-01-02",
+            "origin": "CNSGH",
+            "destination": "GBLON",
+            "stream": "1",
+        }
+        resp = await self.client.get("/rates", params=args)
+        self.assertEqual(resp.status, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
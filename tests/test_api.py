@@ -20,6 +20,10 @@ class APITest(TestBase):
             "TESTING": True,
         })
 
+    def tearDown(self):
+        self.app.db.close()
+        super(APITest, self).tearDown()
+
     def test_get_avg_rates(self):
         """
         Test API for successfully fetching daily average rates between the given
@@ -147,6 +151,39 @@ class APITest(TestBase):
             resp = client.get("/rates", query_string=args)
             self.assertEqual(resp.status_code, 400)
 
+    def test_get_avg_rates_invalid_granularity(self):
+        """
+        Test API for fetching rates, an unknown granularity gives a 400 Bad
+        Request response.
+        """
+        with self.app.test_client() as client:
+            args = {
+                "date_from": "2021-01-01",
+                "date_to": "2021-01-02",
+                "origin": "CNSGH",
+                "destination": "GBLON",
+                "granularity": "year",
+            }
+            resp = client.get("/rates", query_string=args)
+            self.assertEqual(resp.status_code, 400)
+
+    def test_get_avg_rates_invalid_stats(self):
+        """
+        Test API for fetching rates, unknown or repeated stats give a 400 Bad
+        Request response.
+        """
+        with self.app.test_client() as client:
+            for stats in ["p100", "median,mean", "p50,p50"]:
+                args = {
+                    "date_from": "2021-01-01",
+                    "date_to": "2021-01-02",
+                    "origin": "CNSGH",
+                    "destination": "GBLON",
+                    "stats": stats,
+                }
+                resp = client.get("/rates", query_string=args)
+                self.assertEqual(resp.status_code, 400)
+
     def test_get_avg_rates_null_avg(self):
         """
         Test API for fetching rates, given that a particular day within the
@@ -271,6 +308,345 @@ class APITest(TestBase):
                 round(float(avg_rate_2.get("average_price")), 3),
                 round(float(expected_avg_rate_2), 3),
             )
+    def test_get_avg_rates_cached(self):
+        """
+        Test API for fetching rates, given that the same rates were fetched
+        before, the cached response is returned without querying the DB, and
+        a matching If-None-Match header gets a 304 Not Modified response.
+        """
+        test_regions = [
+            {"slug": "china_east_main", "name": "China East Main", "parent_slug": None},
+            {"slug": "uk_sub", "name": "UK Sub", "parent_slug": None},
+        ]
+        test_ports = [
+            {"code": "CNSGH", "name": "Shanghai", "parent_slug": "china_east_main"},
+            {"code": "GBLON", "name": "London", "parent_slug": "uk_sub"},
+        ]
+        test_rates =[
+            {"day": "2021-01-01", "price": 1000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-01", "price": 2000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-01", "price": 3000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+        ]
+
+        db_cursor = self.get_db_cursor()
+        self.create_db_entries(db_cursor, table_name="regions", data_dicts=test_regions)
+        self.create_db_entries(db_cursor, table_name="ports", data_dicts=test_ports)
+        self.create_db_entries(db_cursor, table_name="prices", data_dicts=test_rates)
+
+        with self.app.test_client() as client:
+            args = {
+                "date_from": "2021-01-01",
+                "date_to": "2021-01-01",
+                "origin": "CNSGH",
+                "destination": "GBLON",
+            }
+            resp_1 = client.get("/rates", query_string=args)
+            self.assertEqual(resp_1.status_code, 200)
+            etag, _ = resp_1.get_etag()
+            self.assertIsNotNone(etag)
+
+            db_cursor.execute("DELETE FROM prices")
+            db_cursor.connection.commit()
+
+            resp_2 = client.get("/rates", query_string=args)
+            self.assertEqual(resp_2.status_code, 200)
+            self.assertEqual(resp_2.data, resp_1.data)
+
+            resp_3 = client.get(
+                "/rates",
+                query_string=args,
+                headers={"If-None-Match": '"{}"'.format(etag)}
+            )
+            self.assertEqual(resp_3.status_code, 304)
+
+            stats = json.loads(client.get("/stats").data)
+            self.assertEqual(stats["rates_cache"]["misses"], 1)
+            self.assertEqual(stats["rates_cache"]["hits"], 2)
+    def test_get_avg_rates_batch(self):
+        """
+        Test batch API for fetching daily average rates of many lanes in one
+        request, results are keyed by lane.
+        """
+        test_regions = [
+            {"slug": "china_east_main", "name": "China East Main", "parent_slug": None},
+            {"slug": "uk_sub", "name": "UK Sub", "parent_slug": None},
+        ]
+        test_ports = [
+            {"code": "CNSGH", "name": "Shanghai", "parent_slug": "china_east_main"},
+            {"code": "GBLON", "name": "London", "parent_slug": "uk_sub"},
+        ]
+        test_rates =[
+            {"day": "2021-01-01", "price": 1000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-01", "price": 3000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-01", "price": 2000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-02", "price": 3000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+        ]
+
+        db_cursor = self.get_db_cursor()
+        self.create_db_entries(db_cursor, table_name="regions", data_dicts=test_regions)
+        self.create_db_entries(db_cursor, table_name="ports", data_dicts=test_ports)
+        self.create_db_entries(db_cursor, table_name="prices", data_dicts=test_rates)
+
+        with self.app.test_client() as client:
+            payload = {
+                "lanes": [
+                    {
+                        "id": "port_to_port",
+                        "date_from": "2021-01-01",
+                        "date_to": "2021-01-02",
+                        "origin": "CNSGH",
+                        "destination": "GBLON",
+                    },
+                    {
+                        "date_from": "2021-01-01",
+                        "date_to": "2021-01-01",
+                        "origin": "china_east_main",
+                        "destination": "uk_sub",
+                    },
+                ]
+            }
+            resp = client.post("/rates/batch", json=payload)
+            self.assertEqual(resp.status_code, 200)
+
+            results = json.loads(resp.data)
+            self.assertEqual(
+                results["port_to_port"],
+                [
+                    {"day": "2021-01-01", "average_price": 2000.0},
+                    {"day": "2021-01-02", "average_price": None},
+                ]
+            )
+            self.assertEqual(
+                results["china_east_main:uk_sub:2021-01-01:2021-01-01"],
+                [{"day": "2021-01-01", "average_price": 2000.0}]
+            )
+
+    def test_get_rates_matrix(self):
+        """
+        Test the matrix API returning the average price of every lane
+        between two regions, in total and per day.
+        """
+        test_regions = [
+            {"slug": "china_east_main", "name": "China East Main", "parent_slug": None},
+            {"slug": "uk_sub", "name": "UK Sub", "parent_slug": None},
+        ]
+        test_ports = [
+            {"code": "CNNBO", "name": "Ningbo", "parent_slug": "china_east_main"},
+            {"code": "CNSGH", "name": "Shanghai", "parent_slug": "china_east_main"},
+            {"code": "GBLON", "name": "London", "parent_slug": "uk_sub"},
+            {"code": "GBMNC", "name": "Manchester", "parent_slug": "uk_sub"},
+        ]
+        test_rates = [
+            {"day": "2021-01-01", "price": 1000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-01", "price": 2000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-02", "price": 3000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-02", "price": 5000.0, "orig_code": "CNNBO", "dest_code": "GBMNC"},
+        ]
+
+        db_cursor = self.get_db_cursor()
+        self.create_db_entries(db_cursor, table_name="regions", data_dicts=test_regions)
+        self.create_db_entries(db_cursor, table_name="ports", data_dicts=test_ports)
+        self.create_db_entries(db_cursor, table_name="prices", data_dicts=test_rates)
+
+        url = (
+            "/rates/matrix?date_from=2021-01-01&date_to=2021-01-02"
+            "&origin=china_east_main&destination=uk_sub"
+        )
+        with self.app.test_client() as client:
+            resp = client.get(url)
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(
+                json.loads(resp.data),
+                [
+                    {"origin": "CNNBO", "destination": "GBMNC", "average_price": None},
+                    {"origin": "CNSGH", "destination": "GBLON", "average_price": 2000.0},
+                ]
+            )
+
+            resp = client.get(url + "&granularity=day")
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(
+                json.loads(resp.data),
+                [
+                    {"origin": "CNNBO", "destination": "GBMNC", "day": "2021-01-02", "average_price": None},
+                    {"origin": "CNSGH", "destination": "GBLON", "day": "2021-01-01", "average_price": None},
+                    {"origin": "CNSGH", "destination": "GBLON", "day": "2021-01-02", "average_price": None},
+                ]
+            )
+
+            resp = client.get(url + "&granularity=year")
+            self.assertEqual(resp.status_code, 400)
+
+    def test_get_avg_rates_batch_invalid_payload(self):
+        """
+        Test batch API for fetching rates, given that the payload is missing,
+        empty or has invalid lanes, a 400 Bad Request response is returned.
+        """
+        with self.app.test_client() as client:
+            resp = client.post("/rates/batch")
+            self.assertEqual(resp.status_code, 400)
+
+            resp = client.post("/rates/batch", json={"lanes": []})
+            self.assertEqual(resp.status_code, 400)
+
+            resp = client.post("/rates/batch", json={
+                "lanes": [
+                    {
+                        "date_from": "01/01/2021",
+                        "date_to": "2021-01-02",
+                        "origin": "CNSGH",
+                        "destination": "GBLON",
+                    },
+                ]
+            })
+            self.assertEqual(resp.status_code, 400)
+
+            resp = client.post("/rates/batch", json={
+                "lanes": [
+                    {
+                        "date_from": 20210101,
+                        "date_to": "2021-01-02",
+                        "origin": "CNSGH",
+                        "destination": "GBLON",
+                    },
+                ]
+            })
+            self.assertEqual(resp.status_code, 400)
+            self.assertIn("Invalid date format: 20210101", resp.json["errors"][0])
+
+    def test_get_avg_rates_streamed(self):
+        """
+        Test API for fetching rates as a streamed response, the same rates
+        are returned as without streaming.
+        """
+        test_regions = [
+            {"slug": "china_east_main", "name": "China East Main", "parent_slug": None},
+            {"slug": "uk_sub", "name": "UK Sub", "parent_slug": None},
+        ]
+        test_ports = [
+            {"code": "CNSGH", "name": "Shanghai", "parent_slug": "china_east_main"},
+            {"code": "GBLON", "name": "London", "parent_slug": "uk_sub"},
+        ]
+        test_rates =[
+            {"day": "2021-01-01", "price": 1000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-01", "price": 3000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-01", "price": 2000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-02", "price": 3000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+        ]
+
+        db_cursor = self.get_db_cursor()
+        self.create_db_entries(db_cursor, table_name="regions", data_dicts=test_regions)
+        self.create_db_entries(db_cursor, table_name="ports", data_dicts=test_ports)
+        self.create_db_entries(db_cursor, table_name="prices", data_dicts=test_rates)
+
+        with self.app.test_client() as client:
+            args = {
+                "date_from": "2021-01-01",
+                "date_to": "2021-01-03",
+                "origin": "CNSGH",
+                "destination": "GBLON",
+            }
+            resp = client.get("/rates", query_string=args)
+            streamed_resp = client.get("/rates", query_string=dict(args, stream="1"))
+
+            self.assertEqual(streamed_resp.status_code, 200)
+            self.assertEqual(json.loads(streamed_resp.data), json.loads(resp.data))
+
+    def test_get_avg_rates_metrics(self):
+        """
+        Test API for fetching rates, the response carries the phase timings
+        in a Server-Timing header and the request is counted in the
+        /metrics latency histograms by lane type.
+        """
+        test_regions = [
+            {"slug": "china_east_main", "name": "China East Main", "parent_slug": None},
+            {"slug": "uk_sub", "name": "UK Sub", "parent_slug": None},
+        ]
+        test_ports = [
+            {"code": "CNSGH", "name": "Shanghai", "parent_slug": "china_east_main"},
+            {"code": "GBLON", "name": "London", "parent_slug": "uk_sub"},
+        ]
+        test_rates =[
+            {"day": "2021-01-01", "price": 1000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+        ]
+
+        db_cursor = self.get_db_cursor()
+        self.create_db_entries(db_cursor, table_name="regions", data_dicts=test_regions)
+        self.create_db_entries(db_cursor, table_name="ports", data_dicts=test_ports)
+        self.create_db_entries(db_cursor, table_name="prices", data_dicts=test_rates)
+
+        with self.app.test_client() as client:
+            args = {
+                "date_from": "2021-01-01",
+                "date_to": "2021-01-01",
+                "origin": "CNSGH",
+                "destination": "uk_sub",
+            }
+            resp = client.get("/rates", query_string=args)
+            self.assertEqual(resp.status_code, 200)
+
+            phases = [
+                entry.split(";")[0]
+                for entry in resp.headers["Server-Timing"].split(", ")
+            ]
+            for name in ("validate", "acquire", "resolve", "query", "serialize", "total"):
+                self.assertIn(name, phases)
+
+            metrics = client.get("/metrics").data.decode()
+            self.assertIn(
+                'ratestask_request_duration_seconds_count'
+                '{endpoint="api.get_rates",lane_type="port_region"} 1',
+                metrics
+            )
+            self.assertIn("ratestask_db_pool_max_size 10", metrics)
+
+    def test_get_avg_rates_content_negotiation(self):
+        """
+        Test API for fetching rates, the response format follows the Accept
+        header, cached per format, and unsupported formats get a 406 Not
+        Acceptable response.
+        """
+        test_regions = [
+            {"slug": "china_east_main", "name": "China East Main", "parent_slug": None},
+            {"slug": "uk_sub", "name": "UK Sub", "parent_slug": None},
+        ]
+        test_ports = [
+            {"code": "CNSGH", "name": "Shanghai", "parent_slug": "china_east_main"},
+            {"code": "GBLON", "name": "London", "parent_slug": "uk_sub"},
+        ]
+        test_rates =[
+            {"day": "2021-01-01", "price": 1000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-01", "price": 2000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-01", "price": 3000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+        ]
+
+        db_cursor = self.get_db_cursor()
+        self.create_db_entries(db_cursor, table_name="regions", data_dicts=test_regions)
+        self.create_db_entries(db_cursor, table_name="ports", data_dicts=test_ports)
+        self.create_db_entries(db_cursor, table_name="prices", data_dicts=test_rates)
+
+        with self.app.test_client() as client:
+            args = {
+                "date_from": "2021-01-01",
+                "date_to": "2021-01-02",
+                "origin": "CNSGH",
+                "destination": "GBLON",
+            }
+            resp = client.get("/rates", query_string=args)
+            self.assertEqual(resp.mimetype, "application/json")
+            self.assertIn("Accept", resp.headers["Vary"])
+
+            csv_resp = client.get("/rates", query_string=args, headers={"Accept": "text/csv"})
+            self.assertEqual(csv_resp.status_code, 200)
+            self.assertEqual(csv_resp.mimetype, "text/csv")
+            self.assertEqual(
+                csv_resp.data.decode(),
+                "day,average_price\r\n2021-01-01,2000.0\r\n"
+            )
+
+            resp = client.get("/rates", query_string=args, headers={"Accept": "image/png"})
+            self.assertEqual(resp.status_code, 406)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -2,6 +2,7 @@ import os
 import unittest
 
 from ratestask.db import DBAPI
+from ratestask.migrate import Migrator
 
 
 class TestBase(unittest.TestCase):
@@ -33,6 +34,15 @@ class TestBase(unittest.TestCase):
             cursor.execute(f.read())
             cursor.connection.commit()
 
+        self._apply_migrations()
+
+    def _apply_migrations(self):
+        db_conn = self.db.get_db_conn()
+        try:
+            Migrator(db_conn).upgrade()
+        finally:
+            db_conn.close()
+
     def _drop_tables(self):
         sql_script = os.path.join(
             os.path.dirname(__file__), "schema", "drop_tables.sql"
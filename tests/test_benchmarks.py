@@ -0,0 +1,94 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import unittest
+
+from benchmarks.compare import compare
+from benchmarks.generate import generate_hierarchy, iter_price_chunks, port_code
+from benchmarks.run import percentile, summarize
+
+
+class GenerateTest(unittest.TestCase):
+
+    def test_port_code(self):
+        self.assertEqual(port_code(0), "AAAAA")
+        self.assertEqual(port_code(27), "AAABB")
+
+    def test_generate_hierarchy(self):
+        """
+        Test that the generated hierarchy is deterministic, every parent is
+        a known region, and ports are never attached to root regions.
+        """
+        regions, ports = generate_hierarchy(
+            top_regions=2, depth=3, fanout=3, ports=100, seed=1
+        )
+        self.assertEqual(
+            (regions, ports),
+            generate_hierarchy(top_regions=2, depth=3, fanout=3, ports=100, seed=1)
+        )
+        self.assertEqual(len(regions), 2 + 2 * 3 + 2 * 3 * 3)
+        self.assertEqual(len({code for code, _, _ in ports}), 100)
+
+        slugs = {slug for slug, _, _ in regions}
+        roots = {slug for slug, _, parent in regions if parent is None}
+        for _, _, parent in regions:
+            self.assertTrue(parent is None or parent in slugs)
+        for _, _, parent in ports:
+            self.assertIn(parent, slugs - roots)
+
+    def test_iter_price_chunks(self):
+        """
+        Test that the requested number of rows is generated in chunks, on
+        distinct origin and destination ports.
+        """
+        codes = [port_code(i) for i in range(20)]
+        chunks = list(
+            iter_price_chunks(codes, 2500, lanes=50, days=10, chunk_size=1000)
+        )
+        self.assertEqual([len(chunk) for chunk in chunks], [1000, 1000, 500])
+        for orig_code, dest_code, day, price in chunks[0]:
+            self.assertIn(orig_code, codes)
+            self.assertIn(dest_code, codes)
+            self.assertNotEqual(orig_code, dest_code)
+            self.assertTrue("2021-01-01" <= day <= "2021-01-10")
+            self.assertGreater(price, 0)
+
+
+class ResultsTest(unittest.TestCase):
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 95), 7)
+        self.assertIsNone(percentile([], 50))
+
+    def test_summarize(self):
+        samples = [
+            ("port_port", 0.010, True),
+            ("port_port", 0.020, True),
+            ("region_region", 0.100, False),
+        ]
+        summary = summarize(samples, elapsed=2.0)
+
+        self.assertEqual(summary["all"]["count"], 3)
+        self.assertEqual(summary["all"]["errors"], 1)
+        self.assertEqual(summary["all"]["throughput_rps"], 1.5)
+        self.assertAlmostEqual(summary["port_port"]["p50_ms"], 10.0)
+        self.assertAlmostEqual(summary["port_port"]["p99_ms"], 20.0)
+        self.assertEqual(summary["port_region"]["count"], 0)
+        self.assertIsNone(summary["port_region"]["p50_ms"])
+
+    def test_compare(self):
+        baseline = {"results": {"db": {"all": {"p50_ms": 10.0, "throughput_rps": 100.0}}}}
+        candidate = {"results": {"db": {"all": {"p50_ms": 5.0, "throughput_rps": 200.0}}}}
+        rows = compare(baseline, candidate)
+
+        self.assertIn(("db", "all", "p50_ms", 10.0, 5.0, -0.5), rows)
+        self.assertIn(("db", "all", "throughput_rps", 100.0, 200.0, 1.0), rows)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import time
+import unittest
+
+from flask import Flask, jsonify
+
+from ratestask.cache import LRUCache, cached_response
+from ratestask.db import DBAPI
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        """
+        Test that the least recently used entry is evicted first.
+        """
+        cache = LRUCache(maxsize=2, ttl=None)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_max_bytes(self):
+        """
+        Test that entries are evicted to stay within max_bytes, and entries
+        larger than max_bytes are not cached at all.
+        """
+        cache = LRUCache(maxsize=10, ttl=None, max_bytes=10)
+        cache.set("a", "a", nbytes=6)
+        cache.set("b", "b", nbytes=6)
+        cache.set("c", "c", nbytes=11)
+
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), "b")
+        self.assertIsNone(cache.get("c"))
+        self.assertEqual(cache.stats()["bytes"], 6)
+
+    def test_ttl(self):
+        """
+        Test that entries expire after the TTL.
+        """
+        cache = LRUCache(maxsize=2, ttl=0.01)
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("a"))
+
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["expirations"], 1)
+        self.assertEqual(stats["entries"], 0)
+
+    def test_evict(self):
+        """
+        Test that matching entries are evicted, and that values computed
+        before the eviction are not stored.
+        """
+        cache = LRUCache(maxsize=10, ttl=None)
+        cache.set(("a", 1), 1)
+        cache.set(("b", 2), 2)
+        generation = cache.generation
+
+        self.assertEqual(cache.evict(lambda key: key[0] == "a"), 1)
+        self.assertIsNone(cache.get(("a", 1)))
+        self.assertEqual(cache.get(("b", 2)), 2)
+        self.assertEqual(cache.stats()["invalidations"], 1)
+
+        cache.set(("a", 1), 1, generation=generation)
+        self.assertIsNone(cache.get(("a", 1)))
+        cache.set(("a", 1), 1, generation=cache.generation)
+        self.assertEqual(cache.get(("a", 1)), 1)
+
+    def test_invalidated(self):
+        """
+        Test that evicted keys are reported as invalidated until they are
+        stored again.
+        """
+        cache = LRUCache(maxsize=10, ttl=None)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.evict(lambda key: key == "a")
+        self.assertTrue(cache.invalidated("a"))
+        self.assertFalse(cache.invalidated("b"))
+
+        cache.set("a", 1)
+        self.assertFalse(cache.invalidated("a"))
+
+
+class CachedResponseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.primary_reads = []
+        self.app = Flask(__name__)
+        self.app.rates_cache = LRUCache(maxsize=10, ttl=60)
+
+        self.app.db = DBAPI("postgresql://unused", pool_min_size=0)
+
+        @self.app.route("/echo/<value>")
+        @cached_response
+        def echo(value):
+            self.calls.append(value)
+            self.primary_reads.append(self.app.db._reads_primary())
+            return jsonify(value=value)
+
+    def test_cached_with_etag(self):
+        """
+        Test that responses are served from the cache with a strong ETag,
+        and revalidated with a 304 without calling the handler.
+        """
+        with self.app.test_client() as client:
+            resp_1 = client.get("/echo/a")
+            resp_2 = client.get("/echo/a")
+            self.assertEqual(resp_1.status_code, 200)
+            self.assertEqual(resp_1.data, resp_2.data)
+            self.assertEqual(self.calls, ["a"])
+
+            etag, weak = resp_1.get_etag()
+            self.assertIsNotNone(etag)
+            self.assertFalse(weak)
+            self.assertEqual(resp_2.get_etag(), (etag, False))
+
+            resp_3 = client.get("/echo/a", headers={"If-None-Match": '"{}"'.format(etag)})
+            self.assertEqual(resp_3.status_code, 304)
+            self.assertEqual(resp_3.data, b"")
+            self.assertEqual(self.calls, ["a"])
+
+            client.get("/echo/b")
+            self.assertEqual(self.calls, ["a", "b"])
+
+    def test_invalidated_read_from_primary(self):
+        """
+        Test that responses evicted by an invalidation are refilled from the
+        primary, and later ones from replicas again.
+        """
+        with self.app.test_client() as client:
+            client.get("/echo/a")
+            self.app.rates_cache.evict(lambda key: True)
+            client.get("/echo/a")
+            self.app.rates_cache.clear()
+            client.get("/echo/a")
+        self.assertEqual(self.primary_reads, [False, True, False])
+
+    def test_cache_disabled(self):
+        """
+        Test that ETags are still checked when the cache is disabled.
+        """
+        self.app.rates_cache = None
+        with self.app.test_client() as client:
+            etag, _ = client.get("/echo/a").get_etag()
+            resp = client.get("/echo/a", headers={"If-None-Match": '"{}"'.format(etag)})
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(self.calls, ["a", "a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,273 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import unittest
+from datetime import date
+from statistics import mean
+
+import numpy as np
+
+from tests.test_base import TestBase
+from ratestask.columnar import ColumnarDBAPI, RatesColumns
+
+
+def build_columns(port_codes, rates):
+    port_ids = {code: i for i, code in enumerate(port_codes)}
+    return RatesColumns(
+        port_codes,
+        np.array([port_ids[rate["orig_code"]] for rate in rates], dtype=np.int32),
+        np.array([port_ids[rate["dest_code"]] for rate in rates], dtype=np.int32),
+        np.array(
+            [date.fromisoformat(rate["day"]).toordinal() for rate in rates],
+            dtype=np.int32,
+        ),
+        np.array([rate["price"] for rate in rates], dtype=np.int32),
+    )
+
+
+class RatesColumnsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rates = [
+            {"day": "2021-01-02", "price": 5000, "orig_code": "CNNBO", "dest_code": "GBLON"},
+            {"day": "2021-01-01", "price": 1000, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-01", "price": 3000, "orig_code": "CNNBO", "dest_code": "GBMNC"},
+            {"day": "2021-01-01", "price": 2000, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-02", "price": 3000, "orig_code": "CNNBO", "dest_code": "GBMNC"},
+            {"day": "2021-01-02", "price": 4000, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-05", "price": 9000, "orig_code": "GBLON", "dest_code": "CNSGH"},
+        ]
+        self.columns = build_columns(
+            ["CNNBO", "CNSGH", "GBLON", "GBMNC"], self.rates
+        )
+
+    def test_sorted_by_lane_and_day(self):
+        """
+        Test that rows are sorted by (orig, dest, day) and indexed by lane.
+        """
+        keys = list(zip(self.columns.orig, self.columns.dest, self.columns.day))
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual(len(self.columns.lanes), 4)
+        self.assertEqual(self.columns.lane_offsets[-1], len(self.rates))
+
+    def test_avg_rates_multiple_lanes(self):
+        """
+        Test daily averages over all lanes between two sets of ports.
+        """
+        daily_avg_rates = self.columns.avg_rates(
+            date(2021, 1, 1),
+            date(2021, 1, 2),
+            {"CNSGH", "CNNBO"},
+            {"GBLON", "GBMNC"},
+        )
+        self.assertEqual(
+            daily_avg_rates,
+            [
+                (date(2021, 1, 1), mean([1000, 3000, 2000])),
+                (date(2021, 1, 2), mean([5000, 3000, 4000])),
+            ],
+        )
+
+    def test_avg_rates_min_price_count(self):
+        """
+        Test that days with less than min_price_count prices have a null
+        average, and days without prices are omitted.
+        """
+        daily_avg_rates = self.columns.avg_rates(
+            date(2021, 1, 1),
+            date(2021, 1, 10),
+            {"CNSGH"},
+            {"GBLON"},
+        )
+        self.assertEqual(
+            daily_avg_rates,
+            [(date(2021, 1, 1), None), (date(2021, 1, 2), None)],
+        )
+
+    def test_avg_rates_granularity(self):
+        """
+        Test weekly and monthly averages, labelled by the first day of the
+        bucket, with min_price_count applied per bucket.
+        """
+        self.assertEqual(
+            self.columns.avg_rates(
+                date(2021, 1, 1), date(2021, 1, 10), {"CNSGH"}, {"GBLON"},
+                granularity="week",
+            ),
+            [(date(2020, 12, 28), mean([1000, 2000, 4000]))],
+        )
+        self.assertEqual(
+            self.columns.avg_rates(
+                date(2021, 1, 1), date(2021, 1, 31), {"CNNBO", "GBLON"},
+                {"CNSGH", "GBLON"}, granularity="month",
+            ),
+            [(date(2021, 1, 1), None)],
+        )
+
+    def test_avg_rates_stats(self):
+        """
+        Test that percentiles are estimated per day from the price sketches,
+        and are null where the average is.
+        """
+        daily_avg_rates = self.columns.avg_rates(
+            date(2021, 1, 1),
+            date(2021, 1, 2),
+            {"CNSGH", "CNNBO"},
+            {"GBLON", "GBMNC"},
+            stats=("p10", "median"),
+        )
+        self.assertEqual(len(daily_avg_rates), 2)
+        day, _, p10, median = daily_avg_rates[0]
+        self.assertEqual(day, date(2021, 1, 1))
+        self.assertAlmostEqual(p10, 1000, delta=10)
+        self.assertAlmostEqual(median, 2000, delta=20)
+
+        self.assertEqual(
+            self.columns.avg_rates(
+                date(2021, 1, 1), date(2021, 1, 1), {"CNSGH"}, {"GBLON"},
+                stats=("median",),
+            ),
+            [(date(2021, 1, 1), None, None)],
+        )
+
+    def test_lane_matrix(self):
+        """
+        Test averages per lane, over the whole range and per week.
+        """
+        origins = {"CNSGH", "CNNBO"}
+        destinations = {"GBLON", "GBMNC"}
+        self.assertEqual(
+            self.columns.lane_matrix(
+                date(2021, 1, 1), date(2021, 1, 2), origins, destinations
+            ),
+            [
+                ("CNNBO", "GBLON", None),
+                ("CNNBO", "GBMNC", None),
+                ("CNSGH", "GBLON", mean([1000, 2000, 4000])),
+            ],
+        )
+        self.assertEqual(
+            self.columns.lane_matrix(
+                date(2021, 1, 1),
+                date(2021, 1, 10),
+                origins,
+                destinations,
+                min_price_count=1,
+                granularity="week",
+            ),
+            [
+                ("CNNBO", "GBLON", date(2020, 12, 28), 5000),
+                ("CNNBO", "GBMNC", date(2020, 12, 28), 3000),
+                ("CNSGH", "GBLON", date(2020, 12, 28), mean([1000, 2000, 4000])),
+            ],
+        )
+
+    def test_avg_rates_unknown_ports(self):
+        """
+        Test that unknown ports and lanes without prices give no rates.
+        """
+        self.assertEqual(
+            self.columns.avg_rates(
+                date(2021, 1, 1), date(2021, 1, 2), {"XXXXX"}, {"GBLON"}
+            ),
+            [],
+        )
+        self.assertEqual(
+            self.columns.avg_rates(
+                date(2021, 1, 1), date(2021, 1, 2), {"GBMNC"}, {"CNSGH"}
+            ),
+            [],
+        )
+
+    def test_empty(self):
+        """
+        Test that an empty prices table can be loaded and queried.
+        """
+        columns = build_columns(["CNSGH"], [])
+        self.assertEqual(
+            columns.avg_rates(
+                date(2021, 1, 1), date(2021, 1, 2), {"CNSGH"}, {"CNSGH"}
+            ),
+            [],
+        )
+
+
+class ColumnarForkTest(unittest.TestCase):
+
+    def test_reloader_restarted_after_fork(self):
+        """
+        Test that the reloading thread is stopped before forking and started
+        again in the worker.
+        """
+        db = ColumnarDBAPI(None, reload_interval=3600)
+        db.start_reloader()
+        try:
+            db.before_fork()
+            self.assertIsNone(db._reloader)
+
+            db.after_fork()
+            self.assertTrue(db._reloader.is_alive())
+        finally:
+            db.stop_reloader()
+
+
+class ColumnarDBAPITest(TestBase):
+
+    def test_get_avg_rates_nested_region(self):
+        """
+        Test that the columnar backend, loaded from the DB, returns the same
+        daily averages as the Postgres backend for nested regions.
+        """
+        test_regions = [
+            {"slug": "northern_europe", "name": "Northern Europe", "parent_slug": None},
+            {"slug": "baltic", "name": "Baltic", "parent_slug": "northern_europe"},
+            {"slug": "finland_main", "name": "Finland Main", "parent_slug": "baltic"},
+            {"slug": "china_east_main", "name": "China East Main", "parent_slug": None},
+        ]
+        test_ports = [
+            {"code": "CNNBO", "name": "Ningbo", "parent_slug": "china_east_main"},
+            {"code": "FIIMA", "name": "Imatra", "parent_slug": "baltic"},
+            {"code": "FIRAU", "name": "Rauma", "parent_slug": "finland_main"},
+        ]
+        test_rates = [
+            {"day": "2021-01-01", "price": 1000, "orig_code": "CNNBO", "dest_code": "FIIMA"},
+            {"day": "2021-01-01", "price": 3000, "orig_code": "CNNBO", "dest_code": "FIRAU"},
+            {"day": "2021-01-01", "price": 2000, "orig_code": "CNNBO", "dest_code": "FIRAU"},
+            {"day": "2021-01-02", "price": 3000, "orig_code": "CNNBO", "dest_code": "FIIMA"},
+        ]
+
+        db_cursor = self.get_db_cursor()
+        self.create_db_entries(db_cursor, table_name="regions", data_dicts=test_regions)
+        self.create_db_entries(db_cursor, table_name="ports", data_dicts=test_ports)
+        self.create_db_entries(db_cursor, table_name="prices", data_dicts=test_rates)
+
+        columnar_db = ColumnarDBAPI(self.db_uri)
+        try:
+            columnar_rates = columnar_db.fetch_avg_rates(
+                date(2021, 1, 1), date(2021, 1, 2), "china_east_main", "northern_europe"
+            )
+        finally:
+            columnar_db.close()
+
+        db_rates = self.db.get_avg_rates(
+            db_cursor,
+            start_date=date(2021, 1, 1),
+            end_date=date(2021, 1, 2),
+            origin="china_east_main",
+            destination="northern_europe"
+        )
+
+        self.assertEqual(len(columnar_rates), 2)
+        self.assertEqual(
+            [(day, round(avg, 3) if avg is not None else None) for day, avg in columnar_rates],
+            [
+                (day, round(float(avg), 3) if avg is not None else None)
+                for day, avg in db_rates
+            ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,6 +7,36 @@ import unittest
 from statistics import mean
 
 from tests.test_base import TestBase
+from ratestask.db import DBAPI, PreparedStatement
+
+
+class PreparedStatementTest(unittest.TestCase):
+
+    def test_prepared_statement(self):
+        statement = PreparedStatement(
+            "lane",
+            "SELECT * FROM prices WHERE orig_code = %(origin)s AND "
+            "day >= %(day)s AND dest_code = %(origin)s",
+            {"origin": "text", "day": "date"},
+        )
+        self.assertEqual(
+            statement.prepare_sql,
+            "PREPARE lane (text, date) AS SELECT * FROM prices WHERE "
+            "orig_code = $1 AND day >= $2 AND dest_code = $1"
+        )
+        self.assertEqual(statement.execute_sql, "EXECUTE lane (%s, %s)")
+        self.assertEqual(
+            statement.args({"day": "2021-01-01", "origin": "CNSGH"}),
+            ["CNSGH", "2021-01-01"]
+        )
+
+    def test_invalid_plan_cache_mode(self):
+        with self.assertRaises(ValueError):
+            DBAPI(None, plan_cache_mode="always")
+
+    def test_invalid_region_resolution(self):
+        with self.assertRaises(ValueError):
+            DBAPI(None, region_resolution="cte")
 
 
 class DBQueryTest(TestBase):
@@ -250,6 +280,679 @@ class DBQueryTest(TestBase):
             round(float(expected_avg_rate_2), 3),
         )
 
+    def test_get_avg_rates_unknown_port(self):
+        """
+        Test for fetching daily average rates, given that the origin is
+        neither a known port code nor a region, no rates are returned.
+        """
+        test_regions = [
+            {"slug": "china_east_main", "name": "China East Main", "parent_slug": None},
+        ]
+        test_ports = [
+            {"code": "CNSGH", "name": "Shanghai", "parent_slug": "china_east_main"},
+        ]
+
+        db_cursor = self.get_db_cursor()
+        self.create_db_entries(db_cursor, table_name="regions", data_dicts=test_regions)
+        self.create_db_entries(db_cursor, table_name="ports", data_dicts=test_ports)
+
+        daily_avg_rates = self.db.get_avg_rates(
+            db_cursor,
+            start_date="2021-01-01",
+            end_date="2021-01-02",
+            origin="XXXXX",
+            destination="CNSGH"
+        )
+        self.assertEqual(daily_avg_rates, [])
+
+    def test_get_avg_rates_port_added_after_load(self):
+        """
+        Test for fetching daily average rates, given that a port is added
+        after the region hierarchy was loaded, the hierarchy is reloaded
+        and the new port's prices are included.
+        """
+        self.db.hierarchy.miss_reload_interval = 0
+        test_regions = [
+            {"slug": "china_east_main", "name": "China East Main", "parent_slug": None},
+            {"slug": "uk_sub", "name": "UK Sub", "parent_slug": None},
+        ]
+        test_ports = [
+            {"code": "CNSGH", "name": "Shanghai", "parent_slug": "china_east_main"},
+        ]
+
+        db_cursor = self.get_db_cursor()
+        self.create_db_entries(db_cursor, table_name="regions", data_dicts=test_regions)
+        self.create_db_entries(db_cursor, table_name="ports", data_dicts=test_ports)
+        self.db.hierarchy.refresh(db_cursor)
+
+        test_ports = [
+            {"code": "GBLON", "name": "London", "parent_slug": "uk_sub"},
+        ]
+        test_rates = [
+            {"day": "2021-01-01", "price": 1000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-01", "price": 2000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-01", "price": 3000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+        ]
+        self.create_db_entries(db_cursor, table_name="ports", data_dicts=test_ports)
+        self.create_db_entries(db_cursor, table_name="prices", data_dicts=test_rates)
+
+        daily_avg_rates = self.db.get_avg_rates(
+            db_cursor,
+            start_date="2021-01-01",
+            end_date="2021-01-01",
+            origin="CNSGH",
+            destination="GBLON"
+        )
+        self.assertEqual(len(daily_avg_rates), 1)
+        self.assertEqual(round(float(daily_avg_rates[0][1]), 3), 2000.0)
+
+    def test_daily_lane_stats_maintained(self):
+        """
+        Test that the daily_lane_stats rollup follows inserts, updates,
+        deletes and truncates of prices, so the daily averages (including
+        the min price count rule) stay exact.
+        """
+        test_regions = [
+            {"slug": "china_east_main", "name": "China East Main", "parent_slug": None},
+            {"slug": "uk_sub", "name": "UK Sub", "parent_slug": None},
+        ]
+        test_ports = [
+            {"code": "CNSGH", "name": "Shanghai", "parent_slug": "china_east_main"},
+            {"code": "GBLON", "name": "London", "parent_slug": "uk_sub"},
+        ]
+        test_rates = [
+            {"day": "2021-01-01", "price": 1000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-01", "price": 2000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-01", "price": 3000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-02", "price": 4000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+        ]
+
+        db_cursor = self.get_db_cursor()
+        self.create_db_entries(db_cursor, table_name="regions", data_dicts=test_regions)
+        self.create_db_entries(db_cursor, table_name="ports", data_dicts=test_ports)
+        self.create_db_entries(db_cursor, table_name="prices", data_dicts=test_rates)
+
+        db_cursor.execute(
+            "SELECT day, price_sum, price_count FROM daily_lane_stats ORDER BY day"
+        )
+        self.assertEqual(
+            [(str(day), total, count) for day, total, count in db_cursor.fetchall()],
+            [("2021-01-01", 6000, 3), ("2021-01-02", 4000, 1)],
+        )
+
+        db_cursor.execute("UPDATE prices SET price = 4000 WHERE price = 1000")
+        db_cursor.connection.commit()
+        daily_avg_rates = self.db.get_avg_rates(
+            db_cursor,
+            start_date="2021-01-01",
+            end_date="2021-01-02",
+            origin="CNSGH",
+            destination="GBLON"
+        )
+        self.assertEqual(len(daily_avg_rates), 2)
+        self.assertEqual(round(float(daily_avg_rates[0][1]), 3), 3000.0)
+        self.assertIsNone(daily_avg_rates[1][1])
+
+        db_cursor.execute("DELETE FROM prices WHERE day = '2021-01-02'")
+        db_cursor.connection.commit()
+        db_cursor.execute("SELECT COUNT(*) FROM daily_lane_stats")
+        self.assertEqual(db_cursor.fetchone()[0], 1)
+
+        db_cursor.execute("DELETE FROM prices WHERE price = 4000")
+        db_cursor.connection.commit()
+        daily_avg_rates = self.db.get_avg_rates(
+            db_cursor,
+            start_date="2021-01-01",
+            end_date="2021-01-02",
+            origin="CNSGH",
+            destination="GBLON"
+        )
+        self.assertEqual(len(daily_avg_rates), 1)
+        self.assertIsNone(daily_avg_rates[0][1])
+
+        db_cursor.execute("TRUNCATE prices")
+        db_cursor.connection.commit()
+        db_cursor.execute("SELECT COUNT(*) FROM daily_lane_stats")
+        self.assertEqual(db_cursor.fetchone()[0], 0)
+        db_cursor.connection.commit()
+
+    def test_get_batch_avg_rates(self):
+        """
+        Test for fetching daily average rates of many lanes at once, every
+        lane gets the same rates as when fetched on its own.
+        """
+        test_regions = [
+            {"slug": "china_east_main", "name": "China East Main", "parent_slug": None},
+            {"slug": "uk_sub", "name": "UK Sub", "parent_slug": None},
+        ]
+        test_ports = [
+            {"code": "CNSGH", "name": "Shanghai", "parent_slug": "china_east_main"},
+            {"code": "CNNBO", "name": "Ningbo", "parent_slug": "china_east_main"},
+            {"code": "GBLON", "name": "London", "parent_slug": "uk_sub"},
+            {"code": "GBMNC", "name": "Manchester", "parent_slug": "uk_sub"},
+        ]
+        test_rates =[
+            {"day": "2021-01-01", "price": 1000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-01", "price": 3000.0, "orig_code": "CNNBO", "dest_code": "GBMNC"},
+            {"day": "2021-01-01", "price": 2000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-02", "price": 3000.0, "orig_code": "CNNBO", "dest_code": "GBMNC"},
+            {"day": "2021-01-02", "price": 4000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-02", "price": 5000.0, "orig_code": "CNNBO", "dest_code": "GBLON"},
+        ]
+
+        db_cursor = self.get_db_cursor()
+        self.create_db_entries(db_cursor, table_name="regions", data_dicts=test_regions)
+        self.create_db_entries(db_cursor, table_name="ports", data_dicts=test_ports)
+        self.create_db_entries(db_cursor, table_name="prices", data_dicts=test_rates)
+
+        lanes = [
+            ("2021-01-01", "2021-01-02", "china_east_main", "uk_sub"),
+            ("2021-01-01", "2021-01-01", "CNSGH", "GBLON"),
+            ("2021-01-02", "2021-01-02", "CNNBO", "uk_sub"),
+            ("2021-01-01", "2021-01-02", "XXXXX", "uk_sub"),
+        ]
+        batch_rates = self.db.get_batch_avg_rates(db_cursor, lanes)
+
+        self.assertEqual(len(batch_rates), len(lanes))
+        self.assertEqual(batch_rates[3], [])
+        for lane, rates in zip(lanes, batch_rates):
+            start_date, end_date, origin, destination = lane
+            self.assertEqual(
+                rates,
+                self.db.get_avg_rates(
+                    db_cursor,
+                    start_date=start_date,
+                    end_date=end_date,
+                    origin=origin,
+                    destination=destination
+                )
+            )
+
+        self.assertEqual(len(batch_rates[0]), 2)
+        self.assertEqual(
+            round(float(batch_rates[0][1][1]), 3),
+            round(float(mean([3000, 4000, 5000])), 3),
+        )
+        self.assertEqual(len(batch_rates[1]), 1)
+        self.assertIsNone(batch_rates[1][0][1])
+
+        db = DBAPI(self.db_uri, region_resolution="database")
+        self.assertEqual(db.get_batch_avg_rates(db_cursor, lanes), batch_rates)
+        self.assertIsNone(db.hierarchy.index)
+
+    def test_iter_avg_rates(self):
+        """
+        Test for streaming daily average rates from a server-side cursor,
+        the same rates are returned as when fetched at once, and the pooled
+        connection is returned afterwards.
+        """
+        test_regions = [
+            {"slug": "china_east_main", "name": "China East Main", "parent_slug": None},
+            {"slug": "uk_sub", "name": "UK Sub", "parent_slug": None},
+        ]
+        test_ports = [
+            {"code": "CNSGH", "name": "Shanghai", "parent_slug": "china_east_main"},
+            {"code": "GBLON", "name": "London", "parent_slug": "uk_sub"},
+        ]
+        test_rates = [
+            {"day": "2021-01-%02d" % day, "price": 1000.0 * day, "orig_code": "CNSGH", "dest_code": "GBLON"}
+            for day in range(1, 11)
+            for _ in range(3)
+        ]
+
+        db_cursor = self.get_db_cursor()
+        self.create_db_entries(db_cursor, table_name="regions", data_dicts=test_regions)
+        self.create_db_entries(db_cursor, table_name="ports", data_dicts=test_ports)
+        self.create_db_entries(db_cursor, table_name="prices", data_dicts=test_rates)
+
+        self.db.stream_itersize = 3
+        try:
+            streamed_rates = list(self.db.iter_avg_rates(
+                start_date="2021-01-01",
+                end_date="2021-01-10",
+                origin="china_east_main",
+                destination="GBLON"
+            ))
+            self.assertEqual(self.db.pool_stats()["in_use"], 0)
+        finally:
+            self.db.close()
+
+        self.assertEqual(len(streamed_rates), 10)
+        self.assertEqual(
+            streamed_rates,
+            self.db.get_avg_rates(
+                db_cursor,
+                start_date="2021-01-01",
+                end_date="2021-01-10",
+                origin="china_east_main",
+                destination="GBLON"
+            )
+        )
+
+    def test_get_avg_rates_granularity(self):
+        """
+        Test for fetching weekly and monthly average rates, min_price_count
+        applies to each bucket rather than to each day.
+        """
+        test_regions = [
+            {"slug": "china_east_main", "name": "China East Main", "parent_slug": None},
+            {"slug": "uk_sub", "name": "UK Sub", "parent_slug": None},
+        ]
+        test_ports = [
+            {"code": "CNSGH", "name": "Shanghai", "parent_slug": "china_east_main"},
+            {"code": "GBLON", "name": "London", "parent_slug": "uk_sub"},
+        ]
+        test_rates = [
+            {"day": "2021-01-29", "price": 1000, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-30", "price": 2000, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-31", "price": 3000, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-02-01", "price": 4000, "orig_code": "CNSGH", "dest_code": "GBLON"},
+        ]
+
+        db_cursor = self.get_db_cursor()
+        self.create_db_entries(db_cursor, table_name="regions", data_dicts=test_regions)
+        self.create_db_entries(db_cursor, table_name="ports", data_dicts=test_ports)
+        self.create_db_entries(db_cursor, table_name="prices", data_dicts=test_rates)
+
+        params = dict(
+            start_date="2021-01-01",
+            end_date="2021-02-28",
+            origin="CNSGH",
+            destination="uk_sub",
+        )
+        weekly_rates = self.db.get_avg_rates(db_cursor, granularity="week", **params)
+        self.assertEqual(
+            [(day.isoformat(), avg) for day, avg in weekly_rates],
+            [("2021-01-25", 2000), ("2021-02-01", None)]
+        )
+
+        monthly_rates = self.db.fetch_avg_rates(granularity="month", **params)
+        self.assertEqual(
+            [(day.isoformat(), avg) for day, avg in monthly_rates],
+            [("2021-01-01", 2000), ("2021-02-01", None)]
+        )
+
+    def test_get_avg_rates_stats(self):
+        """
+        Test for fetching daily percentiles across all port pairs of a region,
+        estimated from the price sketches kept current by the triggers.
+        """
+        test_regions = [
+            {"slug": "china_east_main", "name": "China East Main", "parent_slug": None},
+            {"slug": "uk_sub", "name": "UK Sub", "parent_slug": None},
+        ]
+        test_ports = [
+            {"code": "CNSGH", "name": "Shanghai", "parent_slug": "china_east_main"},
+            {"code": "CNNBO", "name": "Ningbo", "parent_slug": "china_east_main"},
+            {"code": "GBLON", "name": "London", "parent_slug": "uk_sub"},
+        ]
+        test_rates = [
+            {"day": "2021-01-01", "price": price, "orig_code": orig_code, "dest_code": "GBLON"}
+            for orig_code, prices in [("CNSGH", [1000, 2000]), ("CNNBO", [3000, 4000, 5000])]
+            for price in prices
+        ]
+
+        db_cursor = self.get_db_cursor()
+        self.create_db_entries(db_cursor, table_name="regions", data_dicts=test_regions)
+        self.create_db_entries(db_cursor, table_name="ports", data_dicts=test_ports)
+        self.create_db_entries(db_cursor, table_name="prices", data_dicts=test_rates)
+
+        params = dict(
+            start_date="2021-01-01",
+            end_date="2021-01-01",
+            origin="china_east_main",
+            destination="uk_sub",
+            stats=("p10", "median"),
+        )
+        [(day, average_price, p10, median)] = self.db.get_avg_rates(db_cursor, **params)
+        self.assertEqual(float(average_price), 3000)
+        self.assertAlmostEqual(p10, 1000, delta=10)
+        self.assertAlmostEqual(median, 3000, delta=30)
+
+        db_cursor.execute("DELETE FROM prices WHERE orig_code = 'CNNBO'")
+        [(day, average_price, p10, median)] = self.db.get_avg_rates(db_cursor, **params)
+        self.assertIsNone(average_price)
+        self.assertIsNone(median)
+
+        db_cursor.execute("SELECT SUM(price_count) FROM daily_lane_price_buckets")
+        self.assertEqual(db_cursor.fetchone()[0], 2)
+
+    def test_prepared_avg_rates(self):
+        """
+        Test that the rates statement is prepared once per pooled connection
+        and prepared again after it has been deallocated, returning the same
+        rates as the plain query.
+        """
+        test_regions = [
+            {"slug": "china_east_main", "name": "China East Main", "parent_slug": None},
+            {"slug": "uk_sub", "name": "UK Sub", "parent_slug": None},
+        ]
+        test_ports = [
+            {"code": "CNSGH", "name": "Shanghai", "parent_slug": "china_east_main"},
+            {"code": "GBLON", "name": "London", "parent_slug": "uk_sub"},
+        ]
+        test_rates = [
+            {"day": "2021-01-%02d" % day, "price": 1000.0 * day, "orig_code": "CNSGH", "dest_code": "GBLON"}
+            for day in range(1, 4)
+            for _ in range(3)
+        ]
+
+        db_cursor = self.get_db_cursor()
+        self.create_db_entries(db_cursor, table_name="regions", data_dicts=test_regions)
+        self.create_db_entries(db_cursor, table_name="ports", data_dicts=test_ports)
+        self.create_db_entries(db_cursor, table_name="prices", data_dicts=test_rates)
+
+        db = DBAPI(
+            self.db_uri,
+            pool_max_size=1,
+            plan_cache_mode="force_generic_plan",
+        )
+        params = dict(
+            start_date="2021-01-01",
+            end_date="2021-01-03",
+            origin="CNSGH",
+            destination="uk_sub",
+        )
+        try:
+            first = db.fetch_avg_rates(**params)
+            second = db.fetch_avg_rates(**params)
+            with db.cursor() as pooled_cursor:
+                pooled_cursor.execute("SHOW plan_cache_mode")
+                plan_cache_mode = pooled_cursor.fetchone()[0]
+                pooled_cursor.execute("DEALLOCATE ALL")
+                pooled_cursor.connection.commit()
+            third = db.fetch_avg_rates(**params)
+            stats = db.statement_stats()
+        finally:
+            db.close()
+
+        self.assertEqual(plan_cache_mode, "force_generic_plan")
+        self.assertEqual(first, self.db.get_avg_rates(db_cursor, **params))
+        self.assertEqual(second, first)
+        self.assertEqual(third, first)
+        self.assertEqual(stats["prepares"], 1)
+        self.assertEqual(stats["reprepares"], 1)
+        self.assertEqual(stats["prepared_executions"], 3)
+
+    def test_region_closure_maintained(self):
+        """
+        Test that the region and port closure tables follow inserts and
+        reparenting of regions and ports.
+        """
+        test_regions = [
+            {"slug": "northern_europe", "name": "Northern Europe", "parent_slug": None},
+            {"slug": "baltic", "name": "Baltic", "parent_slug": "northern_europe"},
+            {"slug": "finland_main", "name": "Finland Main", "parent_slug": "baltic"},
+        ]
+        test_ports = [
+            {"code": "FIIMA", "name": "Imatra", "parent_slug": "baltic"},
+            {"code": "FIRAU", "name": "Rauma", "parent_slug": "finland_main"},
+        ]
+
+        db_cursor = self.get_db_cursor()
+        self.create_db_entries(db_cursor, table_name="regions", data_dicts=test_regions)
+        self.create_db_entries(db_cursor, table_name="ports", data_dicts=test_ports)
+
+        db_cursor.execute(
+            "SELECT descendant_slug, depth FROM region_ancestors "
+            "WHERE ancestor_slug = 'northern_europe' ORDER BY depth"
+        )
+        self.assertEqual(
+            db_cursor.fetchall(),
+            [("northern_europe", 0), ("baltic", 1), ("finland_main", 2)],
+        )
+        db_cursor.execute(
+            "SELECT ancestor_slug, depth FROM port_ancestors "
+            "WHERE port_code = 'FIRAU' ORDER BY depth"
+        )
+        self.assertEqual(
+            db_cursor.fetchall(),
+            [("finland_main", 1), ("baltic", 2), ("northern_europe", 3)],
+        )
+
+        db_cursor.execute(
+            "UPDATE regions SET parent_slug = NULL WHERE slug = 'finland_main'"
+        )
+        db_cursor.execute(
+            "UPDATE ports SET parent_slug = 'finland_main' WHERE code = 'FIIMA'"
+        )
+        db_cursor.execute(
+            "SELECT port_code FROM port_ancestors "
+            "WHERE ancestor_slug = 'northern_europe'"
+        )
+        self.assertEqual(db_cursor.fetchall(), [])
+        db_cursor.execute(
+            "SELECT port_code FROM port_ancestors "
+            "WHERE ancestor_slug = 'finland_main' ORDER BY 1"
+        )
+        self.assertEqual(db_cursor.fetchall(), [("FIIMA",), ("FIRAU",)])
+
+    def test_get_avg_rates_database_resolution(self):
+        """
+        Test that rates resolved through the closure tables match the rates
+        resolved through the in-memory hierarchy, with and without stats.
+        """
+        test_regions = [
+            {"slug": "northern_europe", "name": "Northern Europe", "parent_slug": None},
+            {"slug": "baltic", "name": "Baltic", "parent_slug": "northern_europe"},
+            {"slug": "finland_main", "name": "Finland Main", "parent_slug": "baltic"},
+            {"slug": "china_east_main", "name": "China East Main", "parent_slug": None},
+        ]
+        test_ports = [
+            {"code": "CNNBO", "name": "Ningbo", "parent_slug": "china_east_main"},
+            {"code": "FIIMA", "name": "Imatra", "parent_slug": "baltic"},
+            {"code": "FIRAU", "name": "Rauma", "parent_slug": "finland_main"},
+        ]
+        test_rates = [
+            {"day": "2021-01-%02d" % day, "price": 1000.0 * day + i, "orig_code": "CNNBO", "dest_code": dest_code}
+            for day in range(1, 4)
+            for i, dest_code in enumerate(["FIIMA", "FIRAU", "FIRAU"])
+        ]
+
+        db_cursor = self.get_db_cursor()
+        self.create_db_entries(db_cursor, table_name="regions", data_dicts=test_regions)
+        self.create_db_entries(db_cursor, table_name="ports", data_dicts=test_ports)
+        self.create_db_entries(db_cursor, table_name="prices", data_dicts=test_rates)
+
+        db = DBAPI(self.db_uri, region_resolution="database")
+        lanes = [
+            ("china_east_main", "northern_europe"),
+            ("CNNBO", "finland_main"),
+            ("CNNBO", "FIIMA"),
+            ("CNNBO", "unknown_region"),
+        ]
+        for origin, destination in lanes:
+            for stats in [(), ("median",)]:
+                params = dict(
+                    start_date="2021-01-01",
+                    end_date="2021-01-03",
+                    origin=origin,
+                    destination=destination,
+                    min_price_count=1,
+                    stats=stats,
+                )
+                self.assertEqual(
+                    db.get_avg_rates(db_cursor, **params),
+                    self.db.get_avg_rates(db_cursor, **params),
+                    (origin, destination, stats),
+                )
+        self.assertIsNone(db.hierarchy.index)
+
+    def test_get_lane_matrix(self):
+        """
+        Test fetching the average price of every lane between two regions in
+        one query, in total and per week, with either region resolution.
+        """
+        test_regions = [
+            {"slug": "china_east_main", "name": "China East Main", "parent_slug": None},
+            {"slug": "northern_europe", "name": "Northern Europe", "parent_slug": None},
+            {"slug": "baltic", "name": "Baltic", "parent_slug": "northern_europe"},
+        ]
+        test_ports = [
+            {"code": "CNNBO", "name": "Ningbo", "parent_slug": "china_east_main"},
+            {"code": "CNSGH", "name": "Shanghai", "parent_slug": "china_east_main"},
+            {"code": "FIIMA", "name": "Imatra", "parent_slug": "baltic"},
+            {"code": "NOOSL", "name": "Oslo", "parent_slug": "northern_europe"},
+        ]
+        test_rates = [
+            {"day": "2021-01-0%d" % day, "price": 1000.0 * day, "orig_code": orig_code, "dest_code": dest_code}
+            for day, orig_code, dest_code in [
+                (1, "CNNBO", "FIIMA"),
+                (1, "CNNBO", "FIIMA"),
+                (5, "CNNBO", "FIIMA"),
+                (2, "CNSGH", "NOOSL"),
+            ]
+        ]
+
+        db_cursor = self.get_db_cursor()
+        self.create_db_entries(db_cursor, table_name="regions", data_dicts=test_regions)
+        self.create_db_entries(db_cursor, table_name="ports", data_dicts=test_ports)
+        self.create_db_entries(db_cursor, table_name="prices", data_dicts=test_rates)
+
+        params = dict(
+            start_date="2021-01-01",
+            end_date="2021-01-10",
+            origin="china_east_main",
+            destination="northern_europe",
+            min_price_count=2,
+        )
+        matrix = self.db.get_lane_matrix(db_cursor, **params)
+        self.assertEqual(
+            [(orig, dest, round(float(avg), 3) if avg is not None else None) for orig, dest, avg in matrix],
+            [("CNNBO", "FIIMA", round(7000 / 3, 3)), ("CNSGH", "NOOSL", None)],
+        )
+        weekly = self.db.get_lane_matrix(db_cursor, granularity="week", **params)
+        self.assertEqual(
+            [(orig, dest, str(day), avg is not None) for orig, dest, day, avg in weekly],
+            [
+                ("CNNBO", "FIIMA", "2020-12-28", True),
+                ("CNNBO", "FIIMA", "2021-01-04", False),
+                ("CNSGH", "NOOSL", "2020-12-28", False),
+            ],
+        )
+
+        db = DBAPI(self.db_uri, region_resolution="database")
+        self.assertEqual(db.get_lane_matrix(db_cursor, **params), matrix)
+        self.assertEqual(
+            db.get_lane_matrix(db_cursor, granularity="week", **params), weekly
+        )
+
+    def test_statement_timeout_by_cost_class(self):
+        """
+        Test that rates queries run with the statement timeout of their
+        cost class.
+        """
+        test_regions = [
+            {"slug": "china_east_main", "name": "China East Main", "parent_slug": None},
+            {"slug": "uk_sub", "name": "UK Sub", "parent_slug": None},
+        ]
+        test_ports = [
+            {"code": "CNSGH", "name": "Shanghai", "parent_slug": "china_east_main"},
+            {"code": "GBLON", "name": "London", "parent_slug": "uk_sub"},
+        ]
+
+        db_cursor = self.get_db_cursor()
+        self.create_db_entries(db_cursor, table_name="regions", data_dicts=test_regions)
+        self.create_db_entries(db_cursor, table_name="ports", data_dicts=test_ports)
+
+        db = DBAPI(
+            self.db_uri,
+            statement_timeouts={"light": 1000, "medium": 2000, "heavy": 3000},
+        )
+        lanes = [
+            ("CNSGH", "GBLON", "2021-01-31", "1s"),
+            ("CNSGH", "uk_sub", "2021-01-31", "2s"),
+            ("CNSGH", "GBLON", "2021-12-31", "2s"),
+            ("china_east_main", "uk_sub", "2021-01-31", "3s"),
+        ]
+        for origin, destination, end_date, timeout in lanes:
+            db.get_avg_rates(db_cursor, "2021-01-01", end_date, origin, destination)
+            db_cursor.execute("SHOW statement_timeout")
+            self.assertEqual(db_cursor.fetchone()[0], timeout, (origin, destination))
+            self.db_conn.rollback()
+
+        db_cursor.execute("SHOW statement_timeout")
+        self.assertEqual(db_cursor.fetchone()[0], "0")
+
+    def test_statement_timeout_database_resolution(self):
+        """
+        Test that with database region resolution, lanes are classified by
+        looking their ends up in `ports`, without loading the hierarchy.
+        """
+        test_regions = [
+            {"slug": "china_east_main", "name": "China East Main", "parent_slug": None},
+            {"slug": "uk_sub", "name": "UK Sub", "parent_slug": None},
+        ]
+        test_ports = [
+            {"code": "CNSGH", "name": "Shanghai", "parent_slug": "china_east_main"},
+            {"code": "GBLON", "name": "London", "parent_slug": "uk_sub"},
+        ]
+
+        db_cursor = self.get_db_cursor()
+        self.create_db_entries(db_cursor, table_name="regions", data_dicts=test_regions)
+        self.create_db_entries(db_cursor, table_name="ports", data_dicts=test_ports)
+
+        db = DBAPI(
+            self.db_uri,
+            region_resolution="database",
+            statement_timeouts={"light": 1000, "medium": 2000, "heavy": 3000},
+        )
+        lanes = [
+            ("CNSGH", "GBLON", "1s"),
+            ("CNSGH", "uk_sub", "2s"),
+            ("china_east_main", "uk_sub", "3s"),
+        ]
+        for origin, destination, timeout in lanes:
+            db.get_avg_rates(db_cursor, "2021-01-01", "2021-01-31", origin, destination)
+            db_cursor.execute("SHOW statement_timeout")
+            self.assertEqual(db_cursor.fetchone()[0], timeout, (origin, destination))
+            self.db_conn.rollback()
+        self.assertIsNone(db.hierarchy.index)
+
+    def test_statement_timeout_after_reprepare(self):
+        """
+        Test that a statement prepared again after a pooler dropped it
+        still runs with the statement timeout of its cost class.
+        """
+        test_regions = [
+            {"slug": "china_east_main", "name": "China East Main", "parent_slug": None},
+            {"slug": "uk_sub", "name": "UK Sub", "parent_slug": None},
+        ]
+        test_ports = [
+            {"code": "CNSGH", "name": "Shanghai", "parent_slug": "china_east_main"},
+            {"code": "GBLON", "name": "London", "parent_slug": "uk_sub"},
+        ]
+
+        db_cursor = self.get_db_cursor()
+        self.create_db_entries(db_cursor, table_name="regions", data_dicts=test_regions)
+        self.create_db_entries(db_cursor, table_name="ports", data_dicts=test_ports)
+
+        db = DBAPI(
+            self.db_uri,
+            pool_max_size=1,
+            statement_timeouts={"light": 1000, "medium": 2000, "heavy": 3000},
+        )
+        params = dict(
+            start_date="2021-01-01",
+            end_date="2021-01-03",
+            origin="CNSGH",
+            destination="GBLON",
+        )
+        try:
+            db.fetch_avg_rates(**params)
+            with db.cursor() as pooled_cursor:
+                pooled_cursor.execute("DEALLOCATE ALL")
+                pooled_cursor.connection.commit()
+                db.get_avg_rates(pooled_cursor, **params)
+                pooled_cursor.execute("SHOW statement_timeout")
+                timeout = pooled_cursor.fetchone()[0]
+            stats = db.statement_stats()
+        finally:
+            db.close()
+
+        self.assertEqual(stats["reprepares"], 1)
+        self.assertEqual(timeout, "1s")
+
 
 if __name__ == "__main__":
     unittest.main()
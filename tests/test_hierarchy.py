@@ -0,0 +1,91 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import unittest
+
+from ratestask.hierarchy import RegionHierarchy
+
+
+TEST_REGIONS = [
+    ("northern_europe", None),
+    ("baltic", "northern_europe"),
+    ("finland_main", "baltic"),
+    ("poland_main", "baltic"),
+    ("china_east_main", None),
+]
+TEST_PORTS = [
+    ("CNNBO", "china_east_main"),
+    ("FIIMA", "baltic"),
+    ("FIRAU", "finland_main"),
+    ("PLGDY", "poland_main"),
+]
+
+
+class RegionHierarchyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.hierarchy = RegionHierarchy(ttl=None, miss_reload_interval=None)
+        self.hierarchy.load(TEST_REGIONS, TEST_PORTS)
+
+    def test_resolve_port_code(self):
+        """
+        Test that a port code resolves to itself only.
+        """
+        self.assertEqual(
+            self.hierarchy.resolve(None, "CNNBO"), frozenset(["CNNBO"])
+        )
+
+    def test_resolve_nested_region(self):
+        """
+        Test that a region resolves to its own ports and the ports of all
+        nested sub-regions.
+        """
+        self.assertEqual(
+            self.hierarchy.resolve(None, "northern_europe"),
+            frozenset(["FIIMA", "FIRAU", "PLGDY"]),
+        )
+        self.assertEqual(
+            self.hierarchy.resolve(None, "finland_main"),
+            frozenset(["FIRAU"]),
+        )
+
+    def test_resolve_unknown(self):
+        """
+        Test that unknown codes/slugs resolve to an empty set.
+        """
+        self.assertEqual(self.hierarchy.resolve(None, "unknown"), frozenset())
+
+    def test_resolve_reloaded_concurrently(self):
+        """
+        Test that an index dropped and reloaded by another thread between the
+        reads of `resolve` is reloaded rather than looked up.
+        """
+        hierarchy = RegionHierarchy(ttl=None, miss_reload_interval=None)
+        hierarchy.refresh = lambda db_cursor: hierarchy.load(
+            TEST_REGIONS, TEST_PORTS
+        )
+        is_expired = hierarchy.is_expired
+
+        def reload_then_check():
+            hierarchy.refresh(None)
+            return is_expired()
+
+        hierarchy.is_expired = reload_then_check
+        self.assertEqual(
+            hierarchy.resolve(None, "CNNBO"), frozenset(["CNNBO"])
+        )
+
+    def test_region_cycle(self):
+        """
+        Test that a cyclic region hierarchy doesn't loop forever.
+        """
+        index = RegionHierarchy.build_index(
+            [("a", "b"), ("b", "a")], [("AAAAA", "a"), ("BBBBB", "b")]
+        )
+        self.assertEqual(index["a"], frozenset(["AAAAA", "BBBBB"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,206 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import io
+import unittest
+from datetime import date
+
+from tests.test_base import TestBase
+from ratestask.ingest import (
+    IngestError,
+    ingest_file,
+    iter_csv_chunks,
+    iter_jsonl_chunks,
+)
+
+
+class ChunkReaderTest(unittest.TestCase):
+
+    def test_csv_chunks(self):
+        """
+        Test that CSV rows are reordered to the prices columns and split into
+        chunks of at most chunk_size rows.
+        """
+        fileobj = io.StringIO(
+            "day,price,orig_code,dest_code\n"
+            "2021-01-01,100,CNSGH,GBLON\n"
+            "2021-01-02,200,CNSGH,GBLON\n"
+            "\n"
+            "2021-01-03,300,CNNBO,GBMNC\n"
+        )
+        chunks = list(iter_csv_chunks(fileobj, chunk_size=2))
+        self.assertEqual(
+            chunks,
+            [
+                [
+                    ("CNSGH", "GBLON", "2021-01-01", "100"),
+                    ("CNSGH", "GBLON", "2021-01-02", "200"),
+                ],
+                [("CNNBO", "GBMNC", "2021-01-03", "300")],
+            ]
+        )
+
+    def test_csv_missing_columns(self):
+        fileobj = io.StringIO("orig_code,dest_code,day\nCNSGH,GBLON,2021-01-01\n")
+        with self.assertRaises(IngestError):
+            list(iter_csv_chunks(fileobj))
+
+    def test_csv_short_row(self):
+        """
+        Test that a row with fewer values than the header is reported with
+        its line number.
+        """
+        fileobj = io.StringIO(
+            "orig_code,dest_code,day,price\n"
+            "CNSGH,GBLON,2021-01-01,100\n"
+            "CNSGH,GBLON\n"
+        )
+        with self.assertRaisesRegex(IngestError, "line 3"):
+            list(iter_csv_chunks(fileobj))
+
+    def test_jsonl_chunks(self):
+        fileobj = io.StringIO(
+            '{"orig_code": "CNSGH", "dest_code": "GBLON", "day": "2021-01-01", "price": 100}\n'
+            '\n'
+            '{"orig_code": "CNNBO", "dest_code": "GBMNC", "day": "2021-01-02", "price": 200}\n'
+        )
+        chunks = list(iter_jsonl_chunks(fileobj, chunk_size=10))
+        self.assertEqual(
+            chunks,
+            [[
+                ("CNSGH", "GBLON", "2021-01-01", 100),
+                ("CNNBO", "GBMNC", "2021-01-02", 200),
+            ]]
+        )
+
+    def test_jsonl_invalid_line(self):
+        fileobj = io.StringIO('{"orig_code": "CNSGH"}\n')
+        with self.assertRaises(IngestError):
+            list(iter_jsonl_chunks(fileobj))
+
+
+class IngestTest(TestBase):
+
+    def setUp(self):
+        super().setUp()
+        test_regions = [
+            {"slug": "china_east_main", "name": "China East Main", "parent_slug": None},
+            {"slug": "uk_sub", "name": "UK Sub", "parent_slug": None},
+        ]
+        test_ports = [
+            {"code": "CNSGH", "name": "Shanghai", "parent_slug": "china_east_main"},
+            {"code": "GBLON", "name": "London", "parent_slug": "uk_sub"},
+        ]
+        db_cursor = self.get_db_cursor()
+        self.create_db_entries(db_cursor, table_name="regions", data_dicts=test_regions)
+        self.create_db_entries(db_cursor, table_name="ports", data_dicts=test_ports)
+
+    def _prices(self):
+        db_cursor = self.get_db_cursor()
+        db_cursor.execute(
+            "SELECT orig_code, dest_code, day, price FROM prices "
+            "ORDER BY day, price"
+        )
+        rows = db_cursor.fetchall()
+        self.db_conn.commit()
+        return rows
+
+    def test_ingest_csv(self):
+        """
+        Test that CSV rows are loaded into prices across several chunks, and
+        the daily lane rollup is maintained.
+        """
+        fileobj = io.StringIO(
+            "orig_code,dest_code,day,price\n"
+            "CNSGH,GBLON,2021-01-01,100\n"
+            "CNSGH,GBLON,2021-01-01,200\n"
+            "CNSGH,GBLON,2021-01-02,300\n"
+        )
+        result = ingest_file(self.db_conn, fileobj, chunk_size=2)
+
+        self.assertEqual(result.rows_read, 3)
+        self.assertEqual(result.rows_loaded, 3)
+        self.assertEqual(result.invalid_codes, [])
+        self.assertEqual(
+            self._prices(),
+            [
+                ("CNSGH", "GBLON", date(2021, 1, 1), 100),
+                ("CNSGH", "GBLON", date(2021, 1, 1), 200),
+                ("CNSGH", "GBLON", date(2021, 1, 2), 300),
+            ]
+        )
+
+        db_cursor = self.get_db_cursor()
+        db_cursor.execute(
+            "SELECT day, price_count FROM daily_lane_stats ORDER BY day"
+        )
+        self.assertEqual(
+            db_cursor.fetchall(), [(date(2021, 1, 1), 2), (date(2021, 1, 2), 1)]
+        )
+
+    def test_ingest_unknown_port_aborts(self):
+        """
+        Test that rows with unknown port codes abort the whole load.
+        """
+        fileobj = io.StringIO(
+            '{"orig_code": "CNSGH", "dest_code": "GBLON", "day": "2021-01-01", "price": 100}\n'
+            '{"orig_code": "XXXXX", "dest_code": "GBLON", "day": "2021-01-01", "price": 200}\n'
+        )
+        with self.assertRaises(IngestError):
+            ingest_file(self.db_conn, fileobj, fmt="jsonl")
+
+        self.assertEqual(self._prices(), [])
+
+    def test_ingest_unknown_port_skipped(self):
+        """
+        Test that rows with unknown port codes are left out with skip_invalid.
+        """
+        fileobj = io.StringIO(
+            '{"orig_code": "CNSGH", "dest_code": "GBLON", "day": "2021-01-01", "price": 100}\n'
+            '{"orig_code": "XXXXX", "dest_code": "GBLON", "day": "2021-01-01", "price": 200}\n'
+        )
+        result = ingest_file(self.db_conn, fileobj, fmt="jsonl", skip_invalid=True)
+
+        self.assertEqual(result.rows_read, 2)
+        self.assertEqual(result.rows_loaded, 1)
+        self.assertEqual(result.rows_rejected, 1)
+        self.assertEqual(result.invalid_codes, ["XXXXX"])
+        self.assertEqual(
+            self._prices(), [("CNSGH", "GBLON", date(2021, 1, 1), 100)]
+        )
+
+    def test_ingest_invalid_value_aborts(self):
+        """
+        Test that values Postgres rejects abort the whole load with an
+        IngestError.
+        """
+        fileobj = io.StringIO(
+            "orig_code,dest_code,day,price\n"
+            "CNSGH,GBLON,2021-01-01,100\n"
+            "CNSGH,GBLON,2021-13-01,200\n"
+        )
+        with self.assertRaises(IngestError):
+            ingest_file(self.db_conn, fileobj)
+
+        self.assertEqual(self._prices(), [])
+
+    def test_ingest_empty_price_aborts(self):
+        """
+        Test that an empty price, a NULL Postgres rejects, aborts the whole
+        load with an IngestError.
+        """
+        fileobj = io.StringIO(
+            "orig_code,dest_code,day,price\n"
+            "CNSGH,GBLON,2021-01-01,100\n"
+            "CNSGH,GBLON,2021-01-02,\n"
+        )
+        with self.assertRaises(IngestError):
+            ingest_file(self.db_conn, fileobj)
+
+        self.assertEqual(self._prices(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
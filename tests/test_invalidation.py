@@ -0,0 +1,164 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import time
+import unittest
+from datetime import date
+
+from tests.test_base import TestBase
+from ratestask.app import create_app
+from ratestask.invalidation import (
+    ANY_CHANGE,
+    Change,
+    LaneChange,
+    affects,
+    invalidate_app,
+    parse_change,
+)
+
+
+class ChangeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = {
+            "china_east_main": frozenset({"CNNBO", "CNSGH"}),
+            "uk_sub": frozenset({"GBLON"}),
+            "CNNBO": frozenset({"CNNBO"}),
+            "CNSGH": frozenset({"CNSGH"}),
+            "GBLON": frozenset({"GBLON"}),
+        }
+        self.kwargs = {
+            "origin": "china_east_main",
+            "destination": "uk_sub",
+            "date_from": date(2021, 1, 1),
+            "date_to": date(2021, 1, 31),
+        }
+
+    def test_parse_change(self):
+        payload = json.dumps({
+            "table": "prices",
+            "lanes": [{"orig": "CNSGH", "dest": "GBLON", "from": "2021-01-05", "to": "2021-02-03"}],
+        })
+        self.assertEqual(
+            parse_change(payload),
+            Change("prices", [LaneChange("CNSGH", "GBLON", date(2021, 1, 5), date(2021, 2, 3))]),
+        )
+        self.assertEqual(parse_change('{"table": "ports"}'), Change("ports", None))
+
+    def test_affects(self):
+        """
+        Test that only changes of lanes covered by the origin and
+        destination, within the date range, affect a result.
+        """
+        def change(orig_code, dest_code, start_date, end_date):
+            return Change("prices", [LaneChange(orig_code, dest_code, start_date, end_date)])
+
+        self.assertTrue(affects(
+            change("CNNBO", "GBLON", date(2021, 1, 31), date(2021, 3, 1)), self.kwargs, self.index
+        ))
+        self.assertFalse(affects(
+            change("CNNBO", "GBLON", date(2021, 2, 1), date(2021, 3, 1)), self.kwargs, self.index
+        ))
+        self.assertFalse(affects(
+            change("GBLON", "CNNBO", date(2021, 1, 1), date(2021, 1, 1)), self.kwargs, self.index
+        ))
+        self.assertTrue(affects(ANY_CHANGE, self.kwargs, self.index))
+        self.assertTrue(affects(
+            change("GBLON", "CNNBO", date(2021, 1, 1), date(2021, 1, 1)), self.kwargs, None
+        ))
+
+    def test_invalidate_app(self):
+        """
+        Test that only affected cached responses are evicted, and that
+        changes of ports drop the hierarchy and every cached response.
+        """
+        app = create_app({"DATABASE_URI": None, "TESTING": True})
+        app.db.hierarchy.load(
+            [("china_east_main", None), ("uk_sub", None)],
+            [("CNNBO", "china_east_main"), ("CNSGH", "china_east_main"), ("GBLON", "uk_sub")],
+        )
+        region_key = ("get_rates", tuple(sorted(self.kwargs.items())))
+        port_key = ("get_rates", tuple(sorted(dict(self.kwargs, origin="CNSGH").items())))
+        app.rates_cache.set(region_key, "region")
+        app.rates_cache.set(port_key, "port")
+
+        invalidate_app(app, Change("prices", [
+            LaneChange("CNNBO", "GBLON", date(2021, 1, 1), date(2021, 1, 1)),
+        ]))
+        self.assertIsNone(app.rates_cache.get(region_key))
+        self.assertEqual(app.rates_cache.get(port_key), "port")
+        self.assertIsNotNone(app.db.hierarchy.index)
+
+        invalidate_app(app, Change("ports", None))
+        self.assertIsNone(app.rates_cache.get(port_key))
+        self.assertIsNone(app.db.hierarchy.index)
+
+
+class ChangeListenerTest(TestBase):
+
+    def test_cached_rates_invalidated(self):
+        """
+        Test that committed price changes evict the cached rates of their
+        lane, and leave the others cached.
+        """
+        test_regions = [
+            {"slug": "china_east_main", "name": "China East Main", "parent_slug": None},
+            {"slug": "uk_sub", "name": "UK Sub", "parent_slug": None},
+        ]
+        test_ports = [
+            {"code": "CNSGH", "name": "Shanghai", "parent_slug": "china_east_main"},
+            {"code": "CNNBO", "name": "Ningbo", "parent_slug": "china_east_main"},
+            {"code": "GBLON", "name": "London", "parent_slug": "uk_sub"},
+        ]
+        test_rates = [
+            {"day": "2021-01-01", "price": 1000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-01", "price": 2000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-01", "price": 3000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+        ]
+
+        db_cursor = self.get_db_cursor()
+        self.create_db_entries(db_cursor, table_name="regions", data_dicts=test_regions)
+        self.create_db_entries(db_cursor, table_name="ports", data_dicts=test_ports)
+        self.create_db_entries(db_cursor, table_name="prices", data_dicts=test_rates)
+
+        app = create_app({
+            "DATABASE_URI": self.db_uri,
+            "TESTING": True,
+            "CACHE_INVALIDATION": True,
+        })
+        try:
+            self.assertTrue(app.change_listener.wait_connected(5))
+            client = app.test_client()
+            url = "/rates?date_from=2021-01-01&date_to=2021-01-02&origin={}&destination=GBLON"
+            self.assertEqual(
+                json.loads(client.get(url.format("CNSGH")).data)[0]["average_price"], 2000.0
+            )
+            self.assertEqual(json.loads(client.get(url.format("CNNBO")).data), [])
+
+            self.create_db_entries(db_cursor, table_name="prices", data_dicts=[
+                {"day": "2021-01-01", "price": 6000.0, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            ])
+            deadline = time.monotonic() + 5
+            while (
+                app.rates_cache.stats()["invalidations"] < 1 and
+                time.monotonic() < deadline
+            ):
+                time.sleep(0.01)
+
+            self.assertEqual(
+                json.loads(client.get(url.format("CNSGH")).data)[0]["average_price"], 3000.0
+            )
+            client.get(url.format("CNNBO"))
+            stats = app.rates_cache.stats()
+            self.assertEqual(stats["invalidations"], 1)
+            self.assertEqual(stats["hits"], 1)
+        finally:
+            app.change_listener.stop()
+            app.db.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
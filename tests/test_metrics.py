@@ -0,0 +1,124 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import unittest
+from types import SimpleNamespace
+
+from flask import Flask, jsonify
+
+from ratestask.hierarchy import RegionHierarchy
+from ratestask.metrics import (
+    Histogram,
+    RequestMetrics,
+    labelled_by_lane,
+    phase,
+    server_timing,
+)
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_render(self):
+        """
+        Test that observations are rendered as cumulative buckets with sum
+        and count, per label set.
+        """
+        histogram = Histogram("latency_seconds", "Latency.", ("lane_type",), buckets=(0.1, 1.0))
+        histogram.observe(0.05, lane_type="port_port")
+        histogram.observe(0.5, lane_type="port_port")
+        histogram.observe(2.0, lane_type="port_port")
+        histogram.observe(0.1, lane_type="region_region")
+
+        lines = histogram.render()
+        self.assertEqual(lines[:2], [
+            "# HELP latency_seconds Latency.",
+            "# TYPE latency_seconds histogram",
+        ])
+        self.assertIn('latency_seconds_bucket{lane_type="port_port",le="0.1"} 1', lines)
+        self.assertIn('latency_seconds_bucket{lane_type="port_port",le="1.0"} 2', lines)
+        self.assertIn('latency_seconds_bucket{lane_type="port_port",le="+Inf"} 3', lines)
+        self.assertIn('latency_seconds_sum{lane_type="port_port"} 2.55', lines)
+        self.assertIn('latency_seconds_count{lane_type="port_port"} 3', lines)
+        self.assertIn('latency_seconds_bucket{lane_type="region_region",le="0.1"} 1', lines)
+
+    def test_server_timing(self):
+        self.assertEqual(
+            server_timing({"validate": 0.0001, "query": 0.0125}, 0.02),
+            "validate;dur=0.100, query;dur=12.500, total;dur=20.000"
+        )
+
+
+class RequestMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        hierarchy = RegionHierarchy()
+        hierarchy.load([("uk_sub", None)], [("GBLON", "uk_sub")])
+        self.app.db = SimpleNamespace(hierarchy=hierarchy)
+        RequestMetrics().init_app(self.app)
+
+        @self.app.route("/lanes/<origin>/<destination>")
+        @labelled_by_lane
+        def lane(origin, destination):
+            with phase("query"):
+                pass
+            with phase("query"):
+                pass
+            with phase("serialize"):
+                return jsonify(origin=origin, destination=destination)
+
+    def test_server_timing_header(self):
+        """
+        Test that responses carry the phase timings in a Server-Timing header.
+        """
+        with self.app.test_client() as client:
+            resp = client.get("/lanes/GBLON/uk_sub")
+
+        phases = [
+            entry.split(";")[0]
+            for entry in resp.headers["Server-Timing"].split(", ")
+        ]
+        self.assertEqual(phases, ["query", "serialize", "total"])
+
+    def test_histograms_labelled_by_lane_type(self):
+        with self.app.test_client() as client:
+            client.get("/lanes/GBLON/uk_sub")
+            client.get("/lanes/uk_sub/uk_sub")
+
+        metrics = self.app.metrics.render({"db_pool": {"in_use": 1, "loaded_at": None}})
+        self.assertIn(
+            'ratestask_request_duration_seconds_count{endpoint="lane",lane_type="port_region"} 1',
+            metrics
+        )
+        self.assertIn(
+            'ratestask_request_phase_duration_seconds_count{endpoint="lane",lane_type="region_region",phase="query"} 1',
+            metrics
+        )
+        self.assertIn("ratestask_db_pool_in_use 1\n", metrics)
+        self.assertNotIn("loaded_at", metrics)
+
+    def test_stats_types(self):
+        """
+        Test that monotonic counts are typed as counters and booleans are
+        rendered as 1/0.
+        """
+        metrics = self.app.metrics.render({
+            "cache": {"hits": 3, "entries": 2},
+            "listener": {"connected": True, "notifications": 1},
+            "db_replicas": {"replica": {"ejected": False}},
+        })
+        self.assertIn("# TYPE ratestask_cache_hits counter\nratestask_cache_hits 3\n", metrics)
+        self.assertIn("# TYPE ratestask_cache_entries gauge\n", metrics)
+        self.assertIn("# TYPE ratestask_listener_notifications counter\n", metrics)
+        self.assertIn("ratestask_listener_connected 1\n", metrics)
+        self.assertIn("ratestask_db_replicas_replica_ejected 0\n", metrics)
+
+    def test_phase_outside_request(self):
+        with phase("query"):
+            pass
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import time
+import unittest
+
+import psycopg2
+
+from tests.test_base import TestBase
+from ratestask.migrate import (
+    Migrator,
+    connect,
+    is_transactional,
+    load_migrations,
+    split_statements,
+)
+
+
+class MigrationScriptTest(unittest.TestCase):
+
+    def test_migrations_complete(self):
+        """
+        Test that every shipped migration has both an up and a down script
+        and that versions are unique.
+        """
+        migrations = load_migrations()
+        self.assertTrue(migrations)
+
+        versions = [migration.version for migration in migrations]
+        self.assertEqual(len(versions), len(set(versions)))
+        for migration in migrations:
+            self.assertIsNotNone(migration.up_path, str(migration))
+            self.assertIsNotNone(migration.down_path, str(migration))
+
+    def test_split_statements(self):
+        """
+        Test that non-transactional scripts are split into statements,
+        ignoring comments.
+        """
+        sql = (
+            "-- migrate: no-transaction\n"
+            "-- Comment; with a semicolon\n"
+            "DROP INDEX CONCURRENTLY IF EXISTS a_idx;\n"
+            "CREATE INDEX CONCURRENTLY a_idx\n"
+            "    ON a (b);\n"
+        )
+        self.assertFalse(is_transactional(sql))
+        self.assertEqual(
+            split_statements(sql),
+            [
+                "DROP INDEX CONCURRENTLY IF EXISTS a_idx",
+                "CREATE INDEX CONCURRENTLY a_idx\n    ON a (b)",
+            ],
+        )
+
+
+    def test_connect_wait(self):
+        """
+        Test that connecting is retried until the wait is over.
+        """
+        started = time.monotonic()
+        with self.assertRaises(psycopg2.OperationalError):
+            connect(
+                "postgresql://postgres@127.0.0.1:1/none",
+                wait=0.3,
+                interval=0.1,
+            )
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+
+
+class MigratorTest(TestBase):
+
+    def _index_names(self):
+        db_cursor = self.get_db_cursor()
+        db_cursor.execute(
+            "SELECT indexname FROM pg_indexes WHERE schemaname = 'public'"
+        )
+        index_names = set(name for name, in db_cursor.fetchall())
+        self.db_conn.commit()
+        return index_names
+
+    def test_upgrade_and_downgrade(self):
+        """
+        Test that migrations (applied by the test setup) are tracked, and that
+        they can be rolled back and re-applied.
+        """
+        migrator = Migrator(self.db.get_db_conn())
+        try:
+            self.assertTrue(all(applied for _, applied in migrator.status()))
+            self.assertIn("prices_orig_code_dest_code_day_idx", self._index_names())
+
+            rolled_back = migrator.downgrade(0)
+            self.assertEqual(
+                [migration.version for migration in rolled_back],
+                sorted(
+                    (migration.version for migration in migrator.migrations),
+                    reverse=True
+                ),
+            )
+            self.assertFalse(any(applied for _, applied in migrator.status()))
+            self.assertNotIn(
+                "prices_orig_code_dest_code_day_idx", self._index_names()
+            )
+
+            applied = migrator.upgrade()
+            self.assertEqual(len(applied), len(migrator.migrations))
+            self.assertIn("prices_orig_code_dest_code_day_idx", self._index_names())
+            self.assertEqual(migrator.upgrade(), [])
+        finally:
+            migrator.db_conn.close()
+
+    def test_downgrade_single_step(self):
+        """
+        Test that a downgrade without target only rolls back the latest
+        migration.
+        """
+        migrator = Migrator(self.db.get_db_conn())
+        try:
+            latest = migrator.migrations[-1]
+            self.assertEqual(
+                [migration.version for migration in migrator.downgrade()],
+                [latest.version],
+            )
+            self.assertEqual(
+                [migration.version for migration in migrator.upgrade()],
+                [latest.version],
+            )
+        finally:
+            migrator.db_conn.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
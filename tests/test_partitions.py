@@ -0,0 +1,199 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import unittest
+from datetime import date
+
+from tests.test_base import TestBase
+from ratestask.migrate import Migrator, load_migrations
+from ratestask.partitions import (
+    PartitionError,
+    convert,
+    detach,
+    explain_avg_rates,
+    list_partitions,
+    months_between,
+    next_month,
+    parse_partition_name,
+    partition_name,
+    premake,
+)
+
+
+class PartitionNamesTest(unittest.TestCase):
+
+    def test_months(self):
+        self.assertEqual(next_month(date(2021, 12, 1)), date(2022, 1, 1))
+        self.assertEqual(
+            months_between(date(2021, 11, 15), date(2022, 1, 1)),
+            [date(2021, 11, 1), date(2021, 12, 1), date(2022, 1, 1)]
+        )
+
+    def test_partition_names(self):
+        name = partition_name("daily_lane_stats", date(2021, 3, 1))
+        self.assertEqual(name, "daily_lane_stats_y2021m03")
+        self.assertEqual(
+            parse_partition_name(name), ("daily_lane_stats", date(2021, 3, 1))
+        )
+        self.assertIsNone(parse_partition_name("daily_lane_stats_default"))
+
+
+class PartitionsTest(TestBase):
+
+    def setUp(self):
+        super().setUp()
+        test_regions = [
+            {"slug": "china_east_main", "name": "China East Main", "parent_slug": None},
+            {"slug": "uk_sub", "name": "UK Sub", "parent_slug": None},
+        ]
+        test_ports = [
+            {"code": "CNSGH", "name": "Shanghai", "parent_slug": "china_east_main"},
+            {"code": "GBLON", "name": "London", "parent_slug": "uk_sub"},
+        ]
+        test_rates = [
+            {"day": "2021-01-15", "price": 1000, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-02-15", "price": 2000, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-03-15", "price": 3000, "orig_code": "CNSGH", "dest_code": "GBLON"},
+        ]
+        db_cursor = self.get_db_cursor()
+        self.create_db_entries(db_cursor, table_name="regions", data_dicts=test_regions)
+        self.create_db_entries(db_cursor, table_name="ports", data_dicts=test_ports)
+        self.create_db_entries(db_cursor, table_name="prices", data_dicts=test_rates)
+
+        for table in ("prices", "daily_lane_stats"):
+            convert(self.db_conn, table, premake_months=1, today=date(2021, 3, 1))
+
+    def tearDown(self):
+        db_cursor = self.get_db_cursor()
+        db_cursor.execute("DROP SCHEMA IF EXISTS archive CASCADE")
+        self.db_conn.commit()
+        super().tearDown()
+
+    def test_convert(self):
+        """
+        Test that converted tables keep their rows in monthly partitions, and
+        the rollup triggers keep working on the partitioned prices table.
+        """
+        db_cursor = self.get_db_cursor()
+        names = [name for name, _, _ in list_partitions(db_cursor, "prices")]
+        self.assertEqual(
+            names,
+            [
+                "prices_default",
+                "prices_y2021m01",
+                "prices_y2021m02",
+                "prices_y2021m03",
+                "prices_y2021m04",
+            ]
+        )
+        db_cursor.execute("SELECT COUNT(*) FROM prices_y2021m02")
+        self.assertEqual(db_cursor.fetchone()[0], 1)
+
+        db_cursor.execute(
+            "INSERT INTO prices (orig_code, dest_code, day, price) "
+            "VALUES ('CNSGH', 'GBLON', '2021-02-15', 4000)"
+        )
+        db_cursor.execute(
+            "SELECT price_sum, price_count FROM daily_lane_stats_y2021m02"
+        )
+        self.assertEqual(db_cursor.fetchall(), [(6000, 2)])
+        self.db_conn.commit()
+
+        with self.assertRaises(PartitionError):
+            convert(self.db_conn, "prices")
+
+    def test_partition_pruning(self):
+        """
+        Test that the rates query only scans the partitions of the months
+        within the requested date range.
+        """
+        db_cursor = self.get_db_cursor()
+        scanned = explain_avg_rates(
+            db_cursor, date(2021, 2, 1), date(2021, 2, 28), "CNSGH", "uk_sub"
+        )
+        self.assertEqual(scanned, {"daily_lane_stats_y2021m02"})
+
+    def test_premake_and_detach(self):
+        """
+        Test that future partitions are created, and old partitions are
+        detached into the archive schema while their rollup is kept.
+        """
+        names = premake(self.db_conn, "prices", months=2, today=date(2021, 4, 10))
+        self.assertEqual(
+            names, ["prices_y2021m04", "prices_y2021m05", "prices_y2021m06"]
+        )
+
+        detached = detach(
+            self.db_conn, "prices", date(2021, 3, 1), archive_schema="archive"
+        )
+        self.assertEqual(detached, ["prices_y2021m01", "prices_y2021m02"])
+
+        db_cursor = self.get_db_cursor()
+        db_cursor.execute("SELECT COUNT(*) FROM prices")
+        self.assertEqual(db_cursor.fetchone()[0], 1)
+        db_cursor.execute("SELECT COUNT(*) FROM archive.prices_y2021m01")
+        self.assertEqual(db_cursor.fetchone()[0], 1)
+        db_cursor.execute("SELECT COUNT(*) FROM daily_lane_stats")
+        self.assertEqual(db_cursor.fetchone()[0], 3)
+
+    def test_premake_moves_default_rows(self):
+        """
+        Test that partitions are premade for months with rows in the default
+        partition, which are moved into them without changing the rollup.
+        """
+        db_cursor = self.get_db_cursor()
+        db_cursor.execute(
+            "INSERT INTO prices (orig_code, dest_code, day, price) "
+            "VALUES ('CNSGH', 'GBLON', '2021-06-10', 5000)"
+        )
+        self.db_conn.commit()
+
+        for table in ("prices", "daily_lane_stats"):
+            names = premake(self.db_conn, table, months=2, today=date(2021, 5, 1))
+            self.assertIn(partition_name(table, date(2021, 6, 1)), names)
+
+        db_cursor.execute("SELECT COUNT(*) FROM prices_default")
+        self.assertEqual(db_cursor.fetchone()[0], 0)
+        db_cursor.execute("SELECT day, price FROM prices_y2021m06")
+        self.assertEqual(db_cursor.fetchall(), [(date(2021, 6, 10), 5000)])
+        db_cursor.execute("SELECT COUNT(*) FROM daily_lane_stats_default")
+        self.assertEqual(db_cursor.fetchone()[0], 0)
+        db_cursor.execute(
+            "SELECT day, price_sum, price_count FROM daily_lane_stats_y2021m06"
+        )
+        self.assertEqual(db_cursor.fetchall(), [(date(2021, 6, 10), 5000, 1)])
+
+    def test_index_migration(self):
+        """
+        Test that the concurrent index migration of prices can be rolled
+        back and re-applied once prices is partitioned.
+        """
+        migrator = Migrator(
+            self.db.get_db_conn(),
+            [migration for migration in load_migrations() if migration.version == 1],
+        )
+        try:
+            self.assertEqual(len(migrator.downgrade()), 1)
+            self.assertEqual(len(migrator.upgrade()), 1)
+        finally:
+            migrator.db_conn.close()
+
+        db_cursor = self.get_db_cursor()
+        db_cursor.execute(
+            "SELECT indisvalid FROM pg_index "
+            "WHERE indexrelid = 'prices_orig_code_dest_code_day_idx'::regclass"
+        )
+        self.assertTrue(db_cursor.fetchone()[0])
+        db_cursor.execute(
+            "SELECT COUNT(*) FROM pg_inherits "
+            "WHERE inhparent = 'prices_orig_code_dest_code_day_idx'::regclass"
+        )
+        self.assertEqual(
+            db_cursor.fetchone()[0], len(list_partitions(db_cursor, "prices"))
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
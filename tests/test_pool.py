@@ -0,0 +1,130 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import unittest
+
+from ratestask.pool import ConnectionPool, PoolTimeout
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db_uri = os.getenv("DATABASE_URI")
+
+    def test_connection_reused(self):
+        """
+        Test that a released connection is handed out again instead of
+        opening a new one.
+        """
+        pool = ConnectionPool(self.db_uri, min_size=1, max_size=2)
+        try:
+            conn_1 = pool.getconn()
+            pool.putconn(conn_1)
+            conn_2 = pool.getconn()
+            pool.putconn(conn_2)
+
+            self.assertIs(conn_1, conn_2)
+
+            stats = pool.stats()
+            self.assertEqual(stats["opened"], 1)
+            self.assertEqual(stats["acquired"], 2)
+            self.assertEqual(stats["in_use"], 0)
+            self.assertEqual(stats["idle"], 1)
+        finally:
+            pool.closeall()
+
+    def test_acquire_timeout(self):
+        """
+        Test that acquiring from an exhausted pool fails after the configured
+        timeout and is accounted as a wait.
+        """
+        pool = ConnectionPool(self.db_uri, min_size=0, max_size=1, timeout=0.1)
+        try:
+            conn = pool.getconn()
+            with self.assertRaises(PoolTimeout):
+                pool.getconn()
+            pool.putconn(conn)
+
+            stats = pool.stats()
+            self.assertEqual(stats["timeouts"], 1)
+            self.assertEqual(stats["size"], 1)
+        finally:
+            pool.closeall()
+
+    def test_open_transaction_rolled_back(self):
+        """
+        Test that a connection is returned to the pool without an open
+        transaction.
+        """
+        pool = ConnectionPool(self.db_uri, min_size=1, max_size=1)
+        try:
+            conn = pool.getconn()
+            conn.cursor().execute("SELECT 1")
+            pool.putconn(conn)
+
+            conn = pool.getconn()
+            self.assertEqual(conn.info.transaction_status, 0)
+            pool.putconn(conn)
+        finally:
+            pool.closeall()
+
+    def test_expired_connection_recycled(self):
+        """
+        Test that connections older than max_age are replaced.
+        """
+        pool = ConnectionPool(self.db_uri, min_size=1, max_size=1, max_age=0)
+        try:
+            conn_1 = pool.getconn()
+            pool.putconn(conn_1)
+            conn_2 = pool.getconn()
+            pool.putconn(conn_2)
+
+            self.assertIsNot(conn_1, conn_2)
+            self.assertTrue(conn_1.closed)
+        finally:
+            pool.closeall()
+
+    def test_broken_idle_connection_replaced(self):
+        """
+        Test that an idle connection failing validation is replaced.
+        """
+        pool = ConnectionPool(
+            self.db_uri, min_size=1, max_size=1, validate_after=0
+        )
+        try:
+            conn_1 = pool.getconn()
+            pool.putconn(conn_1)
+            conn_1.close()
+
+            conn_2 = pool.getconn()
+            self.assertIsNot(conn_1, conn_2)
+            self.assertFalse(conn_2.closed)
+            pool.putconn(conn_2)
+        finally:
+            pool.closeall()
+
+    def test_reset_forgets_connections(self):
+        """
+        Test that a reset pool (as in a forked worker) opens new connections
+        and leaves the previous ones open.
+        """
+        pool = ConnectionPool(self.db_uri, min_size=1, max_size=1)
+        conn_1 = pool.getconn()
+        pool.putconn(conn_1)
+        try:
+            pool.reset()
+            self.assertEqual(pool.stats()["size"], 0)
+
+            conn_2 = pool.getconn()
+            pool.putconn(conn_2)
+            self.assertIsNot(conn_1, conn_2)
+            self.assertFalse(conn_1.closed)
+        finally:
+            conn_1.close()
+            pool.closeall()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import time
+import unittest
+
+import psycopg2
+
+from tests.test_base import TestBase
+from ratestask.db import DBAPI
+from ratestask.pool import PoolTimeout
+from ratestask.replicas import ReplicaRouter
+
+
+class StubPool(object):
+    """
+    Stands in for a ConnectionPool, handing out names instead of connections.
+    """
+
+    def __init__(self, name, fail=False, busy=False):
+        self.name = name
+        self.fail = fail
+        self.busy = busy
+        self.in_use = 0
+        self.timeouts = []
+
+    def getconn(self, timeout=None):
+        self.timeouts.append(timeout)
+        if self.fail:
+            raise psycopg2.OperationalError("{} is down".format(self.name))
+        if self.busy:
+            raise PoolTimeout("{} is busy".format(self.name))
+        self.in_use += 1
+        return self.name
+
+    def putconn(self, conn, discard=False):
+        self.in_use -= 1
+
+    def stats(self):
+        return {"in_use": self.in_use}
+
+
+class ReplicaRouterTest(unittest.TestCase):
+
+    def test_round_robin(self):
+        router = ReplicaRouter(
+            StubPool("primary"), [StubPool("a"), StubPool("b")]
+        )
+        names = []
+        for _ in range(4):
+            node, conn = router.getconn()
+            router.putconn(node, conn)
+            names.append(conn)
+        self.assertEqual(names, ["a", "b", "a", "b"])
+
+    def test_least_connections(self):
+        router = ReplicaRouter(
+            StubPool("primary"),
+            [StubPool("a"), StubPool("b")],
+            strategy="least_connections",
+        )
+        held = [router.getconn() for _ in range(4)]
+        self.assertEqual(sorted(conn for _, conn in held), ["a", "a", "b", "b"])
+
+    def test_ejected_replica_skipped(self):
+        """
+        Test that a failing replica is ejected, and reads fall back to the
+        primary once no replica is left.
+        """
+        replica = StubPool("a", fail=True)
+        router = ReplicaRouter(StubPool("primary"), [replica], eject_for=60)
+
+        node, conn = router.getconn()
+        self.assertIsNone(node)
+        self.assertEqual(conn, "primary")
+
+        replica.fail = False
+        node, conn = router.getconn()
+        self.assertEqual(conn, "primary")
+
+        stats = router.stats()
+        self.assertEqual(stats["fallbacks"], 2)
+        self.assertEqual(stats["replicas"]["replica_0"]["ejections"], 1)
+        self.assertTrue(stats["replicas"]["replica_0"]["ejected"])
+
+        router.replicas[0].ejected_until = 0.0
+        node, conn = router.getconn()
+        self.assertEqual(conn, "a")
+
+    def test_replica_with_unknown_lag_skipped(self):
+        """
+        Test that a replica that is not streaming from the primary, so its
+        lag is unknown, is skipped like a lagging one.
+        """
+        router = ReplicaRouter(StubPool("primary"), [StubPool("a")], max_lag=10)
+        node = router.replicas[0]
+        node.lag, node.lag_checked_at = None, time.monotonic()
+
+        node, conn = router.getconn()
+        self.assertEqual(conn, "primary")
+
+    def test_saturated_replica_skipped(self):
+        """
+        Test that reads go to the next replica, or the primary, when a
+        replica has no free connection, without ejecting it.
+        """
+        busy = StubPool("a", busy=True)
+        router = ReplicaRouter(StubPool("primary"), [busy, StubPool("b")])
+        self.assertEqual(
+            [router.getconn()[1] for _ in range(2)], ["b", "b"]
+        )
+
+        router = ReplicaRouter(StubPool("primary"), [busy])
+        node, conn = router.getconn()
+        self.assertIsNone(node)
+        self.assertEqual(conn, "primary")
+
+        busy.busy = False
+        node, conn = router.getconn()
+        self.assertEqual(conn, "a")
+        self.assertEqual(router.stats()["replicas"]["replica_0"]["ejections"], 0)
+
+    def test_only_last_replica_waited_on(self):
+        """
+        Test that saturated replicas are passed over without waiting, except
+        for the last one tried.
+        """
+        a, b = StubPool("a", busy=True), StubPool("b", busy=True)
+        router = ReplicaRouter(StubPool("primary"), [a, b])
+        node, conn = router.getconn()
+        self.assertEqual(conn, "primary")
+        self.assertEqual(a.timeouts, [0])
+        self.assertEqual(b.timeouts, [None])
+
+
+class ReplicaDBAPITest(TestBase):
+
+    def test_reads_from_replicas(self):
+        """
+        Test that reads go to a healthy replica within the maximum lag, and
+        an unreachable replica is ejected.
+        """
+        db = DBAPI(
+            self.db_uri,
+            pool_min_size=0,
+            replica_uris=["postgresql://127.0.0.1:1/unreachable", self.db_uri],
+            replica_max_lag=10,
+        )
+        try:
+            for _ in range(3):
+                with db.cursor() as db_cursor:
+                    db_cursor.execute("SELECT 1")
+            stats = db.stats()["db_replicas"]
+        finally:
+            db.close()
+
+        unreachable, healthy = stats["replicas"]["replica_0"], stats["replicas"]["replica_1"]
+        self.assertEqual(unreachable["ejections"], 1)
+        self.assertEqual(healthy["reads"], 3)
+        self.assertEqual(healthy["lag_seconds"], 0)
+        self.assertEqual(stats["fallbacks"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
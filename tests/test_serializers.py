@@ -0,0 +1,129 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import unittest
+from datetime import date
+from decimal import Decimal
+
+from flask import Flask
+
+from ratestask.api import format_rates
+from ratestask.serializers import (
+    ARROW_MIMETYPE,
+    CSV_MIMETYPE,
+    JSON_MIMETYPE,
+    MSGPACK_MIMETYPE,
+    dump_arrow,
+    dump_csv,
+    dump_json,
+    dump_msgpack,
+    msgpack,
+    negotiate_mimetype,
+    pyarrow,
+    rates_columns,
+    stream_csv,
+    stream_json,
+)
+
+
+RATES = [
+    (date(2021, 1, 1), Decimal("1111.91666666")),
+    (date(2021, 1, 2), None),
+    (date(2021, 1, 3), 2000),
+]
+
+
+class SerializersTest(unittest.TestCase):
+
+    def test_json(self):
+        """
+        Test that the JSON serializer matches the per-row formatting, and the
+        streamed JSON is the same.
+        """
+        body = dump_json(*rates_columns(RATES))
+        self.assertEqual(json.loads(body), format_rates(RATES))
+        self.assertEqual(json.loads("".join(stream_json(RATES, chunk_size=2))), format_rates(RATES))
+        self.assertEqual(json.loads(dump_json([], [])), [])
+        self.assertEqual(json.loads("".join(stream_json([]))), [])
+
+    def test_csv(self):
+        expected = (
+            "day,average_price\r\n"
+            "2021-01-01,1111.917\r\n"
+            "2021-01-02,\r\n"
+            "2021-01-03,2000.0\r\n"
+        )
+        self.assertEqual(dump_csv(*rates_columns(RATES)), expected)
+        self.assertEqual("".join(stream_csv(RATES, chunk_size=2)), expected)
+
+    def test_stats(self):
+        """
+        Test that stats columns follow the day, in the requested order.
+        """
+        rates = [(day, price, price, None) for day, price in RATES]
+        columns = rates_columns(rates, ("p90", "median"))
+        self.assertEqual(
+            json.loads(dump_json(*columns))[0],
+            {"average_price": 1111.917, "day": "2021-01-01", "p90": 1111.917, "median": None}
+        )
+        self.assertEqual(
+            dump_csv(*columns).splitlines()[:2],
+            ["day,average_price,p90,median", "2021-01-01,1111.917,1111.917,"]
+        )
+        self.assertEqual(
+            "".join(stream_csv(rates, chunk_size=2, stats=("p90", "median"))),
+            dump_csv(*columns)
+        )
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    def test_msgpack(self):
+        body = dump_msgpack(*rates_columns(RATES))
+        self.assertEqual(
+            msgpack.unpackb(body, raw=False),
+            {
+                "day": ["2021-01-01", "2021-01-02", "2021-01-03"],
+                "average_price": [1111.917, None, 2000.0],
+            }
+        )
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_arrow(self):
+        body = dump_arrow(*rates_columns(RATES))
+        table = pyarrow.ipc.open_stream(body).read_all()
+        self.assertEqual(table.column_names, ["day", "average_price"])
+        self.assertEqual(
+            table.to_pydict(),
+            {
+                "day": [date(2021, 1, 1), date(2021, 1, 2), date(2021, 1, 3)],
+                "average_price": [1111.917, None, 2000.0],
+            }
+        )
+
+
+class NegotiationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+
+    def negotiate(self, accept=None):
+        headers = {"Accept": accept} if accept is not None else {}
+        with self.app.test_request_context(headers=headers):
+            return negotiate_mimetype()
+
+    def test_negotiate_mimetype(self):
+        self.assertEqual(self.negotiate(), JSON_MIMETYPE)
+        self.assertEqual(self.negotiate("*/*"), JSON_MIMETYPE)
+        self.assertEqual(self.negotiate("text/csv"), CSV_MIMETYPE)
+        self.assertEqual(self.negotiate("text/csv;q=0.5, application/json"), JSON_MIMETYPE)
+        self.assertIsNone(self.negotiate("image/png"))
+        if msgpack is not None:
+            self.assertEqual(self.negotiate(MSGPACK_MIMETYPE), MSGPACK_MIMETYPE)
+        if pyarrow is not None:
+            self.assertEqual(self.negotiate(ARROW_MIMETYPE), ARROW_MIMETYPE)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import threading
+import time
+import unittest
+
+from ratestask.singleflight import SingleFlight
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def run_concurrently(self, singleflight, key, func, callers=5):
+        results = []
+        errors = []
+
+        def call():
+            try:
+                results.append(singleflight.do(key, func))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        return threads, results, errors
+
+    def wait_for_waiters(self, singleflight, waiters):
+        deadline = time.monotonic() + 5
+        while singleflight.stats()["coalesced"] < waiters:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.001)
+
+    def test_concurrent_calls_coalesced(self):
+        """
+        Test that concurrent calls with the same key run the function once
+        and all get its result, and later calls run it again.
+        """
+        singleflight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def func():
+            calls.append(1)
+            release.wait(5)
+            return ["rates"]
+
+        threads, results, errors = self.run_concurrently(singleflight, "key", func)
+        self.wait_for_waiters(singleflight, 4)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [["rates"]] * 5)
+        self.assertEqual(errors, [])
+        self.assertEqual(
+            singleflight.stats(),
+            {"executions": 1, "coalesced": 4, "in_flight": 0}
+        )
+
+        self.assertEqual(singleflight.do("key", lambda: "again"), "again")
+
+    def test_error_shared(self):
+        """
+        Test that callers waiting on a failing call get its exception.
+        """
+        singleflight = SingleFlight()
+        release = threading.Event()
+
+        def func():
+            release.wait(5)
+            raise ValueError("query failed")
+
+        threads, results, errors = self.run_concurrently(singleflight, "key", func, callers=3)
+        self.wait_for_waiters(singleflight, 2)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [])
+        self.assertEqual(len(errors), 3)
+        self.assertTrue(all(isinstance(e, ValueError) for e in errors))
+
+    def test_different_keys(self):
+        singleflight = SingleFlight()
+        self.assertEqual(singleflight.do("a", lambda: 1), 1)
+        self.assertEqual(singleflight.do("b", lambda: 2), 2)
+        self.assertEqual(singleflight.stats()["executions"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import random
+import unittest
+from collections import Counter
+from datetime import date
+
+from ratestask.sketches import (
+    RELATIVE_ACCURACY,
+    bucket_value,
+    price_bucket,
+    quantiles,
+    stat_quantile,
+    with_quantiles,
+)
+
+
+def sketch(prices):
+    counts = Counter(price_bucket(price) for price in prices)
+    buckets = sorted(counts)
+    return buckets, [counts[bucket] for bucket in buckets]
+
+
+class SketchesTest(unittest.TestCase):
+
+    def test_bucket_value_accuracy(self):
+        """
+        Test that every price is estimated within the relative accuracy by
+        the value of its bucket.
+        """
+        self.assertEqual(price_bucket(0), 0)
+        self.assertEqual(bucket_value(0), 0.0)
+        for price in [1, 2, 99, 100, 101, 1234, 99999]:
+            estimate = bucket_value(price_bucket(price))
+            self.assertLessEqual(
+                abs(estimate - price), price * RELATIVE_ACCURACY + 1e-9
+            )
+
+    def test_quantiles(self):
+        """
+        Test that quantiles of a sketch are within the relative accuracy of
+        the exact ones.
+        """
+        prices = [random.Random(0).randint(500, 5000) for _ in range(1001)]
+        prices.sort()
+        buckets, counts = sketch(prices)
+        estimates = quantiles(buckets, counts, [0.1, 0.5, 0.9])
+        for q, estimate in zip([0.1, 0.5, 0.9], estimates):
+            exact = prices[int(q * (len(prices) - 1))]
+            self.assertLessEqual(abs(estimate - exact), exact * RELATIVE_ACCURACY)
+
+    def test_stat_quantile(self):
+        self.assertEqual(stat_quantile("median"), 0.5)
+        self.assertEqual(stat_quantile("p90"), 0.9)
+        for name in ["p0", "p100", "p05", "avg"]:
+            with self.assertRaises(ValueError):
+                stat_quantile(name)
+
+    def test_with_quantiles(self):
+        """
+        Test that quantiles are appended per day, and are None for days with
+        less than min_price_count prices.
+        """
+        buckets, counts = sketch([1000, 2000, 3000])
+        bucket_rows = [
+            (date(2021, 1, 1), bucket, count)
+            for bucket, count in zip(buckets, counts)
+        ] + [(date(2021, 1, 2), price_bucket(1000), 1)]
+        rates = with_quantiles(
+            [(date(2021, 1, 1), 2000), (date(2021, 1, 2), None)],
+            bucket_rows,
+            [0.5],
+        )
+        self.assertEqual(rates[0][:2], (date(2021, 1, 1), 2000))
+        self.assertAlmostEqual(rates[0][2], 2000, delta=2000 * RELATIVE_ACCURACY)
+        self.assertEqual(rates[1], (date(2021, 1, 2), None, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,193 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import shutil
+import struct
+import tempfile
+import unittest
+from datetime import date
+
+import numpy as np
+
+from tests.test_base import TestBase
+from tests.test_columnar import build_columns
+from ratestask.columnar import ColumnarDBAPI
+from ratestask.snapshot import (
+    SnapshotError,
+    export_snapshot,
+    load_snapshot,
+    write_snapshot,
+)
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "rates.snap")
+        self.regions = [
+            ("china_east_main", None),
+            ("northern_europe", None),
+            ("uk_sub", "northern_europe"),
+        ]
+        self.ports = [
+            ("CNNBO", "china_east_main"),
+            ("CNSGH", "china_east_main"),
+            ("GBLON", "uk_sub"),
+            ("GBMNC", "uk_sub"),
+        ]
+        self.rates = [
+            {"day": "2021-01-02", "price": 5000, "orig_code": "CNNBO", "dest_code": "GBLON"},
+            {"day": "2021-01-01", "price": 1000, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-01", "price": 3000, "orig_code": "CNNBO", "dest_code": "GBMNC"},
+            {"day": "2021-01-01", "price": 2000, "orig_code": "CNSGH", "dest_code": "GBLON"},
+            {"day": "2021-01-02", "price": 3000, "orig_code": "CNNBO", "dest_code": "GBMNC"},
+            {"day": "2021-01-09", "price": 4000, "orig_code": "CNSGH", "dest_code": "GBLON"},
+        ]
+        self.columns = build_columns(
+            [code for code, _ in self.ports], self.rates
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_round_trip(self):
+        """
+        Test that a loaded snapshot holds the same (read-only, memory-mapped)
+        columns and hierarchy and answers the same rates.
+        """
+        write_snapshot(self.path, self.columns, self.regions, self.ports)
+        snapshot = load_snapshot(self.path)
+
+        self.assertEqual(snapshot.regions, self.regions)
+        self.assertEqual(snapshot.ports, self.ports)
+        self.assertEqual(snapshot.columns.port_codes, self.columns.port_codes)
+        for name in ("orig", "dest", "day", "price", "bucket", "lanes", "lane_offsets"):
+            array = getattr(snapshot.columns, name)
+            np.testing.assert_array_equal(array, getattr(self.columns, name))
+            self.assertFalse(array.flags.writeable, name)
+
+        args = (
+            date(2021, 1, 1),
+            date(2021, 1, 31),
+            {"CNNBO", "CNSGH"},
+            {"GBLON", "GBMNC"},
+        )
+        kwargs = dict(min_price_count=1, granularity="week", stats=("median",))
+        self.assertEqual(
+            snapshot.columns.avg_rates(*args, **kwargs),
+            self.columns.avg_rates(*args, **kwargs),
+        )
+
+    def test_empty(self):
+        columns = build_columns([], [])
+        write_snapshot(self.path, columns, [], [])
+        snapshot = load_snapshot(self.path)
+        self.assertEqual(len(snapshot.columns), 0)
+        self.assertEqual(
+            snapshot.columns.avg_rates(date(2021, 1, 1), date(2021, 1, 2), {"A"}, {"B"}),
+            [],
+        )
+
+    def test_invalid_files(self):
+        """
+        Test that files of another format or version, or cut short, are
+        rejected.
+        """
+        write_snapshot(self.path, self.columns, self.regions, self.ports)
+        with open(self.path, "rb") as f:
+            data = f.read()
+
+        invalid = {
+            "empty": b"",
+            "magic": b"NOTASNAP" + data[8:],
+            "version": data[:8] + struct.pack("<I", 99) + data[12:],
+            "truncated": data[:-64],
+        }
+        for name, content in invalid.items():
+            with open(self.path, "wb") as f:
+                f.write(content)
+            with self.assertRaises(SnapshotError, msg=name):
+                load_snapshot(self.path)
+
+    def test_columnar_backend_from_snapshot(self):
+        """
+        Test that the columnar backend answers from a snapshot without
+        connecting to the DB, resolving regions through its hierarchy.
+        """
+        write_snapshot(self.path, self.columns, self.regions, self.ports)
+        db = ColumnarDBAPI(None, snapshot_path=self.path)
+        db.warm_up()
+
+        rates = db.fetch_avg_rates(
+            date(2021, 1, 1),
+            date(2021, 1, 2),
+            "china_east_main",
+            "northern_europe",
+            min_price_count=1,
+        )
+        self.assertEqual(
+            rates,
+            [(date(2021, 1, 1), 2000.0), (date(2021, 1, 2), 4000.0)],
+        )
+        self.assertEqual(db.stats()["columnar"]["rows"], len(self.rates))
+        self.assertEqual(db.pool_stats()["opened"], 0)
+
+
+class SnapshotExportTest(TestBase):
+
+    def test_export_snapshot(self):
+        """
+        Test that an exported snapshot serves the same rates as the DB.
+        """
+        test_regions = [
+            {"slug": "northern_europe", "name": "Northern Europe", "parent_slug": None},
+            {"slug": "baltic", "name": "Baltic", "parent_slug": "northern_europe"},
+            {"slug": "china_east_main", "name": "China East Main", "parent_slug": None},
+        ]
+        test_ports = [
+            {"code": "CNNBO", "name": "Ningbo", "parent_slug": "china_east_main"},
+            {"code": "FIIMA", "name": "Imatra", "parent_slug": "baltic"},
+        ]
+        test_rates = [
+            {"day": "2021-01-01", "price": 1000, "orig_code": "CNNBO", "dest_code": "FIIMA"},
+            {"day": "2021-01-01", "price": 3000, "orig_code": "CNNBO", "dest_code": "FIIMA"},
+            {"day": "2021-01-02", "price": 2000, "orig_code": "CNNBO", "dest_code": "FIIMA"},
+        ]
+
+        db_cursor = self.get_db_cursor()
+        self.create_db_entries(db_cursor, table_name="regions", data_dicts=test_regions)
+        self.create_db_entries(db_cursor, table_name="ports", data_dicts=test_ports)
+        self.create_db_entries(db_cursor, table_name="prices", data_dicts=test_rates)
+
+        tmp_dir = tempfile.mkdtemp()
+        path = os.path.join(tmp_dir, "rates.snap")
+        db_conn = self.db.get_db_conn()
+        try:
+            self.assertEqual(export_snapshot(db_conn, path), len(test_rates))
+            columnar_db = ColumnarDBAPI(None, snapshot_path=path)
+            rates = columnar_db.fetch_avg_rates(
+                date(2021, 1, 1), date(2021, 1, 2), "china_east_main", "northern_europe",
+                min_price_count=1,
+            )
+        finally:
+            db_conn.close()
+            shutil.rmtree(tmp_dir)
+
+        db_rates = self.db.get_avg_rates(
+            db_cursor,
+            start_date=date(2021, 1, 1),
+            end_date=date(2021, 1, 2),
+            origin="china_east_main",
+            destination="northern_europe",
+            min_price_count=1,
+        )
+        self.assertEqual(
+            rates, [(day, float(avg)) for day, avg in db_rates]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()